@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# This script builds the annotation matrices of the loci, in place of one intersectBed run per annotation and locus
+# followed by paste and awk.
+# Each annotation bed file listed in the annotations file is read once, its intervals are sorted and merged per
+# chromosome, and the overlap of all the snps of all the loci is found with searchsorted on these intervals.
+# For each locus bed file BED (chr, pos, pos+1 as written by locus_annotations.py) it writes
+# BED.coord.over.allannots.txt: a header with the annotation ids, then one row per snp (in the bed order, repeated
+# positions being reported once) with a 0/1 value per annotation, 1 meaning the snp falls in the annotation.
+# With --index DIR, the merged intervals are read from a memory-mappable index shared across runs (built with
+# --build_index, or on first use): each annotation bed file is stored once under the sha256 of its content, so an
+# entry is never used once its source bed file has changed.
+
+
+# IMPORTS --------------------------------------------------------------------
+import pandas as pd
+import numpy as np
+import time
+import os
+import json
+import fcntl
+import hashlib
+from optparse import OptionParser
+# ----------------------------------------------------------------------------
+
+
+# version of the annotation index layout, entries of other versions are ignored
+INDEX_VERSION = 1
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def ReadAnnotationsList(annotations : str) -> "list[tuple]" :
+    """
+    returns the list of (annotation id, bed file) of the annotations file, in the file order
+    """
+    with open(annotations) as f:
+        return [tuple(line.split()[:2]) for line in f if line.strip()]
+
+
+def MergeIntervals(starts : np.ndarray, ends : np.ndarray) -> tuple :
+    """
+    returns the (starts, ends) arrays of the union of the intervals, sorted and non overlapping
+    """
+    order = np.argsort(starts, kind='stable')
+    starts,ends = starts[order],np.maximum.accumulate(ends[order])
+    # a new merged interval begins where the start is after the end of all the previous intervals
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > ends[:-1]
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(starts)) - 1
+
+    return starts[first], ends[last]
+
+
+def ReadBedIntervals(bed : str) -> dict :
+    """
+    returns the dictionary chromosome -> (starts, ends) of the merged intervals of a bed file (track/browser lines are skipped)
+    """
+    intervals = pd.read_csv(bed, sep='\t', header=None, usecols=[0,1,2], names=['chr','start','end'], dtype=str, comment='#')
+    intervals['start'] = pd.to_numeric(intervals['start'], errors='coerce')
+    intervals['end'] = pd.to_numeric(intervals['end'], errors='coerce')
+    intervals = intervals.dropna()
+
+    return {chr : MergeIntervals(i['start'].to_numpy(np.int64), i['end'].to_numpy(np.int64)) for chr,i in intervals.groupby('chr')}
+
+
+def ReadSources(sources_file : str) -> dict :
+    """
+    returns the remembered checksums of sources.json (see FileChecksum), empty when there is none yet
+    """
+    if not os.path.isfile(sources_file):
+        return {}
+    with open(sources_file) as f:
+        return json.load(f)
+
+
+def FileChecksum(file : str, index_dir : str) -> str :
+    """
+    returns the sha256 of a file; checksums are remembered in index_dir/sources.json with the size and modification
+    time of the file, so that only new or modified files are read again
+    sources.json is only updated under a lock (read again under it, as the tasks sharing the index write it too)
+    """
+    sources_file = os.path.join(index_dir, "sources.json")
+    stat = os.stat(file)
+    key = os.path.realpath(file)
+    entry = ReadSources(sources_file).get(key)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+        return entry['sha256']
+
+    checksum = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            checksum.update(block)
+    entry = {'size' : stat.st_size, 'mtime' : stat.st_mtime, 'sha256' : checksum.hexdigest()}
+    with open(f"{sources_file}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        sources = ReadSources(sources_file)
+        sources[key] = entry
+        with open(f"{sources_file}.tmp{os.getpid()}", 'w') as f:
+            json.dump(sources, f)
+        os.replace(f"{sources_file}.tmp{os.getpid()}", sources_file)
+
+    return entry['sha256']
+
+
+def BuildIndexEntry(bed : str, prefix : str) -> None :
+    """
+    writes the merged intervals of a bed file: prefix.starts.npy and prefix.ends.npy (all chromosomes one after
+    the other) and prefix.json (chromosome -> [first, last+1] rows), written last to mark the entry as complete
+    """
+    intervals = ReadBedIntervals(bed)
+    chroms = {}
+    offset = 0
+    for chr,(starts,ends) in intervals.items():
+        chroms[chr] = [offset, offset + len(starts)]
+        offset += len(starts)
+    tmp = f"{prefix}.tmp{os.getpid()}"
+    np.save(f"{tmp}.starts.npy", np.concatenate([i[0] for i in intervals.values()]) if intervals else np.zeros(0, dtype=np.int64))
+    np.save(f"{tmp}.ends.npy", np.concatenate([i[1] for i in intervals.values()]) if intervals else np.zeros(0, dtype=np.int64))
+    os.replace(f"{tmp}.starts.npy", f"{prefix}.starts.npy")
+    os.replace(f"{tmp}.ends.npy", f"{prefix}.ends.npy")
+    with open(f"{tmp}.json", 'w') as f:
+        json.dump({'source' : os.path.realpath(bed), 'chroms' : chroms}, f)
+    os.replace(f"{tmp}.json", f"{prefix}.json")
+
+    return None
+
+
+def IndexedIntervals(bed : str, index_dir : str) -> dict :
+    """
+    returns the dictionary chromosome -> (starts, ends) of the merged intervals of a bed file, memory-mapped from
+    the index (the entry is built if the index has no entry for the current content of the file)
+    """
+    version_dir = os.path.join(index_dir, f"v{INDEX_VERSION}")
+    os.makedirs(version_dir, exist_ok=True)
+    prefix = os.path.join(version_dir, FileChecksum(bed, version_dir))
+    if not os.path.isfile(f"{prefix}.json"):
+        BuildIndexEntry(bed, prefix)
+
+    with open(f"{prefix}.json") as f:
+        chroms = json.load(f)['chroms']
+    starts = np.load(f"{prefix}.starts.npy", mmap_mode='r')
+    ends = np.load(f"{prefix}.ends.npy", mmap_mode='r')
+
+    return {chr : (starts[lo:hi], ends[lo:hi]) for chr,(lo,hi) in chroms.items()}
+
+
+def BuildAnnotationIndex(annotations : "list[tuple]", annotations_file : str, index_dir : str) -> str :
+    """
+    makes sure every annotation of the list has an up to date entry in the index, and writes the manifest of the
+    annotation set: the annotation ids in the annotations file order with the checksum of their bed file
+    """
+    version_dir = os.path.join(index_dir, f"v{INDEX_VERSION}")
+    entries = []
+    for annid,annfile in annotations:
+        start_time = time.time()
+        IndexedIntervals(annfile, index_dir)
+        entries.append({'id' : annid, 'bed' : annfile, 'sha256' : FileChecksum(annfile, version_dir)})
+        print(f"--- annotation {annid} indexed in %s seconds ---" % (time.time() - start_time))
+
+    manifest = os.path.join(version_dir, f"{os.path.basename(annotations_file)}.manifest.json")
+    with open(manifest, 'w') as f:
+        json.dump({'version' : INDEX_VERSION, 'annotations' : entries}, f, indent=1)
+
+    return manifest
+
+
+def Overlaps(intervals : tuple, positions : np.ndarray) -> np.ndarray :
+    """
+    returns the boolean array telling which of the 1 bp bed intervals [pos, pos+1) overlap the merged intervals
+    """
+    starts,ends = intervals
+    k = np.searchsorted(starts, positions, side='right') - 1
+
+    return (k >= 0) & (positions < ends[np.maximum(k, 0)])
+
+
+def ReadLocusBed(bed : str) -> pd.DataFrame :
+    """
+    reads the snps (chr, pos) of a locus bed file, repeated positions being kept once
+    """
+    locus = pd.read_csv(bed, sep='\t', header=None, usecols=[0,1], names=['chr','pos'], dtype={'chr' : str, 'pos' : np.int64})
+
+    return locus.drop_duplicates().reset_index(drop=True)
+
+
+def AnnotationMatrices(loci : "list[pd.DataFrame]", annotations : "list[tuple]", index_dir : str = None) -> "list[np.ndarray]" :
+    """
+    returns, for each locus, the (snps x annotations) 0/1 matrix of overlaps
+    each annotation bed file (or its index entry) is read once and queried with the snps of all the loci of each chromosome at once
+    """
+    all_snps = pd.concat(loci, ignore_index=True)
+    bounds = np.cumsum([0] + [len(l) for l in loci])
+    matrix = np.zeros((len(all_snps), len(annotations)), dtype=np.int8)
+    by_chr = all_snps.groupby('chr').indices
+
+    for j,(annid,annfile) in enumerate(annotations):
+        start_time = time.time()
+        intervals = ReadBedIntervals(annfile) if index_dir is None else IndexedIntervals(annfile, index_dir)
+        for chr,rows in by_chr.items():
+            if chr in intervals:
+                matrix[rows, j] = Overlaps(intervals[chr], all_snps['pos'].to_numpy()[rows])
+        print(f"--- annotation {annid} done in %s seconds ---" % (time.time() - start_time))
+
+    return [matrix[bounds[i]:bounds[i+1]] for i in range(len(loci))]
+
+
+def WriteAnnotationMatrix(matrix : np.ndarray, annotations : "list[tuple]", out_file : str) -> None :
+    """
+    writes an annotation matrix with the header of annotation ids (space separated, as PAINTOR expects it)
+    """
+    header = "".join(f"{annid} " for annid,_ in annotations)
+    np.savetxt(out_file, matrix, fmt='%d', delimiter=' ', header=header, comments='')
+
+    return None
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog [options] locus1.bed locus2.bed ...")
+    parser.add_option("-a", "--annotations", dest="annotations", default="annotations.txt")             #File with the id and the bed file of each annotation
+    parser.add_option("--od", "--outdir", dest="outdir", default=".")                                   #Output directory
+    parser.add_option("-i", "--index", dest="index_dir", default=None)                                  #Directory of the annotation index shared across runs (bed files are read directly by default)
+    parser.add_option("--build_index", dest="build_index", action="store_true", default=False)          #Only build the index of the annotations (no locus bed file needed)
+    (options, args) = parser.parse_args()
+
+    debut = time.time()
+
+    annotations = ReadAnnotationsList(options.annotations)
+
+    if options.build_index:
+        if options.index_dir is None:
+            parser.error("--build_index needs --index")
+        print(f"Manifest written in {BuildAnnotationIndex(annotations, options.annotations, options.index_dir)}")
+        print("\n~~~~~ annotations_merge finished in %s seconds ~~~~~\n" % (time.time() - debut))
+        return 0
+
+    if len(args) == 0:
+        parser.error("no locus bed file given")
+
+    loci = [ReadLocusBed(bed) for bed in args]
+    print(f"{len(loci)} loci ({sum(len(l) for l in loci)} SNPs) and {len(annotations)} annotations\n")
+
+    for bed,matrix in zip(args, AnnotationMatrices(loci, annotations, options.index_dir)):
+        WriteAnnotationMatrix(matrix, annotations, os.path.join(options.outdir, f"{os.path.basename(bed)}.coord.over.allannots.txt"))
+
+    print("\n~~~~~ annotations_merge finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
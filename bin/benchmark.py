@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+
+# This script benchmarks the python stages of the pipeline on synthetic data of increasing size.
+# For each GWAS size (number of snps) it generates, in a working directory:
+#   gwas.txt                a GWAS file with the columns of CAD_META (Chr BP Allele1 Allele2 Effect StdErr Pvalue rsID),
+#                           snps spread over the 22 autosomes in proportion to their hg19 length, a fraction of them
+#                           (--lead_density) being lead snps (pvalue below 5e-08)
+#   panel/                  one bgzipped and indexed VCF per chromosome with the snps of the loci (haplotypes copied
+#                           from the previous snp with some probability, so that neighbouring snps are in LD), with
+#                           ldFile.txt and mapFile.txt
+#   annotations/            --annotations bed files of random intervals, listed in annotations.txt
+# and times the stages, each one in a new process so that its peak memory is its own:
+#   split                   ChromosomeSplitter (or StreamingChromosomeSplitter with --chunksize), ZscoreColumns, LocusList and printLocus of main_V2.py
+#   ld                      ld_calculation.py ProcessChromosome (reading the VCFs, LD matrices and filtering of the repeated positions)
+#   annotations             annotations_merge.py AnnotationMatrices on the bed files of the loci
+#   statistics              results_statistics.py ResultsStatistics on PAINTOR-like results (random posterior probabilities)
+# The results (seconds, throughput in snps per second, peak RSS) are written as JSON. With --baseline, they are compared
+# with a former JSON file: a stage slower or bigger than the baseline by more than --tolerance is reported as a
+# regression, and the script exits with status 1. A stage that fails is recorded with its error (the traceback,
+# also in its log file), the stages depending on it are not timed, and the script exits with status 1 as well.
+#   benchmark.py --sizes 1e5,1e6 -o bench.json
+#   benchmark.py --sizes 1e5,1e6 --baseline bench.json -o bench.new.json
+
+
+# IMPORTS --------------------------------------------------------------------
+import pandas as pd
+import numpy as np
+import multiprocessing
+import platform
+import resource
+import tempfile
+import traceback
+import shutil
+import json
+import time
+import glob
+import sys
+import os
+from optparse import OptionParser
+from queue import Empty
+try:
+    import pysam
+except ImportError:
+    pysam = None
+# ----------------------------------------------------------------------------
+
+
+# length of the hg19 autosomes, the snps are spread over them in proportion
+CHR_LENGTHS = (249250621, 243199373, 198022430, 191154276, 180915260, 171115067, 159138663, 146364022, 141213431, 135534747, 135006516,
+               133851895, 115169878, 107349540, 102531392, 90354753, 81195210, 78077248, 59128983, 63025520, 48129895, 51304566)
+
+# number of GWAS lines generated at once
+WRITE_CHUNK = 1000000
+
+STAGES = ("split", "ld", "annotations", "statistics")
+
+# GWAS columns, as named in CAD_META
+GWAS_COLUMNS = {'chr' : 'Chr', 'pos' : 'BP', 'a1' : 'Allele1', 'a2' : 'Allele2', 'effect' : 'Effect', 'stderr' : 'StdErr',
+                'pvalue' : 'Pvalue', 'rsid' : 'rsID', 'zscore' : 'Zscore'}
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def GenerateGWAS(gwas_file : str, nb_snp : int, lead_density : float, seed : int = 1) -> None :
+    """
+    writes a synthetic GWAS of nb_snp snps (see the top of this file), WRITE_CHUNK lines at a time
+    """
+    rng = np.random.default_rng(seed)
+    lengths = np.array(CHR_LENGTHS, dtype=np.int64)
+    per_chr = np.diff(np.round(np.cumsum(np.append(0, lengths)) / lengths.sum() * nb_snp).astype(np.int64))
+    alleles = np.array(['a', 'c', 'g', 't'])
+    c = GWAS_COLUMNS
+    first = True
+    for chr,(length,n) in enumerate(zip(lengths, per_chr), start=1):
+        for done in range(0, n, WRITE_CHUNK):
+            k = min(WRITE_CHUNK, n - done)
+            # positions of the chunk within its share of the chromosome, so that the file is sorted by position
+            lo,hi = length * done // n, length * (done + k) // n
+            pos = np.sort(rng.integers(lo, max(hi, lo + 1), size=k)) + 1
+            a1 = rng.integers(0, 4, size=k)
+            a2 = (a1 + rng.integers(1, 4, size=k)) % 4
+            stderr = rng.uniform(0.005, 0.02, size=k)
+            pvalue = rng.uniform(0, 1, size=k)
+            leads = rng.uniform(size=k) < lead_density
+            pvalue[leads] = 10 ** -rng.uniform(8, 20, size=leads.sum())
+            effect = rng.normal(0, 1, size=k) * stderr
+            effect[leads] = np.sign(effect[leads]) * stderr[leads] * rng.uniform(5.5, 9, size=leads.sum())
+            chunk = pd.DataFrame({c['chr'] : chr, c['pos'] : pos, c['a1'] : alleles[a1], c['a2'] : alleles[a2],
+                                  c['effect'] : np.round(effect, 4), c['stderr'] : np.round(stderr, 4),
+                                  c['pvalue'] : pvalue, c['rsid'] : [f"rs{chr}{done + j}" for j in range(k)]})
+            chunk.to_csv(gwas_file, sep='\t', index=False, header=first, mode='w' if first else 'a', float_format='%.4g')
+            first = False
+
+    return None
+
+
+def IndexVcf(vcf : str) -> str :
+    """
+    bgzips and tabix indexes a vcf file, returns the name of the compressed file
+    """
+    if pysam is not None:
+        return pysam.tabix_index(vcf, preset='vcf', force=True)
+
+    if os.system(f"bgzip -f {vcf} && tabix -f -p vcf {vcf}.gz") != 0:
+        raise IOError(f"{vcf}: bgzip or tabix indexing failed")
+    return f"{vcf}.gz"
+
+
+def GeneratePanel(locus_files : "list[str]", panel_dir : str, nb_sample : int, seed : int = 1, copy : float = 0.8) -> tuple :
+    """
+    writes a synthetic reference panel with the snps of the locus files: one indexed vcf per chromosome, where each
+    haplotype copies the allele of the previous snp with probability copy; returns the (ldFile.txt, mapFile.txt) files
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(panel_dir, exist_ok=True)
+    samples = [f"SYN{i:05d}" for i in range(nb_sample)]
+    map_file = os.path.join(panel_dir, "mapFile.txt")
+    pd.DataFrame({'sample' : samples, 'pop' : 'SYN', 'super_pop' : 'EUR', 'gender' : 'female'}).to_csv(map_file, sep='\t', index=False)
+
+    c = GWAS_COLUMNS
+    snps = pd.concat([pd.read_csv(f, sep=' ', usecols=[c['chr'], c['pos'], c['a1'], c['a2']]) for f in locus_files])
+    snps = snps.drop_duplicates([c['chr'], c['pos']]).sort_values([c['chr'], c['pos']])
+    ld_files = {}
+    header = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" + "\t".join(samples) + "\n"
+    for chr,chr_snps in snps.groupby(c['chr']):
+        vcf = os.path.join(panel_dir, f"chr{chr}.vcf")
+        haplotypes = rng.integers(0, 2, size=2 * nb_sample, dtype=np.int8)
+        with open(vcf, 'w') as f:
+            f.write(header)
+            for p,a1,a2 in zip(chr_snps[c['pos']], chr_snps[c['a1']], chr_snps[c['a2']]):
+                frequency = rng.uniform(0.05, 0.5)
+                new = (rng.uniform(size=2 * nb_sample) < frequency).astype(np.int8)
+                haplotypes = np.where(rng.uniform(size=2 * nb_sample) < copy, haplotypes, new)
+                gt = "\t".join(f"{h[0]}|{h[1]}" for h in haplotypes.reshape(-1, 2))
+                f.write(f"{chr}\t{p}\t.\t{a2.upper()}\t{a1.upper()}\t.\tPASS\t.\tGT\t{gt}\n")
+        ld_files[chr] = IndexVcf(vcf)
+
+    ld_file = os.path.join(panel_dir, "ldFile.txt")
+    with open(ld_file, 'w') as f:
+        f.writelines(f"{chr}\t{vcf}\n" for chr,vcf in ld_files.items())
+
+    return ld_file, map_file
+
+
+def GenerateAnnotations(annotation_dir : str, nb_annotation : int, nb_interval : int, seed : int = 1) -> str :
+    """
+    writes nb_annotation bed files of nb_interval random intervals (50 bp to 5 kb, ucsc chromosome names) and the
+    annotations.txt file listing them, returns the annotations.txt file
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(annotation_dir, exist_ok=True)
+    lengths = np.array(CHR_LENGTHS, dtype=np.int64)
+    annotations_file = os.path.join(annotation_dir, "annotations.txt")
+    with open(annotations_file, 'w') as f:
+        for a in range(nb_annotation):
+            bed = os.path.join(annotation_dir, f"annotation{a}.bed")
+            chr = rng.choice(len(lengths), size=nb_interval, p=lengths / lengths.sum())
+            start = (rng.uniform(size=nb_interval) * lengths[chr]).astype(np.int64)
+            pd.DataFrame({'chr' : [f"chr{i + 1}" for i in chr], 'start' : start,
+                          'end' : start + rng.integers(50, 5000, size=nb_interval)}).to_csv(bed, sep='\t', index=False, header=False)
+            f.write(f"annotation{a}\t{bed}\n")
+
+    return annotations_file
+
+
+def WriteLocusBeds(processed_files : "list[str]") -> "list[str]" :
+    """
+    writes the bed file of each LOCUS.ld_out.processed.filtered file, as the former ANNOTATIONS_bedfiles task did, returns their names
+    """
+    c = GWAS_COLUMNS
+    beds = []
+    for f in processed_files:
+        locus = pd.read_csv(f, sep=' ', usecols=[c['chr'], c['pos']])
+        beds.append(f"{f}.ucsc.bed")
+        pd.DataFrame({'chr' : "chr" + locus[c['chr']].astype(str), 'start' : locus[c['pos']],
+                      'end' : locus[c['pos']] + 1}).to_csv(beds[-1], sep='\t', index=False, header=False)
+
+    return beds
+
+
+def WriteResults(processed_files : "list[str]", annotations_file : str, outdir : str, seed : int = 1) -> "list[str]" :
+    """
+    writes PAINTOR-like outputs: LOCUS.results (the processed snps with a random Posterior_Prob column) and
+    Enrichment.Values, returns the results files
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(outdir, exist_ok=True)
+    results = []
+    for f in processed_files:
+        locus = pd.read_csv(f, sep=' ', dtype=str, keep_default_na=False)
+        locus['Posterior_Prob'] = ["%.5e" % p for p in rng.dirichlet(np.full(len(locus), 0.1))] if len(locus) else []
+        results.append(os.path.join(outdir, f"{os.path.basename(f).split('.')[0]}.results"))
+        locus.to_csv(results[-1], sep=' ', index=False)
+
+    with open(annotations_file) as f:
+        names = [line.split()[0] for line in f if line.strip()]
+    with open(os.path.join(outdir, "Enrichment.Values"), 'w') as f:
+        f.write(" ".join(["Baseline"] + names) + "\n")
+        f.write(" ".join("%g" % v for v in rng.normal(0, 1, size=len(names) + 1)) + "\n")
+
+    return results
+
+
+def CountSnps(files : "list[str]") -> int :
+    """
+    returns the number of snps of files with a header line
+    """
+    nb_snp = 0
+    for f in files:
+        with open(f) as fh:
+            nb_snp += max(sum(1 for _ in fh) - 1, 0)
+
+    return nb_snp
+
+
+def StageSplit(gwas : str, outdir : str, kb, chunksize : int) -> None :
+    """
+    splits the GWAS into loci as main_V2.py does (in a single process)
+    """
+    from main_V2 import ChromosomeSplitter, StreamingChromosomeSplitter, ZscoreColumns, LocusList, printLocus
+    c = GWAS_COLUMNS
+    if chunksize > 0:
+        dtypes = {c['chr'] : 'int8', c['pos'] : 'int32', c['a1'] : 'category', c['a2'] : 'category',
+                  c['effect'] : 'float32', c['stderr'] : 'float32', c['pvalue'] : 'float64', c['rsid'] : 'object'}
+        chr_list = StreamingChromosomeSplitter(gwas, '\t', c['chr'], dtypes, chunksize)
+    else:
+        chr_list = ChromosomeSplitter(gwas, '\t', c['chr'])
+    columns = [c['chr'], c['pos'], c['a1'], c['a2'], c['effect'], c['stderr'], c['pvalue'], c['rsid']]
+    for i,chromosome in chr_list:
+        chromosome = ZscoreColumns(chromosome, columns, c['zscore'], c['effect'], c['stderr'])
+        printLocus(LocusList((i, chromosome), c['pvalue'], c['pos'], kb, 5e-08, 1), outdir, c['pos'], c['pvalue'])
+
+    return None
+
+
+def StageLD(locus_files : "list[str]", ld_file : str, map_file : str, max_snps : int) -> None :
+    """
+    computes the LD matrices of the loci as ld_calculation.py does (one chromosome after the other)
+    """
+    from ld_calculation import ReadLdFile, ReadPopulationSamples, ProcessChromosome
+    c = GWAS_COLUMNS
+    ld_files = ReadLdFile(ld_file)
+    samples = ReadPopulationSamples(map_file, 'EUR')
+    by_chr = {}
+    for f in locus_files:
+        by_chr.setdefault(str(int(os.path.basename(f)[3:5])), []).append(f)
+    for chr,files in by_chr.items():
+        ProcessChromosome((chr, files), ld_files, samples, c['pos'], c['a1'], c['a2'], c['zscore'], max_snps=max_snps, ld_format='npy')
+
+    return None
+
+
+def StageAnnotations(beds : "list[str]", annotations_file : str) -> None :
+    """
+    builds the annotation matrices of the loci as annotations_merge.py does
+    """
+    from annotations_merge import ReadAnnotationsList, ReadLocusBed, AnnotationMatrices, WriteAnnotationMatrix
+    annotations = ReadAnnotationsList(annotations_file)
+    for bed,matrix in zip(beds, AnnotationMatrices([ReadLocusBed(bed) for bed in beds], annotations)):
+        WriteAnnotationMatrix(matrix, annotations, f"{bed}.coord.over.allannots.txt")
+
+    return None
+
+
+def StageStatistics(results : "list[str]", allannots : "list[str]", annotations_file : str, enrichment : str, outdir : str) -> None :
+    """
+    computes the statistics of the results as results_statistics.py does
+    """
+    from results_statistics import ResultsStatistics
+    os.makedirs(outdir, exist_ok=True)
+    ResultsStatistics(results, allannots, annotations_file, enrichment, outdir)
+
+    return None
+
+
+def RunStage(queue, log_file : str, stage, args : tuple) -> None :
+    """
+    runs a stage function in the current (new) process with its outputs sent to log_file, and puts its duration,
+    the peak RSS of the process (in MB) and the traceback of its error (None when it succeeded) in the queue
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    seconds,error = None,None
+    with open(log_file, 'w') as log:
+        sys.stdout,sys.stderr = log,log
+        try:
+            start_time = time.perf_counter()
+            stage(*args)
+            seconds = time.perf_counter() - start_time
+        except Exception:
+            error = traceback.format_exc()
+            log.write(error)
+        finally:
+            sys.stdout,sys.stderr = sys.__stdout__,sys.__stderr__
+    queue.put((seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, error))
+
+    return None
+
+
+def TimeStage(name : str, nb_snp : int, items : int, log_file : str, stage, args : tuple) -> dict :
+    """
+    runs a stage in a new process, returns its benchmark record
+    a stage that raised or whose process died is recorded as failed, with its error, instead of being waited for
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    p = context.Process(target=RunStage, args=(queue, log_file, stage, args))
+    p.start()
+    result = None
+    while result is None:
+        exited = p.exitcode is not None
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            # the result is put before the process exits: none after its exit means it died without one
+            if exited:
+                break
+    p.join()
+    if result is None:
+        result = (None, None, f"stage process exited with status {p.exitcode} without a result")
+
+    seconds,rss,error = result
+    if error is not None:
+        record = {'stage' : name, 'nb_snp' : nb_snp, 'items' : items, 'seconds' : None, 'throughput' : None,
+                  'peak_rss_mb' : round(rss, 1) if rss is not None else None, 'error' : error}
+        print(f"--- {name} of {nb_snp} SNPs : FAILED, see {log_file} ---\n{error}")
+        return record
+    record = {'stage' : name, 'nb_snp' : nb_snp, 'items' : items, 'seconds' : round(seconds, 4),
+              'throughput' : round(items / seconds, 1) if seconds > 0 else None, 'peak_rss_mb' : round(rss, 1)}
+    print(f"--- {name} of {nb_snp} SNPs : {items} SNPs in {record['seconds']} seconds, {record['throughput']} SNPs/s, {record['peak_rss_mb']} MB ---")
+
+    return record
+
+
+def BenchmarkSize(nb_snp : int, workdir : str, stages : "list[str]", options) -> "list[dict]" :
+    """
+    generates the synthetic data of one GWAS size in workdir and times the chosen stages, returns their records
+    a stage is only timed if the stages it depends on were run and succeeded (split, then ld, then annotations and statistics)
+    """
+    records = []
+    start_time = time.time()
+    gwas = os.path.join(workdir, "gwas.txt")
+    GenerateGWAS(gwas, nb_snp, float(options.lead_density), int(options.seed))
+    annotations_file = GenerateAnnotations(os.path.join(workdir, "annotations"), int(options.annotations), int(options.intervals), int(options.seed))
+    print(f"--- synthetic GWAS of {nb_snp} SNPs generated in %s seconds ---" % (time.time() - start_time))
+
+    if "split" not in stages:
+        return records
+    locus_dir = os.path.join(workdir, "loci")
+    os.makedirs(locus_dir, exist_ok=True)
+    records.append(TimeStage("split", nb_snp, nb_snp, os.path.join(workdir, "split.log"), StageSplit,
+                             (gwas, locus_dir, options.kb, int(options.chunksize))))
+    locus_files = sorted(glob.glob(os.path.join(locus_dir, "CHR*locus*[0-9]")))
+    records[-1]['loci'] = len(locus_files)
+
+    if "ld" not in stages or 'error' in records[-1] or len(locus_files) == 0:
+        return records
+    start_time = time.time()
+    ld_file,map_file = GeneratePanel(locus_files, os.path.join(workdir, "panel"), int(options.samples), int(options.seed))
+    print(f"--- synthetic panel of {len(locus_files)} loci generated in %s seconds ---" % (time.time() - start_time))
+    records.append(TimeStage("ld", nb_snp, CountSnps(locus_files), os.path.join(workdir, "ld.log"), StageLD,
+                             (locus_files, ld_file, map_file, int(options.max_snps))))
+    if 'error' in records[-1]:
+        return records
+    processed = sorted(glob.glob(os.path.join(locus_dir, "*.ld_out.processed.filtered")))
+
+    beds = WriteLocusBeds(processed)
+    if "annotations" in stages:
+        records.append(TimeStage("annotations", nb_snp, CountSnps(processed), os.path.join(workdir, "annotations.log"), StageAnnotations,
+                                 (beds, annotations_file)))
+    if "statistics" in stages:
+        results = WriteResults(processed, annotations_file, os.path.join(workdir, "paintor"), int(options.seed))
+        allannots = [f"{bed}.coord.over.allannots.txt" for bed in beds if os.path.isfile(f"{bed}.coord.over.allannots.txt")]
+        records.append(TimeStage("statistics", nb_snp, CountSnps(results), os.path.join(workdir, "statistics.log"), StageStatistics,
+                                 (results, allannots, annotations_file, os.path.join(workdir, "paintor", "Enrichment.Values"),
+                                  os.path.join(workdir, "statistics"))))
+
+    return records
+
+
+def CompareBaseline(records : "list[dict]", baseline_file : str, tolerance : float) -> "list[dict]" :
+    """
+    returns the comparison of each record with the baseline record of the same stage and GWAS size: ratios of the
+    throughputs and of the peak RSS (new / baseline), and whether they are a regression beyond the tolerance
+    """
+    with open(baseline_file) as f:
+        baseline = {(r['stage'], r['nb_snp']) : r for r in json.load(f)['results']}
+
+    comparison = []
+    for r in records:
+        b = baseline.get((r['stage'], r['nb_snp']))
+        if b is None or not b['throughput'] or not r['throughput']:
+            continue
+        speed = r['throughput'] / b['throughput']
+        memory = r['peak_rss_mb'] / b['peak_rss_mb'] if b['peak_rss_mb'] else 1.0
+        comparison.append({'stage' : r['stage'], 'nb_snp' : r['nb_snp'], 'throughput_ratio' : round(speed, 3), 'rss_ratio' : round(memory, 3),
+                           'regression' : speed < 1 - tolerance or memory > 1 + tolerance})
+        print(f"{r['stage']:<12} {r['nb_snp']:>11} SNPs   throughput x{speed:.2f}   peak RSS x{memory:.2f}" + ("   REGRESSION" if comparison[-1]['regression'] else ""))
+
+    return comparison
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-s", "--sizes", dest="sizes", default="1e5,1e6")                                 #Comma separated numbers of GWAS snps to benchmark (1e5 to 1e8)
+    parser.add_option("--stages", dest="stages", default=",".join(STAGES))                              #Comma separated stages to time (split, ld, annotations, statistics)
+    parser.add_option("--lead_density", dest="lead_density", default=1e-5)                              #Fraction of the GWAS snps with a pvalue below 5e-08
+    parser.add_option("--kb", dest="kb", default=500)                                                   #Number of kb upstream and downstream of the lead snps
+    parser.add_option("--chunksize", dest="chunksize", default=0)                                       #Number of GWAS lines read at once by the split stage (0 reads the whole file at once)
+    parser.add_option("--max_snps", dest="max_snps", default=0)                                         #Maximum number of snps of a locus in the ld stage (0 means no cap)
+    parser.add_option("--samples", dest="samples", default=500)                                         #Number of samples of the synthetic reference panel
+    parser.add_option("--annotations", dest="annotations", default=10)                                  #Number of synthetic annotation bed files
+    parser.add_option("--intervals", dest="intervals", default=100000)                                  #Number of intervals of each annotation bed file
+    parser.add_option("--seed", dest="seed", default=1)                                                 #Seed of the synthetic data
+    parser.add_option("-w", "--workdir", dest="workdir", default=None)                                  #Directory of the synthetic data (a temporary directory, removed at the end, by default)
+    parser.add_option("-b", "--baseline", dest="baseline", default=None)                                #JSON file of a former benchmark to compare with
+    parser.add_option("--tolerance", dest="tolerance", default=0.2)                                     #Relative slowdown or memory increase above which a stage is a regression
+    parser.add_option("-o", "--output", dest="output", default="benchmark.json")                        #JSON file where the results are written
+    (options, args) = parser.parse_args()
+
+    debut = time.time()
+
+    sizes = [int(float(s)) for s in options.sizes.split(',')]
+    stages = options.stages.split(',')
+    workdir = options.workdir if options.workdir is not None else tempfile.mkdtemp(prefix="paintorpipe_benchmark.")
+
+    records = []
+    try:
+        for nb_snp in sizes:
+            size_dir = os.path.join(workdir, f"snps{nb_snp}")
+            os.makedirs(size_dir, exist_ok=True)
+            records.extend(BenchmarkSize(nb_snp, size_dir, stages, options))
+    finally:
+        if options.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'date' : time.strftime("%Y-%m-%dT%H:%M:%S"), 'host' : platform.node(), 'python' : platform.python_version(),
+              'numpy' : np.__version__, 'pandas' : pd.__version__, 'cpus' : os.cpu_count(),
+              'parameters' : {k : v for k,v in vars(options).items() if k not in ('workdir', 'baseline', 'output')},
+              'results' : records}
+    status = 0
+    if options.baseline is not None:
+        print()
+        report['comparison'] = CompareBaseline(records, options.baseline, float(options.tolerance))
+        status = int(any(c['regression'] for c in report['comparison']))
+    status = max(status, int(any('error' in r for r in records)))
+
+    with open(options.output, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    print("\n~~~~~ benchmark finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return status
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": sys.exit(main())
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+# This script draws the figures of all the loci in one process (or a small pool of worker processes), in place of one
+# CANVIS.py task per locus. For each locus it reads LOCUS.results.for.canvis (positions, zscores and posterior
+# probabilities), the LD matrix (LOCUS.sorted.ld_out.ld.filtered text, .npy binary or .npz sparse) and the annotations
+# (LOCUS.*.allannots.txt), and writes LOCUS.results.for.canvis_fig.svg with, like CANVIS:
+#   - the -log10 p-values of the zscores, coloured by the r2 of each snp with the top snp (largest |zscore|)
+#   - the posterior probabilities of the snps
+#   - one track per annotation, with a tick for each annotated snp
+#   - the LD heatmap (r2) as a triangle under the tracks
+# The LD matrix is never loaded as a whole: it is read by chunks of ROW_CHUNK rows (upper triangle of the
+# binary matrix read sequentially, stored pairs of a sparse matrix, or text matrix streamed line by line) and averaged over blocks of snps, so that the heatmap has at most --resolution
+# cells per side (one cell per snp for the small loci) and the memory is bounded by the resolution and the number of
+# snps, not by its square. The heatmap is embedded in the SVG as a PNG image.
+# The files of all the loci are given as arguments and grouped by locus name.
+
+
+# IMPORTS --------------------------------------------------------------------
+import numpy as np
+import multiprocessing
+import base64
+import struct
+import html
+import math
+import zlib
+import time
+import os
+from functools import partial
+from optparse import OptionParser
+from ld_matrix import ReadPackedLD, TriangleOffsets, ReadSparseLD, LocusName
+# ----------------------------------------------------------------------------
+
+
+# number of LD rows read at once
+ROW_CHUNK = 256
+
+# width of the figures and horizontal margins of the plots (pixels)
+FIGURE_WIDTH = 800
+MARGIN_LEFT = 90
+MARGIN_RIGHT = 30
+
+# r2 bins with the top snp (lower bounds) and their colours, as in LocusZoom
+LD_BINS = (0.0, 0.2, 0.4, 0.6, 0.8)
+LD_COLORS = ('#357EBD', '#46B8DA', '#5CB85C', '#EEA236', '#D43F3A')
+
+# colour of the heatmap cells of r2 = 1 (r2 = 0 is white)
+HEATMAP_COLOR = (212, 63, 58)
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def GroupFiles(files : "list[str]") -> dict :
+    """
+    returns the dictionary locus -> {'results', 'ld', 'annotations'} of the input files
+    """
+    loci = {}
+    for f in files:
+        name = os.path.basename(f)
+        if name.endswith('.results.for.canvis'):
+            kind = 'results'
+        elif name.endswith(('.ld_out.ld.filtered', '.ld_out.ld.filtered.npy', '.ld_out.ld.filtered.npz')):
+            kind = 'ld'
+        elif name.endswith('allannots.txt'):
+            kind = 'annotations'
+        else:
+            continue
+        loci.setdefault(LocusName(f), {})[kind] = f
+
+    return {locus : f for locus,f in loci.items() if len(f) == 3}
+
+
+def ReadResults(results_file : str, zheader : str) -> dict :
+    """
+    returns the positions, zscores, posterior probabilities and rsids of the snps of a .results.for.canvis file
+    """
+    with open(results_file) as f:
+        header = f.readline().split()
+        rows = [line.split() for line in f if line.strip()]
+    column = lambda name, dtype: np.array([r[header.index(name)] for r in rows], dtype=dtype)
+
+    return {'pos' : column('pos', np.int64), 'z' : column(zheader, np.float64),
+            'pp' : column('Posterior_Prob', np.float64),
+            'rsid' : column('rsID', object) if 'rsID' in header else np.array([''] * len(rows), dtype=object)}
+
+
+def ReadAnnotations(annotations_file : str) -> tuple :
+    """
+    returns (annotation names, 0/1 matrix snps x annotations) of an allannots file
+    """
+    with open(annotations_file) as f:
+        names = f.readline().split()
+        matrix = np.array([line.split() for line in f if line.strip()], dtype=np.float64).reshape(-1, len(names))
+
+    return names, matrix
+
+
+def TextLDChunks(ld_file : str):
+    """
+    yields (first row, rows) chunks of at most ROW_CHUNK rows of a text LD matrix, read line by line
+    """
+    with open(ld_file) as f:
+        first,rows = 0,[]
+        for line in f:
+            rows.append(np.array(line.split(), dtype=np.float32))
+            if len(rows) == ROW_CHUNK:
+                yield first, np.vstack(rows)
+                first,rows = first + len(rows),[]
+        if rows:
+            yield first, np.vstack(rows)
+
+
+def DownsampledLD(ld_file : str, nb_snp : int, resolution : int, top : int) -> tuple :
+    """
+    returns (mean r2 over blocks of consecutive snps, at most resolution x resolution, r2 of each snp with the top
+    snp), reading the LD matrix by chunks of ROW_CHUNK rows
+    a binary matrix is read sequentially, only its stored upper triangle: the sums of the blocks above the diagonal
+    are mirrored, and the diagonal blocks count their off-diagonal pairs twice
+    a sparse matrix is read from its stored pairs only (the missing pairs count as 0)
+    """
+    edges = np.unique(np.linspace(0, nb_snp, min(nb_snp, resolution) + 1).astype(np.int64))
+    block = np.repeat(np.arange(len(edges) - 1), np.diff(edges))
+    sums = np.zeros((len(edges) - 1, len(edges) - 1))
+    sizes = np.diff(edges).astype(np.float64)
+
+    if ld_file.endswith('.npz'):
+        sparse = ReadSparseLD(ld_file)
+        if sparse['nb_snp'] != nb_snp:
+            raise ValueError(f"{ld_file}: LD matrix of {sparse['nb_snp']} snps for {nb_snp} snps")
+        top_r2 = np.zeros(nb_snp)
+        for first in range(0, nb_snp, ROW_CHUNK):
+            last = min(first + ROW_CHUNK, nb_snp)
+            start,end = sparse['indptr'][first],sparse['indptr'][last]
+            rows = np.repeat(np.arange(first, last), np.diff(sparse['indptr'][first:last + 1]))
+            cols = sparse['indices'][start:end]
+            r2 = sparse['data'][start:end].astype(np.float64) ** 2
+            np.add.at(sums, (block[rows], block[cols]), r2)
+            if first <= top < last:
+                top_r2[cols[rows == top]] = r2[rows == top]
+
+        return sums / np.outer(sizes, sizes), top_r2
+
+    if ld_file.endswith('.npy'):
+        size,packed = ReadPackedLD(ld_file)
+        if size != nb_snp:
+            raise ValueError(f"{ld_file}: LD matrix of {size} snps for {nb_snp} snps")
+        offsets = np.append(TriangleOffsets(nb_snp), nb_snp * (nb_snp + 1) // 2)
+        diagonal,top_r2 = np.zeros(len(sums)),np.zeros(nb_snp)
+        # plain reads rather than the memory map, so that the pages read are not kept in the memory of the process
+        with open(ld_file, 'rb') as f:
+            for first in range(0, nb_snp, ROW_CHUNK):
+                last = min(first + ROW_CHUNK, nb_snp)
+                f.seek(packed.offset + int(offsets[first]) * packed.itemsize)
+                chunk = np.fromfile(f, dtype=packed.dtype, count=int(offsets[last] - offsets[first])).astype(np.float64) ** 2
+                for i in range(first, last):
+                    row = chunk[offsets[i] - offsets[first]:offsets[i + 1] - offsets[first]]
+                    # blocks of ld[i, i:], from the block of i to the last one
+                    starts = np.append(0, edges[block[i] + 1:-1] - i)
+                    sums[block[i], block[i]:] += np.add.reduceat(row, starts)
+                    diagonal[block[i]] += row[0]
+                    if i < top:
+                        top_r2[i] = row[top - i]
+                    elif i == top:
+                        top_r2[top:] = row
+        sums = sums + sums.T - np.diag(np.diagonal(sums)) + np.diag(np.diagonal(sums) - diagonal)
+
+        return sums / np.outer(sizes, sizes), top_r2
+
+    top_r2 = np.zeros(nb_snp)
+    for first,rows in TextLDChunks(ld_file):
+        if rows.shape[1] != nb_snp:
+            raise ValueError(f"{ld_file}: {rows.shape[1]} LD columns for {nb_snp} snps")
+        r2 = rows.astype(np.float64) ** 2
+        np.add.at(sums, block[first:first + len(rows)], np.add.reduceat(r2, edges[:-1], axis=1))
+        if first <= top < first + len(rows):
+            top_r2 = r2[top - first].copy()
+
+    return sums / np.outer(sizes, sizes), top_r2
+
+
+def PngDataUri(rgba : np.ndarray) -> str :
+    """
+    returns the data URI of an RGBA image (height x width x 4 uint8 array) encoded as PNG
+    """
+    height,width,_ = rgba.shape
+    chunk = lambda tag, data: struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    # each row of pixels starts with its filter type (0, none)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)]).tobytes()
+    png = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+           + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b""))
+
+    return "data:image/png;base64," + base64.b64encode(png).decode('ascii')
+
+
+def HeatmapPixels(r2 : np.ndarray) -> np.ndarray :
+    """
+    returns the RGBA pixels of the lower triangle of the block r2 matrix (white to HEATMAP_COLOR, upper triangle
+    transparent)
+    """
+    r2 = np.clip(r2, 0, 1)[:, :, None]
+    rgba = np.empty(r2.shape[:2] + (4,), dtype=np.uint8)
+    rgba[:, :, :3] = np.rint(255 + r2 * (np.array(HEATMAP_COLOR) - 255))
+    rgba[:, :, 3] = np.where(np.tri(len(r2), dtype=bool), 255, 0)
+
+    return rgba
+
+
+def MinusLog10P(z : np.ndarray) -> np.ndarray :
+    """
+    returns -log10 of the two-sided p-values of the zscores (asymptotic expansion when erfc underflows)
+    """
+    out = np.empty(len(z))
+    for i,x in enumerate(np.abs(z)):
+        p = math.erfc(x / math.sqrt(2))
+        out[i] = -math.log10(p) if p > 0 else (x * x / 2 + math.log(x) + 0.5 * math.log(math.pi / 2)) / math.log(10)
+
+    return out
+
+
+def NiceTicks(top : float, nb : int = 5) -> np.ndarray :
+    """
+    returns round tick values from 0 to at least top, about nb of them
+    """
+    raw = max(top, 1e-9) / nb
+    step = 10 ** math.floor(math.log10(raw))
+    step *= next(m for m in (1, 2, 5, 10) if m * step >= raw)
+
+    return np.arange(0, top + step * 0.999, step)
+
+
+def LDColor(r2 : float) -> str :
+    """
+    returns the colour of the r2 bin of a snp
+    """
+    return LD_COLORS[int(np.searchsorted(LD_BINS, r2, side='right')) - 1]
+
+
+def YAxis(y0 : float, height : float, ticks : np.ndarray, label : str) -> "list[str]" :
+    """
+    returns the SVG elements of a frame and its y axis (ticks from bottom to top)
+    """
+    width = FIGURE_WIDTH - MARGIN_LEFT - MARGIN_RIGHT
+    svg = [f'<rect x="{MARGIN_LEFT}" y="{y0}" width="{width}" height="{height}" fill="none" stroke="black"/>']
+    for t in ticks:
+        y = y0 + height * (1 - t / ticks[-1])
+        svg.append(f'<line x1="{MARGIN_LEFT - 4}" y1="{y:.1f}" x2="{MARGIN_LEFT}" y2="{y:.1f}" stroke="black"/>')
+        svg.append(f'<text x="{MARGIN_LEFT - 6}" y="{y + 4:.1f}" font-size="11" text-anchor="end">{t:g}</text>')
+    svg.append(f'<text x="20" y="{y0 + height / 2}" font-size="12" text-anchor="middle" '
+               f'transform="rotate(-90 20 {y0 + height / 2})">{html.escape(label)}</text>')
+
+    return svg
+
+
+def LocusFigure(locus : str, results : dict, annotations : tuple, r2 : np.ndarray, top_r2 : np.ndarray, top : int) -> str :
+    """
+    returns the SVG figure of a locus
+    """
+    width = FIGURE_WIDTH - MARGIN_LEFT - MARGIN_RIGHT
+    pos = results['pos']
+    span = max(int(pos.max() - pos.min()), 1) if len(pos) else 1
+    x = MARGIN_LEFT + width * (pos - (pos.min() if len(pos) else 0)) / span
+    svg = [f'<text x="{FIGURE_WIDTH / 2}" y="20" font-size="14" text-anchor="middle">{html.escape(locus)}</text>']
+
+    # -log10 p-values coloured by the r2 with the top snp, top snp as a purple diamond
+    logp = MinusLog10P(results['z'])
+    ticks = NiceTicks(logp.max() if len(logp) else 1)
+    y0,height = 40,160
+    svg += YAxis(y0, height, ticks, "-log10(p-value)")
+    y = y0 + height * (1 - logp / ticks[-1])
+    svg += [f'<circle cx="{a:.1f}" cy="{b:.1f}" r="3" fill="{LDColor(c)}"/>' for a,b,c in zip(x, y, top_r2)]
+    if len(pos):
+        svg.append(f'<path d="M {x[top]:.1f} {y[top] - 6:.1f} l 6 6 l -6 6 l -6 -6 z" fill="#7B3294"/>')
+        svg.append(f'<text x="{x[top]:.1f}" y="{y[top] - 9:.1f}" font-size="11" text-anchor="middle">{html.escape(str(results["rsid"][top]))}</text>')
+    for k,(bound,color) in enumerate(zip(LD_BINS, LD_COLORS)):
+        svg.append(f'<rect x="{FIGURE_WIDTH - MARGIN_RIGHT - 60}" y="{y0 + 6 + 14 * k}" width="10" height="10" fill="{color}"/>')
+        svg.append(f'<text x="{FIGURE_WIDTH - MARGIN_RIGHT - 46}" y="{y0 + 15 + 14 * k}" font-size="10">r2 &gt; {bound:g}</text>')
+
+    # posterior probabilities
+    y0,height = 230,120
+    svg += YAxis(y0, height, np.array([0, 0.5, 1]), "Posterior probability")
+    y = y0 + height * (1 - np.clip(results['pp'], 0, 1))
+    svg += [f'<circle cx="{a:.1f}" cy="{b:.1f}" r="3" fill="{LDColor(c)}"/>' for a,b,c in zip(x, y, top_r2)]
+
+    # annotation tracks
+    names,matrix = annotations
+    y0 = 370
+    for k,name in enumerate(names):
+        y = y0 + 16 * k
+        svg.append(f'<text x="{MARGIN_LEFT - 6}" y="{y + 10}" font-size="11" text-anchor="end">{html.escape(name)}</text>')
+        svg.append(f'<line x1="{MARGIN_LEFT}" y1="{y + 6}" x2="{MARGIN_LEFT + width}" y2="{y + 6}" stroke="#CCCCCC"/>')
+        svg += [f'<rect x="{a - 1:.1f}" y="{y}" width="2" height="12" fill="#2C7BB6"/>' for a in x[matrix[:, k] > 0]]
+
+    # positions, then the LD triangle: the lower triangle of the block matrix rotated by -45 degrees, its diagonal
+    # along the width of the plots
+    y0 += 16 * len(names) + 14
+    if len(pos):
+        svg.append(f'<text x="{MARGIN_LEFT}" y="{y0}" font-size="11">{pos.min() / 1e6:.3f} Mb</text>')
+        svg.append(f'<text x="{MARGIN_LEFT + width}" y="{y0}" font-size="11" text-anchor="end">{pos.max() / 1e6:.3f} Mb</text>')
+    y0 += 10
+    if len(r2):
+        scale = width / (math.sqrt(2) * len(r2))
+        svg.append(f'<image x="0" y="0" width="{len(r2)}" height="{len(r2)}" preserveAspectRatio="none" '
+                   f'style="image-rendering:pixelated" transform="translate({MARGIN_LEFT} {y0}) rotate(-45) scale({scale:.6f})" '
+                   f'xlink:href="{PngDataUri(HeatmapPixels(r2))}"/>')
+    height = y0 + width / 2 + 20
+
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1" '
+            f'width="{FIGURE_WIDTH}" height="{height:.0f}" viewBox="0 0 {FIGURE_WIDTH} {height:.0f}" font-family="sans-serif">\n'
+            + "\n".join(svg) + "\n</svg>\n")
+
+
+def RenderLocus(item : tuple, zheader : str, resolution : int, outdir : str) -> tuple :
+    """
+    writes the figure of a locus, returns (locus, number of snps, heatmap cells per side, seconds)
+    """
+    start_time = time.time()
+    locus,files = item
+    results = ReadResults(files['results'], zheader)
+    annotations = ReadAnnotations(files['annotations'])
+    if len(annotations[1]) != len(results['pos']):
+        raise ValueError(f"{locus}: {len(results['pos'])} snps, {len(annotations[1])} annotation rows")
+    top = int(np.argmax(np.abs(results['z']))) if len(results['z']) else 0
+    r2,top_r2 = DownsampledLD(files['ld'], len(results['pos']), resolution, top)
+    with open(os.path.join(outdir, f"{os.path.basename(files['results'])}_fig.svg"), 'w') as f:
+        f.write(LocusFigure(locus, results, annotations, r2, top_r2, top))
+
+    return locus, len(results['pos']), len(r2), time.time() - start_time
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog -z Zscore [options] LOCUS.results.for.canvis LOCUS.sorted.ld_out.ld.filtered[.npy] LOCUS.*.allannots.txt ...")
+    parser.add_option("-z", "--zheader", dest="zheader", default="Zscore")                              #Zscore header of the results files
+    parser.add_option("-r", "--resolution", dest="resolution", default=200)                             #Maximum number of heatmap cells per side (blocks of snps averaged above)
+    parser.add_option("-o", "--outdir", dest="outdir", default=".")                                     #Output directory of the figures
+    parser.add_option("-t", "--threads", dest="threads", default=1)                                     #Number of loci drawn in parallel
+    (options, args) = parser.parse_args()
+
+    debut = time.time()
+
+    loci = GroupFiles(args)
+    missing = sorted({LocusName(f) for f in args} - set(loci))
+    if missing:
+        print(f"Loci without their results, LD and annotation files, not drawn: {' '.join(missing)}\n")
+    # the largest LD matrices first, so that the workers stay evenly loaded
+    items = sorted(loci.items(), key=lambda item: -os.path.getsize(item[1]['ld']))
+
+    threads = int(options.threads)
+    pool = multiprocessing.get_context("fork").Pool(threads) if threads > 1 else None
+    try:
+        draw = partial(RenderLocus, zheader=options.zheader, resolution=int(options.resolution), outdir=options.outdir)
+        results = map(draw, items) if pool is None else pool.imap_unordered(draw, items, chunksize=1)
+        for locus,nb_snp,cells,seconds in results:
+            print(f"--- {locus}: {nb_snp} SNPs, heatmap of {cells} x {cells} cells, drawn in %s seconds ---" % seconds)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print("\n~~~~~ canvis_batch finished: %d loci drawn in %s seconds ~~~~~\n" % (len(items), time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
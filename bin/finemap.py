@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+
+# This script is a fine-mapping engine that reads the inputs of PAINTOR and writes its outputs, in place of the PAINTOR
+# binary. For each locus of the -input file (LOCUS with the zscores, LOCUS.ld, LOCUS.ld.npy or LOCUS.ld.npz with the LD matrix, and
+# LOCUS.annotations with the 0/1 annotations of the snps), it computes the posterior probability of each snp to be causal.
+# The model is the one of PAINTOR 3.1:
+#   - a configuration C is a set of causal snps, the zscores follow N(0, R + (s2 / |C|) R_C R_C') where R is the LD
+#     matrix and s2 the prior variance of the locus, estimated as z' U S^-1 U' z - k on the k principal components
+#     of R explaining --prop_ld of its variance (written to LogFile.results)
+#   - each snp is causal independently, with probability 1 / (1 + exp(a.gamma)), a being its annotations and gamma
+#     the enrichment parameters (first one for the baseline), estimated on all the loci
+# The log Bayes factor of C only needs M = |C| / s2 I + R_CC:  -(|C| log(s2 / |C|) + log det M) / 2 + z_C' M^-1 z_C / 2.
+# Configurations are evaluated by batches with NumPy: the Cholesky factor of a configuration is computed once and
+# extended to all the configurations with one more snp (one triangular solve for all the snps of the locus).
+# All the configurations of at most --max_causal snps (no cap by default, as PAINTOR -mcmc) are enumerated when there
+# are at most EXACT_MAX_CONFIGS of them,
+# otherwise they are sampled by tempered Gibbs sampling (the flips of the causal status of every snp of the current
+# configuration are evaluated at once), and the posteriors are the Rao-Blackwellized averages of the conditional
+# causal probabilities of the snps over the weighted samples.
+# The enrichment is estimated by EM over all the loci: the configurations of each locus are found once (loci read,
+# eigendecomposed and searched in a pool of worker processes, only their configurations are sent back), then the posteriors (E step) and the weighted logistic regression of the snp priors on
+# the annotations (M step) are iterated on them; the sampled loci are sampled again with the final priors.
+# Outputs, in the PAINTOR format: LOCUS.results (locus file with a Posterior_Prob column), Enrichment.Values,
+# Log.BayesFactor (sum over the loci of the log of the average Bayes factor under the prior) and LogFile.results.
+
+
+# IMPORTS --------------------------------------------------------------------
+import pandas as pd
+import numpy as np
+import multiprocessing
+import time
+import os
+from functools import partial
+from optparse import OptionParser
+from ld_matrix import UnpackLD
+# ----------------------------------------------------------------------------
+
+
+# loci whose configurations of at most max_causal snps are fewer than this are enumerated exactly
+EXACT_MAX_CONFIGS = 200000
+
+# lowest prior variance of a locus (the estimate is negative when the zscores are smaller than expected under the null)
+PRIOR_VARIANCE_MIN = 1.0
+
+# FUNCTIONS  -----------------------------------------------------------------
+def ReadLocus(locus : str, indir : str, Zhead : str, LDname : str, annotations : "list[str]") -> dict :
+    """
+    returns the zscores, LD matrix (text LOCUS.LDname, packed LOCUS.LDname.npy or sparse LOCUS.LDname.npz, densified) and annotation matrix (baseline
+    column first, then the requested annotations) of a locus (the LD matrix as read, see NearestPSD)
+    """
+    prefix = os.path.join(indir, locus)
+    with open(prefix) as f:
+        lines = f.read().splitlines()
+    header = lines[0].split()
+    z = np.array([line.split()[header.index(Zhead)] for line in lines[1:]], dtype=np.float64)
+
+    if os.path.exists(f"{prefix}.{LDname}.npy"):
+        ld = UnpackLD(f"{prefix}.{LDname}.npy").astype(np.float64)
+    elif os.path.exists(f"{prefix}.{LDname}.npz"):
+        ld = UnpackLD(f"{prefix}.{LDname}.npz").astype(np.float64)
+    else:
+        ld = np.loadtxt(f"{prefix}.{LDname}", ndmin=2)
+
+    annot = pd.read_csv(f"{prefix}.annotations", sep=r'\s+')
+    A = np.hstack([np.ones((len(z), 1)), annot[annotations].to_numpy(dtype=np.float64)]) if annotations else np.ones((len(z), 1))
+
+    if ld.shape != (len(z), len(z)) or len(A) != len(z):
+        raise ValueError(f"{locus}: {len(z)} zscores, LD matrix {ld.shape}, {len(A)} annotation rows")
+
+    return {'name' : locus, 'lines' : lines, 'z' : z, 'ld' : ld, 'A' : A}
+
+
+def NearestPSD(ld : np.ndarray) -> tuple :
+    """
+    returns (LD matrix with its negative eigenvalues (rounding of the text matrices, pairs left out of a sparse
+    matrix) set to 0, its eigenvalues, its eigenvectors), from a single eigendecomposition
+    """
+    w,U = np.linalg.eigh(ld)
+    if len(w) == 0 or w[0] >= 0:
+        return ld, w, U
+    w = np.maximum(w, 0)
+
+    return (U * w) @ U.T, w, U
+
+
+def PriorVariance(z : np.ndarray, w : np.ndarray, U : np.ndarray, prop_ld : float = 0.95) -> tuple :
+    """
+    returns (prior variance, number of principal components) of a locus: z' U S^-1 U' z - k on the k first principal
+    components of the LD matrix (eigenvalues w and eigenvectors U, increasing as np.linalg.eigh returns them) whose
+    cumulated eigenvalues are below prop_ld of their sum
+    """
+    w,U = w[::-1],U[:, ::-1]
+    k = max(int(np.searchsorted(np.cumsum(w) / w.sum(), prop_ld)), 1)
+    projection = U[:, :k].T @ z
+
+    return max(float((projection ** 2 / w[:k]).sum()) - k, PRIOR_VARIANCE_MIN), k
+
+
+def LogBayesFactors(z : np.ndarray, ld : np.ndarray, configs : np.ndarray, s2 : float) -> np.ndarray :
+    """
+    returns the log Bayes factors of a batch of configurations of the same size (rows of configs)
+    """
+    m,k = configs.shape
+    if k == 0:
+        return np.zeros(m)
+    M = ld[configs[:, :, None], configs[:, None, :]] + (k / s2) * np.eye(k)
+    L = np.linalg.cholesky(M)
+    w = np.linalg.solve(L, z[configs][:, :, None])[:, :, 0]
+
+    return -0.5 * (k * np.log(s2 / k) + 2 * np.log(np.diagonal(L, axis1=1, axis2=2)).sum(axis=1)) + 0.5 * (w ** 2).sum(axis=1)
+
+
+def ExtendedLogBayesFactors(z : np.ndarray, ld : np.ndarray, bases : np.ndarray, s2 : float) -> np.ndarray :
+    """
+    returns the (number of bases, number of snps) log Bayes factors of the configurations made of a base (row of bases)
+    and one more snp: the Cholesky factor of each base is computed once and extended to all the snps of the locus
+    (values for the snps of the base are meaningless)
+    """
+    m,k = bases.shape
+    v = s2 / (k + 1)
+    if k == 0:
+        d2 = np.broadcast_to(1 / v + np.diagonal(ld), (m, len(z)))
+        return -0.5 * (np.log(v) + np.log(d2)) + 0.5 * z ** 2 / d2
+
+    M = ld[bases[:, :, None], bases[:, None, :]] + np.eye(k) / v
+    L = np.linalg.cholesky(M)
+    Lz = np.linalg.solve(L, z[bases][:, :, None])[:, :, 0]
+    Lr = np.linalg.solve(L, ld[bases])
+    d2 = np.maximum(1 / v + np.diagonal(ld)[None, :] - (Lr ** 2).sum(axis=1), 1e-12)
+    t = (z[None, :] - (Lr * Lz[:, :, None]).sum(axis=1)) ** 2 / d2
+    logdet = 2 * np.log(np.diagonal(L, axis1=1, axis2=2)).sum(axis=1)[:, None] + np.log(d2)
+
+    return -0.5 * ((k + 1) * np.log(v) + logdet) + 0.5 * ((Lz ** 2).sum(axis=1)[:, None] + t)
+
+
+def NbConfigs(nb_snp : int, max_causal : int) -> int :
+    """
+    returns the number of configurations of at most max_causal snps
+    """
+    total,count = 1,1
+    for k in range(1, min(nb_snp, max_causal) + 1):
+        count = count * (nb_snp - k + 1) // k
+        total += count
+
+    return total
+
+
+def PadConfigs(configs : np.ndarray, nb_snp : int, width : int) -> np.ndarray :
+    """
+    returns the configurations padded to width columns with nb_snp (index of a dummy snp)
+    """
+    return np.hstack([configs, np.full((len(configs), width - configs.shape[1]), nb_snp, dtype=np.int64)])
+
+
+def EnumerateConfigs(z : np.ndarray, ld : np.ndarray, s2 : float, max_causal : int) -> tuple :
+    """
+    returns (configurations padded to max_causal columns, log Bayes factors) of all the configurations of at most
+    max_causal snps, each size being the extension of the previous one by a snp after the last one of the base
+    """
+    n = len(z)
+    width = min(n, max_causal)
+    bases = np.zeros((1, 0), dtype=np.int64)
+    configs,logbf = [PadConfigs(bases, n, width)],[np.zeros(1)]
+    for k in range(width):
+        extended = ExtendedLogBayesFactors(z, ld, bases, s2)
+        last = bases[:, -1] if k else np.full(len(bases), -1)
+        b,j = np.nonzero(np.arange(n)[None, :] > last[:, None])
+        bases = np.hstack([bases[b], j[:, None]])
+        configs.append(PadConfigs(bases, n, width))
+        logbf.append(extended[b, j])
+
+    return np.vstack(configs), np.concatenate(logbf)
+
+
+def FlipLogPosteriors(z : np.ndarray, ld : np.ndarray, s2 : float, logit : np.ndarray, current : np.ndarray, current_bf : float,
+                      max_causal : int) -> tuple :
+    """
+    returns (log Bayes factors, log posteriors minus the one of the current configuration) of the configurations with
+    the causal status of one snp flipped, for each snp (adding a snp to a configuration of max_causal snps is excluded)
+    the additions are evaluated at once from the Cholesky factor of the current configuration, the removals as a batch
+    """
+    n,k = len(z),len(current)
+    logbf = np.full(n, -np.inf)
+    if k < max_causal:
+        logbf[:] = ExtendedLogBayesFactors(z, ld, current[None, :], s2)[0]
+    if k > 0:
+        # row i of the removals is the current configuration without its snp i
+        logbf[current] = LogBayesFactors(z, ld, np.broadcast_to(current, (k, k))[~np.eye(k, dtype=bool)].reshape(k, k - 1), s2)
+    sign = np.ones(n)
+    sign[current] = -1
+
+    return logbf, logbf - current_bf + sign * logit
+
+
+def SampleConfigs(z : np.ndarray, ld : np.ndarray, s2 : float, logit : np.ndarray, max_causal : int, iterations : int,
+                  seed : int = 1) -> tuple :
+    """
+    returns (configurations padded to the size of the largest one, log Bayes factors, sum of the weights of their samples,
+    posterior probability of each snp) of the configurations sampled by tempered Gibbs sampling, starting from no causal snp: at each iteration, the
+    conditional probability pi_i of the current status of each snp is computed from all the flips at once, a snp is
+    picked with probability proportional to 1 / pi_i and its status is drawn uniformly (flipped half of the time); the sample is
+    weighted by 1 / Z, Z being the mean of 1 / (2 pi_i), so that weighted averages are posterior expectations
+    logit is log(p / (1 - p)) of the prior causal probability of each snp; the first tenth of the chain is burn-in
+    the posteriors average the conditional causal probability of each snp (rather than its status) over the samples
+    """
+    rng = np.random.default_rng(seed)
+    n = len(z)
+    current,current_bf = np.zeros(0, dtype=np.int64),0.0
+    samples = {}
+    pp,total = np.zeros(n),0.0
+    for iteration in range(iterations):
+        logbf,delta = FlipLogPosteriors(z, ld, s2, logit, current, current_bf, max_causal)
+        # pi_i = 1 / (1 + exp(delta_i)), 1 / (2 pi_i) computed in log scale
+        log_p = np.logaddexp(0, delta) - np.log(2)
+        log_z = LogSumExp(log_p) - np.log(n)
+        if iteration >= iterations // 10:
+            key = tuple(current)
+            samples[key] = (np.logaddexp(samples[key][0], -log_z), current_bf) if key in samples else (-log_z, current_bf)
+            # conditional causal probability: 1 - pi_i for the snps of the configuration, pi_i for the others
+            causal = np.exp(-np.logaddexp(0, -delta))
+            causal[current] = 1 - causal[current]
+            weight = np.exp(-log_z)
+            pp += weight * causal
+            total += weight
+
+        i = rng.choice(n, p=np.exp(log_p - log_z - np.log(n)))
+        if rng.uniform() < 0.5 and np.isfinite(delta[i]):
+            current = np.sort(np.append(current, i)) if i not in current else current[current != i]
+            current_bf = logbf[i]
+
+    # padded to the largest sampled configuration rather than to max_causal, which is the number of snps without a cap
+    width = max(len(key) for key in samples)
+    configs = np.vstack([PadConfigs(np.array(key, dtype=np.int64)[None, :], n, width) for key in samples])
+    log_weights,logbf = (np.array(v) for v in zip(*samples.values()))
+
+    return configs, logbf, log_weights, pp / total
+
+
+def LogSumExp(x : np.ndarray) -> float :
+    """
+    returns log(sum(exp(x)))
+    """
+    top = x.max()
+
+    return top + np.log(np.exp(x - top).sum())
+
+
+def SnpLogit(A : np.ndarray, gamma : np.ndarray) -> np.ndarray :
+    """
+    returns log(p / (1 - p)) of the prior causal probability p = 1 / (1 + exp(a.gamma)) of each snp
+    """
+    return -(A @ gamma)
+
+
+def Posteriors(locus : dict, gamma : np.ndarray) -> tuple :
+    """
+    returns (posterior probability of each snp, log of the average Bayes factor under the prior) of a locus
+    the weight of a configuration is exp(base + log prior): base is its log Bayes factor for the enumerated loci, and
+    log(number of samples) - log(prior of the sampling) for the sampled ones (importance sampling, so that the samples
+    drawn with the priors of the first EM iteration are reweighted with the current priors); the log Bayes factor of
+    a sampled locus only sums over its sampled configurations
+    the posteriors of a locus sampled with the current priors are the Rao-Blackwellized ones of its sampling
+    """
+    n = len(locus['z'])
+    logit = SnpLogit(locus['A'], gamma)
+    logprior = np.append(logit, 0)[locus['configs']].sum(axis=1) - np.logaddexp(0, logit).sum()
+    weights = locus['base'] + logprior
+    weights = np.exp(weights - weights.max())
+    pp = np.bincount(locus['configs'].ravel(), weights=np.repeat(weights / weights.sum(), locus['configs'].shape[1]), minlength=n + 1)[:n]
+    if locus['sampled_pp'] is not None and np.array_equal(locus['sampled_gamma'], gamma):
+        pp = locus['sampled_pp']
+
+    return np.minimum(pp, 1.0), LogSumExp(locus['logbf'] + logprior)
+
+
+def FindConfigs(name : str, read, gamma : np.ndarray, max_causal : int, iterations : int, prop_ld : float, seed : int) -> dict :
+    """
+    reads a locus with read(name) and finds its configurations (run in the worker processes), returns the locus without
+    its LD matrix plus its configurations, log Bayes factors, base weights, posteriors of the sampling (None when the
+    configurations are enumerated), prior variance and number of principal components
+    the LD matrix is eigendecomposed once, for its projection on the PSD matrices and for the prior variance
+    max_causal 0 means no cap on the number of causal snps of a configuration
+    """
+    locus = read(name)
+    z = locus['z']
+    ld,w,U = NearestPSD(locus.pop('ld'))
+    max_causal = len(z) if max_causal <= 0 else max_causal
+    s2,pcs = PriorVariance(z, w, U, prop_ld)
+    del w,U
+    exact = NbConfigs(len(z), max_causal) <= EXACT_MAX_CONFIGS
+    if exact:
+        configs,logbf = EnumerateConfigs(z, ld, s2, max_causal)
+        base,sampled_pp = logbf,None
+    else:
+        logit = SnpLogit(locus['A'], gamma)
+        configs,logbf,log_weights,sampled_pp = SampleConfigs(z, ld, s2, logit, min(max_causal, len(z)), iterations, seed)
+        base = log_weights - np.append(logit, 0)[configs].sum(axis=1)
+    locus.update(configs=configs, logbf=logbf, base=base, sampled_pp=sampled_pp, sampled_gamma=gamma, prior_variance=s2, ld_pcs=pcs)
+
+    return locus
+
+
+def MStep(loci : "list[dict]", pps : "list[np.ndarray]", gamma : np.ndarray, ridge : float = 1e-6, steps : int = 25) -> np.ndarray :
+    """
+    returns the enrichment parameters maximizing the expected log prior of the snps given their posteriors: logistic
+    regression of the posteriors on the annotations (Newton steps), with p = 1 / (1 + exp(a.gamma))
+    """
+    A = np.vstack([l['A'] for l in loci])
+    y = np.concatenate(pps)
+    beta = -gamma.copy()
+    for _ in range(steps):
+        p = 1 / (1 + np.exp(-(A @ beta)))
+        gradient = A.T @ (y - p) - ridge * beta
+        hessian = (A * (p * (1 - p))[:, None]).T @ A + ridge * np.eye(len(beta))
+        step = np.linalg.solve(hessian, gradient)
+        beta += step
+        if np.abs(step).max() < 1e-8:
+            break
+
+    return -beta
+
+
+def FineMap(names : "list[str]", read, gamma : np.ndarray, max_iter : int, tol : float, max_causal : int, iterations : int,
+            prop_ld : float, threads : int, seed : int = 1, costs : dict = None) -> tuple :
+    """
+    reads the loci with read(name) and finds their configurations (in parallel, by decreasing costs when given), then
+    estimates the enrichment by EM on them, returns (enrichment, loci, posteriors of each locus, log Bayes factor of
+    each locus), the loci in the order of names
+    """
+    found = {}
+    # the most expensive loci first, so that the workers stay evenly loaded
+    order = sorted(names, key=lambda name: -costs[name]) if costs else list(names)
+
+    def Search(names, gamma):
+        find = partial(FindConfigs, read=read, gamma=gamma, max_causal=max_causal, iterations=iterations, prop_ld=prop_ld, seed=seed)
+        results = map(find, names) if pool is None else pool.imap_unordered(find, names, chunksize=1)
+        for locus in results:
+            found[locus['name']] = locus
+
+    pool = multiprocessing.get_context("fork").Pool(threads) if threads > 1 else None
+    try:
+        start_time = time.time()
+        Search(order, gamma)
+        loci = [found[name] for name in names]
+        print(f"{len(loci)} loci, {sum(len(l['z']) for l in loci)} SNPs\n")
+        print(f"--- configurations of {len(loci)} loci found in %s seconds ---\n" % (time.time() - start_time))
+
+        previous = None
+        for iteration in range(1, max_iter + 1):
+            pps,logbfs = zip(*(Posteriors(l, gamma) for l in loci))
+            total = sum(logbfs)
+            print(f"Enrichment estimates at iteration {iteration} : {' '.join('%g' % g for g in gamma)}")
+            print(f"Log Bayes factor: {total:f}\n")
+            if previous is not None and abs(total - previous) < tol:
+                break
+            previous = total
+            gamma = MStep(loci, pps, gamma)
+
+        # the sampled loci are read again by the workers, which do not keep the LD matrices
+        sampled = [l['name'] for l in loci if l['sampled_pp'] is not None]
+        if sampled and not np.array_equal(gamma, found[sampled[0]]['sampled_gamma']):
+            start_time = time.time()
+            Search(sampled, gamma)
+            loci = [found[name] for name in names]
+            print(f"--- {len(sampled)} sampled loci sampled again with the final priors in %s seconds ---\n" % (time.time() - start_time))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    pps,logbfs = zip(*(Posteriors(l, gamma) for l in loci))
+
+    return gamma, loci, list(pps), list(logbfs)
+
+
+def WriteResults(loci : "list[dict]", pps : "list[np.ndarray]", logbfs : "list[float]", gamma : np.ndarray,
+                 annotations : "list[str]", outdir : str) -> None :
+    """
+    writes LOCUS.results, Enrichment.Values, Log.BayesFactor and LogFile.results in the PAINTOR formats
+    """
+    for locus,pp in zip(loci, pps):
+        with open(os.path.join(outdir, f"{locus['name']}.results"), 'w') as f:
+            f.write(f"{locus['lines'][0]} Posterior_Prob\n")
+            f.writelines(f"{line} {p:.5e}\n" for line,p in zip(locus['lines'][1:], pp))
+
+    with open(os.path.join(outdir, "Enrichment.Values"), 'w') as f:
+        f.write(" ".join(["Baseline"] + annotations) + "\n")
+        f.write(" ".join("%g" % g for g in gamma) + "\n")
+
+    with open(os.path.join(outdir, "Log.BayesFactor"), 'w') as f:
+        f.write("%f\n" % sum(logbfs))
+
+    with open(os.path.join(outdir, "LogFile.results"), 'w') as f:
+        f.write("locus_name prior_variance ld_pcs\n")
+        f.writelines(f"{l['name']} {l['prior_variance']:g} {l['ld_pcs']}\n" for l in loci)
+
+    return None
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog --input filename.files --annotations annot1,annot2 [options]")
+    parser.add_option("--input", dest="input", default="filename.files")                                #File with the names of the loci, one per line (PAINTOR -input)
+    parser.add_option("--in", dest="indir", default=".")                                                #Directory of the locus, LD and annotation files (PAINTOR -in)
+    parser.add_option("--out", dest="outdir", default=".")                                              #Output directory (PAINTOR -out)
+    parser.add_option("--Zhead", dest="Zhead", default="Zscore")                                        #Zscore header of the locus files (PAINTOR -Zhead)
+    parser.add_option("--LDname", dest="LDname", default="ld")                                          #Suffix of the LD files: LOCUS.LDname as text or LOCUS.LDname.npy packed (PAINTOR -LDname)
+    parser.add_option("--annotations", dest="annotations", default="")                                  #Comma separated names of the annotations of the model (PAINTOR -annotations)
+    parser.add_option("--gamma_initial", dest="gamma_initial", default=None)                            #Comma separated initial enrichment values, baseline first (PAINTOR -GAMinitial, default log(15) then 0)
+    parser.add_option("--max_iter", dest="max_iter", default=15)                                        #Maximum number of EM iterations of the enrichment estimation (PAINTOR -MI)
+    parser.add_option("--tol", dest="tol", default=0.01)                                                #EM stops when the log Bayes factor changes by less than this
+    parser.add_option("--max_causal", dest="max_causal", default=0)                                     #Maximum number of causal SNPs of a configuration (0 means no cap, as PAINTOR -mcmc)
+    parser.add_option("--iterations", dest="iterations", default=10000)                                 #Number of iterations of the sampling of the loci with too many configurations
+    parser.add_option("--prop_ld", dest="prop_ld", default=0.95)                                        #Proportion of the LD variance kept to estimate the prior variance of a locus
+    parser.add_option("-t", "--threads", dest="threads", default=1)                                     #Number of loci processed in parallel
+    parser.add_option("--seed", dest="seed", default=1)                                                 #Seed of the sampling
+    (options, args) = parser.parse_args()
+
+    debut = time.time()
+
+    with open(options.input) as f:
+        names = [line.strip() for line in f if line.strip()]
+    annotations = [a for a in options.annotations.split(',') if a]
+    print(f"annotations: {' '.join(annotations)}\n")
+
+    if options.gamma_initial:
+        gamma = np.array(options.gamma_initial.split(','), dtype=np.float64)
+    else:
+        gamma = np.append(np.log(15), np.zeros(len(annotations)))
+    if len(gamma) != len(annotations) + 1:
+        parser.error(f"{len(gamma)} initial enrichment values for {len(annotations)} annotations and the baseline")
+
+    # the loci are read in the worker processes, the size of their zscore file gives their cost
+    read = partial(ReadLocus, indir=options.indir, Zhead=options.Zhead, LDname=options.LDname, annotations=annotations)
+    costs = {name : os.path.getsize(os.path.join(options.indir, name)) for name in names}
+    gamma,loci,pps,logbfs = FineMap(names, read, gamma, int(options.max_iter), float(options.tol), int(options.max_causal),
+                                    int(options.iterations), float(options.prop_ld), int(options.threads), int(options.seed), costs)
+    WriteResults(loci, pps, logbfs, gamma, annotations, options.outdir)
+
+    print("~~~~~ finemap finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# This module holds the logging, metrics and profiling helpers of the python scripts of the pipeline.
+# Metrics are timers (seconds and number of calls of the functions decorated with Timed, or of Timer blocks) and
+# counters (Count), collected in the active Metrics object: a script opens one with Collect for each unit of work
+# (e.g. a chromosome), and writes it as a JSON file at the end of the unit.
+# Profile runs a block under cProfile and tracemalloc and writes PREFIX.prof (readable with python -m pstats or
+# snakeviz) and PREFIX.tracemalloc.txt (peak traced memory and the lines that allocated the most memory).
+
+
+# IMPORTS --------------------------------------------------------------------
+import cProfile
+import tracemalloc
+import functools
+import contextlib
+import resource
+import logging
+import json
+import time
+import sys
+import os
+# ----------------------------------------------------------------------------
+
+
+# number of allocation sites written in the tracemalloc reports
+TRACEMALLOC_TOP = 30
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+class Metrics:
+    """
+    timers and counters of a unit of work
+    """
+    def __init__(self, name : str):
+        self.name = name
+        self.timers = {}
+        self.counters = {}
+        self.start = time.time()
+
+    def Count(self, counter : str, n : int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + int(n)
+
+    @contextlib.contextmanager
+    def Timer(self, timer : str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds,calls = self.timers.get(timer, (0.0, 0))
+            self.timers[timer] = (seconds + time.perf_counter() - start_time, calls + 1)
+
+    def Write(self, out_file : str, **info) -> None:
+        """
+        writes the metrics as JSON, with the wall time since their creation, the peak RSS of the process and info
+        """
+        report = {'name' : self.name, **info, 'seconds' : round(time.time() - self.start, 6),
+                  'peak_rss_mb' : round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                  'timers' : {t : {'seconds' : round(s, 6), 'calls' : c} for t,(s,c) in self.timers.items()},
+                  'counters' : self.counters}
+        with open(out_file, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+# stack of the metrics being collected, the last one is the active one
+ACTIVE_METRICS = [Metrics("main")]
+
+
+def ActiveMetrics() -> Metrics :
+    """
+    returns the metrics being collected
+    """
+    return ACTIVE_METRICS[-1]
+
+
+@contextlib.contextmanager
+def Collect(name : str):
+    """
+    makes a new Metrics object the active one for the duration of the block, and yields it
+    """
+    ACTIVE_METRICS.append(Metrics(name))
+    try:
+        yield ACTIVE_METRICS[-1]
+    finally:
+        ACTIVE_METRICS.pop()
+
+
+def Count(counter : str, n : int = 1) -> None :
+    """
+    adds n to a counter of the active metrics
+    """
+    ActiveMetrics().Count(counter, n)
+
+
+def Timed(function):
+    """
+    decorator adding the time of each call of the function to the timer of its name in the active metrics
+    (the time of a function includes the time of the timed functions it calls)
+    """
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        with ActiveMetrics().Timer(function.__name__):
+            return function(*args, **kwargs)
+
+    return timed
+
+
+@contextlib.contextmanager
+def Profile(prefix : str = None):
+    """
+    runs the block under cProfile and tracemalloc, and writes prefix.prof and prefix.tracemalloc.txt
+    (nothing is done when prefix is None)
+    """
+    if prefix is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{prefix}.prof")
+        current,peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP]
+        if not tracing:
+            tracemalloc.stop()
+        with open(f"{prefix}.tracemalloc.txt", 'w') as f:
+            f.write(f"# pid {os.getpid()}, traced memory: current {current / 2**20:.1f} MB, peak {peak / 2**20:.1f} MB\n")
+            f.writelines(f"{stat}\n" for stat in top)
+
+
+def SetupLogging(level : str = "INFO") -> None :
+    """
+    sends the log messages of the given level and above to the standard output, without decoration
+    """
+    logging.basicConfig(stream=sys.stdout, level=getattr(logging, level.upper()), format="%(message)s")
+
+# ----------------------------------------------------------------------------
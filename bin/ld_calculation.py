@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+
+# This script computes the LD matrices of the loci of a GWAS with the 1000 Genomes reference panel.
+# It replaces one CalcLD_1KG_VCF.py run per locus: each chromosome VCF is opened once through its tabix index,
+# the genotypes of all the loci of the chromosome are read in a single pass, and the LD matrices are computed
+# with numpy on the 0/1/2 dosages of the samples of the chosen population.
+# With --panel, genotypes are read from the packed store of panel_store.py (built on first use) instead of the vcf.
+# For each locus file LOCUS it writes, in the CalcLD_1KG_VCF.py formats:
+#   LOCUS.ld_out.ld.filtered         the LD matrix (pearson correlation between the snps kept)
+#   LOCUS.ld_out.processed.filtered  the locus snps kept (bi-allelic, alleles matching the panel, first snp of each position),
+#                                    zscores polarized on the panel
+# With --ld_format npy, the LD matrix is written as LOCUS.ld_out.ld.filtered.npy instead, the packed upper triangle of
+# ld_matrix.py (float32, or float16 with --ld_dtype), and exported as text only by the tasks running PAINTOR and CANVIS.
+# With --ld_format sparse, only the pairs of snps closer than --ld_window_kb (in the same row blocks) or with an r2 above
+# --ld_min_r2 are computed and kept, and the matrix is written as LOCUS.ld_out.ld.filtered.npz in CSR form (see
+# ld_matrix.py), so that the memory and time of large loci grow with the number of snps times the window instead of its
+# square. The error versus the dense matrix of the SPARSE_CHECK_SNPS first snps of each locus is reported in the log.
+# With --max_snps K, the loci with more than K snps are pruned before their matrix is computed: the snps are taken by
+# decreasing |zscore| and kept if their r2 with the snps already kept is below --prune_r2, until K snps are kept.
+# The loci are plain or gzipped locus files, or the CHRnn.loci files of main_V2.py --locus-format indexed, whose loci
+# are read at the byte offsets of their CHRnn.loci.idx index (the output files are then named after the loci).
+# With --ld_store, the LD matrices are read from (and added to) the persistent LD store of ld_store.py for the
+# reference panel and population, shared with the previous runs: only the LD of the snps not already in it is computed.
+# With --filter_only, it only removes the snps repeated at the same position from existing LOCUS.ld_out.ld and
+# LOCUS.ld_out.processed pairs (as written by CalcLD_1KG_VCF.py).
+
+
+# IMPORTS --------------------------------------------------------------------
+import pandas as pd
+import numpy as np
+import time
+import os
+import io
+import sys
+import gzip
+import subprocess
+import multiprocessing
+from functools import partial
+from optparse import OptionParser
+try:
+    import pysam
+except ImportError:
+    pysam = None
+from panel_store import IsPanelBuilt, BuildChromosomePanel, ReadPanelGenotypes
+from ld_matrix import WritePackedLD, WriteSparseLD, SparseLDSubset, SparseLDError
+from ld_store import LDStore, SnpKeys
+# ----------------------------------------------------------------------------
+
+
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+# LD matrices of loci with at least this number of snps are read into a memory-mapped file instead of memory
+MEMMAP_MIN_SNP = 5000
+
+# number of rows of a sparse LD matrix computed at once
+SPARSE_BLOCK = 512
+
+# the error of a sparse LD matrix is measured versus the dense matrix of at most this number of first snps of the locus
+SPARSE_CHECK_SNPS = 2000
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def ReadLdFile(ldfile : str) -> dict :
+    """
+    returns the dictionary chromosome number -> reference panel vcf path, read from the ldFile.txt file
+    """
+    ld = pd.read_csv(ldfile, sep='\t', header=None, names=['chr', 'vcf'], dtype=str)
+
+    return dict(zip(ld['chr'], ld['vcf']))
+
+
+def ReadPopulationSamples(map_file : str, population : str) -> "set[str]" :
+    """
+    returns the ids of the samples of the population in the map file (population or super population column)
+    """
+    samples = pd.read_csv(map_file, sep='\t', index_col=False, usecols=[0,1,2], dtype=str)
+    sample,pop,super_pop = samples.columns
+
+    return set(samples.loc[(samples[pop] == population) | (samples[super_pop] == population), sample])
+
+
+def LocusSources(files : "list[str]") -> dict :
+    """
+    returns the dictionary chromosome -> loci of the locus files of main_V2.py, where a locus is a file name (plain or
+    gzipped locus file) or a tuple (CHRnn.loci file, byte offset, byte length, locus name) read from the CHRnn.loci.idx
+    index of an indexed chromosome file (the .idx files themselves are skipped)
+    """
+    loci_per_chr = {}
+    for f in files:
+        if f.endswith('.loci.idx'):
+            continue
+        if f.endswith('.loci'):
+            index = pd.read_csv(f"{f}.idx", sep='\t', dtype={'locus' : str, 'chr' : str})
+            for locus in index.itertuples():
+                loci_per_chr.setdefault(locus.chr, []).append((f, locus.offset, locus.length, locus.locus))
+            continue
+        with (gzip.open(f, 'rt') if f.endswith('.gz') else open(f)) as fh:
+            fh.readline()
+            line = fh.readline()
+        if line:
+            loci_per_chr.setdefault(line.split()[0], []).append(f)
+        else:
+            print(f"{f} is empty, skipped")
+
+    return loci_per_chr
+
+
+def LocusOutName(locus) -> str :
+    """
+    returns the prefix of the output files of a locus (see LocusSources): the locus file name without .gz, or the
+    locus name next to the indexed chromosome file
+    """
+    if isinstance(locus, tuple):
+        return os.path.join(os.path.dirname(locus[0]), locus[3])
+
+    return locus[:-len('.gz')] if locus.endswith('.gz') else locus
+
+
+def ReadLocus(locus, Zhead : str) -> pd.DataFrame :
+    """
+    reads a locus (see LocusSources), keeping every column as text (so that they are written back unchanged) except the zscore
+    """
+    if isinstance(locus, tuple):
+        loci_file,offset,length,_ = locus
+        with open(loci_file, 'rb') as f:
+            f.seek(offset)
+            locus = io.BytesIO(f.read(length))
+    locus = pd.read_csv(locus, sep=' ', index_col=False, dtype=str, keep_default_na=False)
+    locus[Zhead] = locus[Zhead].astype(float)
+
+    return locus
+
+
+def VcfContig(vcf : str, chr : str) -> str :
+    """
+    returns the name of the chromosome in the vcf (1000 Genomes hg19 files use 1, hg38 files use chr1)
+    """
+    if pysam is not None:
+        contigs = pysam.TabixFile(vcf).contigs
+    else:
+        contigs = subprocess.run(["tabix", "-l", vcf], check=True, capture_output=True, text=True).stdout.split()
+
+    return chr if chr in contigs else f"chr{chr}"
+
+
+def FetchVcfLines(vcf : str, contig : str, regions : "list[tuple]"):
+    """
+    yields the header line (#CHROM...) then the vcf lines of the regions, read through the tabix index
+    regions must be sorted and non overlapping so that each vcf record is read once
+    """
+    if pysam is not None:
+        tabix = pysam.TabixFile(vcf)
+        yield tabix.header[-1]
+        for start,end in regions:
+            yield from tabix.fetch(contig, start - 1, end)
+    else:
+        header = subprocess.run(["tabix", "-H", vcf], check=True, capture_output=True, text=True).stdout.splitlines()
+        yield header[-1]
+        for start,end in regions:
+            with subprocess.Popen(["tabix", vcf, f"{contig}:{start}-{end}"], stdout=subprocess.PIPE, text=True) as p:
+                for line in p.stdout:
+                    yield line.rstrip('\n')
+
+
+def MergeRegions(loci : "list[pd.DataFrame]", pos : str) -> "list[tuple]" :
+    """
+    returns the sorted and merged (start, end) regions spanned by the loci
+    """
+    spans = sorted((int(l[pos].astype(int).min()), int(l[pos].astype(int).max())) for l in loci if len(l) > 0)
+    regions = []
+    for start,end in spans:
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], end))
+        else:
+            regions.append((start, end))
+
+    return regions
+
+
+def ReadGenotypes(vcf : str, chr : str, regions : "list[tuple]", positions : "set[int]", samples : "set[str]") -> dict :
+    """
+    returns the dictionary position -> list of (ref, alt, dosages) of the bi-allelic snps of the vcf at the given positions
+    dosages is an int8 array with the number of alternative alleles (0/1/2) of each sample of the population
+    """
+    start_time = time.time()
+    lines = FetchVcfLines(vcf, VcfContig(vcf, chr), regions)
+    header = next(lines).split('\t')
+    columns = np.array([9 + j for j,s in enumerate(header[9:]) if s in samples])
+    if len(columns) == 0:
+        sys.exit(f"No sample of the population found in {vcf}")
+
+    genotypes = {}
+    for line in lines:
+        # only the first fields are split until the record is known to be useful
+        fields = line.split('\t', 5)
+        p = int(fields[1])
+        ref,alt = fields[3].upper(),fields[4].upper()
+        if p not in positions or len(ref) != 1 or len(alt) != 1:
+            continue
+        fields = line.split('\t')
+        # the 3 first characters of a sample field are its genotype (0|1, 1/1...)
+        gt = np.frombuffer(''.join(fields[j][:3] for j in columns).encode(), dtype=np.uint8).reshape(-1,3)
+        dosages = (gt[:,0] == ord('1')).astype(np.int8) + (gt[:,2] == ord('1'))
+        genotypes.setdefault(p, []).append((ref, alt, dosages))
+
+    print(f"--- {len(genotypes)} positions of chromosome {chr} read from {vcf} in %s seconds ---\n" % (time.time() - start_time))
+    return genotypes
+
+
+def HarmonizeAlleles(a1 : np.ndarray, a2 : np.ndarray, ref : np.ndarray, alt : np.ndarray) -> np.ndarray :
+    """
+    returns, for arrays of locus alleles (effect, alternative) and panel alleles (ref, alt), 1 where the locus alleles are
+    the panel ones, -1 where they are swapped (the zscore has to be flipped) and 0 where they do not match;
+    strand flips are accepted, except for ambiguous A/T and C/G snps which never match
+    """
+    c1 = np.char.translate(a1, COMPLEMENT)
+    c2 = np.char.translate(a2, COMPLEMENT)
+    signs = np.select([(a1 == ref) & (a2 == alt), (a1 == alt) & (a2 == ref), (c1 == ref) & (c2 == alt), (c1 == alt) & (c2 == ref)],
+                      [1, -1, 1, -1], 0)
+    signs[c1 == a2] = 0
+
+    return signs
+
+
+def StandardizeDosages(dosages : np.ndarray) -> np.ndarray :
+    """
+    returns the dosages (snps x samples) centered and scaled to a unit norm per snp, so that the dot product of two
+    rows is their pearson correlation
+    """
+    g = dosages.astype(np.float32)
+    g -= g.mean(axis=1, keepdims=True)
+    g /= np.sqrt((g * g).sum(axis=1, keepdims=True))
+
+    return g
+
+
+def ComputeLD(dosages : np.ndarray) -> np.ndarray :
+    """
+    returns the pearson correlation matrix between the rows (snps) of the dosage matrix (snps x samples)
+    """
+    g = StandardizeDosages(dosages)
+    ld = g @ g.T
+    np.clip(ld, -1, 1, out=ld)
+    np.fill_diagonal(ld, 1)
+
+    return ld
+
+
+def SparseLD(dosages : np.ndarray, positions : np.ndarray, window : int = 0, min_r2 : float = 0) -> dict :
+    """
+    returns the sparse LD matrix (see ld_matrix.py) of the rows (snps, sorted by position) of the dosage matrix, with
+    the correlations of the pairs of snps at most window bp apart (all the pairs with window 0) whose r2 is at least
+    min_r2; only the columns within the window of a block of SPARSE_BLOCK rows are computed
+    """
+    g = StandardizeDosages(dosages)
+    nb_snp = len(g)
+    counts,indices,data = [],[],[]
+    for first in range(0, nb_snp, SPARSE_BLOCK):
+        last = min(first + SPARSE_BLOCK, nb_snp)
+        low = np.searchsorted(positions, positions[first] - window, 'left') if window else 0
+        high = np.searchsorted(positions, positions[last - 1] + window, 'right') if window else nb_snp
+        ld = g[first:last] @ g[low:high].T
+        np.clip(ld, -1, 1, out=ld)
+        keep = ld * ld >= min_r2
+        if window:
+            keep &= np.abs(positions[first:last, None] - positions[None, low:high]) <= window
+        diagonal = np.arange(last - first), np.arange(first, last) - low
+        ld[diagonal],keep[diagonal] = 1,True
+        rows,cols = np.nonzero(keep)
+        counts.append(np.bincount(rows, minlength=last - first))
+        indices.append((cols + low).astype(np.int32))
+        data.append(ld[rows, cols])
+
+    return {'nb_snp' : nb_snp, 'indptr' : np.append(0, np.cumsum(np.concatenate(counts) if counts else [])).astype(np.int64),
+            'indices' : np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+            'data' : np.concatenate(data) if data else np.zeros(0, dtype=np.float32)}
+
+
+def PruneByLD(dosages : np.ndarray, scores : np.ndarray, max_snps : int, prune_r2 : float) -> np.ndarray :
+    """
+    returns the sorted indices of at most max_snps snps, taken by decreasing score and kept when their r2 with all the
+    snps already kept is below prune_r2 (only the correlations with the kept snps are computed, not the whole matrix)
+    """
+    g = StandardizeDosages(dosages)
+    kept = np.empty(max_snps, dtype=np.int64)
+    basis = np.empty((max_snps, g.shape[1]), dtype=np.float32)
+    k = 0
+    for j in np.argsort(-scores, kind='stable'):
+        if k and np.max((basis[:k] @ g[j]) ** 2) >= prune_r2:
+            continue
+        kept[k],basis[k] = j,g[j]
+        k += 1
+        if k == max_snps:
+            break
+
+    return np.sort(kept[:k])
+
+
+def LocusLD(locus : pd.DataFrame, genotypes : dict, pos : str, effect_allele : str, alt_allele : str, Zhead : str,
+            max_snps : int = 0, prune_r2 : float = 0.8, store : LDStore = None, chr : str = None, source : str = None,
+            sparse : tuple = None) -> tuple :
+    """
+    returns (processed locus, LD matrix) for one locus sorted by position: keeps the snps found in the panel with
+    matching alleles and not monomorphic in the population, and polarizes their zscores on the panel alleles
+    loci with more than max_snps such snps (if max_snps > 0) are pruned by LD first (see PruneByLD)
+    with a store, the LD is taken from the LD store when it holds the snps (source identifies the panel vcf of chr)
+    with sparse = (window in bp, r2 floor), the LD is a sparse matrix (see SparseLD), with its error versus the dense
+    matrix of the SPARSE_CHECK_SNPS first snps as 'error'
+    """
+    # every (locus snp, panel snp at the same position) pair is a candidate, the first valid one of each locus snp is kept
+    records = [(row, ref, alt, d) for row,p in enumerate(locus[pos].astype(int)) for ref,alt,d in genotypes.get(p, [])]
+    if len(records) == 0:
+        return locus.iloc[[]].reset_index(drop=True), np.zeros((0,0), dtype=np.float32)
+    rows = np.array([r for r,_,_,_ in records])
+    a1 = locus[effect_allele].str.upper().to_numpy(dtype=str)[rows]
+    a2 = locus[alt_allele].str.upper().to_numpy(dtype=str)[rows]
+    signs = HarmonizeAlleles(a1, a2, np.array([r for _,r,_,_ in records]), np.array([a for _,_,a,_ in records]))
+    polymorphic = np.array([d.min() != d.max() for _,_,_,d in records])
+
+    valid = np.flatnonzero((signs != 0) & polymorphic)
+    keep,first = np.unique(rows[valid], return_index=True)
+    chosen = valid[first]
+
+    processed = locus.iloc[keep].reset_index(drop=True)
+    processed[Zhead] = processed[Zhead] * signs[chosen]
+    if len(chosen) == 0:
+        return processed, np.zeros((0,0), dtype=np.float32)
+
+    dosages = np.vstack([records[k][3] for k in chosen])
+    if max_snps > 0 and len(chosen) > max_snps:
+        kept = PruneByLD(dosages, np.abs(processed[Zhead].to_numpy(dtype=float)), max_snps, prune_r2)
+        processed,dosages,chosen = processed.iloc[kept].reset_index(drop=True),dosages[kept],chosen[kept]
+    if sparse is not None:
+        ld = SparseLD(dosages, processed[pos].astype(int).to_numpy(), *sparse)
+        ld['error'] = SparseLDError(ld, ComputeLD(dosages[:SPARSE_CHECK_SNPS]))
+    elif store is None:
+        ld = ComputeLD(dosages)
+    else:
+        positions = processed[pos].astype(int).to_numpy()
+        snps = SnpKeys(chr, positions, [records[k][1] for k in chosen], [records[k][2] for k in chosen])
+        ld = store.LD(source, chr, positions, snps, StandardizeDosages(dosages))
+
+    return processed, ld
+
+
+def FilterDuplicatePositions(processed : pd.DataFrame, ld : np.ndarray, pos : str) -> tuple :
+    """
+    removes the snps repeated at the same chromosome and position (all but the first one) from the processed locus
+    and from both dimensions of the LD matrix (dense or sparse)
+    """
+    keep = ~processed.duplicated([processed.columns[0], pos]).to_numpy()
+    if keep.all():
+        return processed, ld
+    if isinstance(ld, dict):
+        return processed[keep].reset_index(drop=True), {**SparseLDSubset(ld, keep), 'error' : ld.get('error')}
+
+    return processed[keep].reset_index(drop=True), ld[keep][:, keep]
+
+
+def ReadLDMatrix(ld_file : str, nb_snp : int) -> np.ndarray :
+    """
+    reads a text LD matrix of nb_snp snps as float32, into a memory-mapped temporary file for large loci
+    """
+    if nb_snp >= MEMMAP_MIN_SNP:
+        ld = np.lib.format.open_memmap(f"{ld_file}.npy.tmp", mode='w+', dtype=np.float32, shape=(nb_snp, nb_snp))
+    else:
+        ld = np.empty((nb_snp, nb_snp), dtype=np.float32)
+    with open(ld_file) as f:
+        for i,line in enumerate(f):
+            ld[i] = np.array(line.split(), dtype=np.float32)
+
+    return ld
+
+
+def WriteLocusLD(processed : pd.DataFrame, ld : np.ndarray, out_name : str, ld_format : str = 'text', ld_dtype : str = 'float32') -> None :
+    """
+    writes out_name.processed.filtered and out_name.ld.filtered in the CalcLD_1KG_VCF.py formats,
+    or out_name.ld.filtered.npy (packed upper triangle, see ld_matrix.py) with the npy format, or
+    out_name.ld.filtered.npz (CSR) for a sparse matrix
+    """
+    processed.to_csv(f"{out_name}.processed.filtered", index=False, sep=' ')
+    if ld_format == 'sparse':
+        if not isinstance(ld, dict):
+            # loci without any snp kept
+            ld = {'nb_snp' : 0, 'indptr' : np.zeros(1, dtype=np.int64), 'indices' : np.zeros(0, dtype=np.int32), 'data' : ld.ravel()}
+        WriteSparseLD(ld, f"{out_name}.ld.filtered.npz", ld_dtype)
+    elif ld_format == 'npy':
+        WritePackedLD(ld, f"{out_name}.ld.filtered.npy", ld_dtype)
+    else:
+        np.savetxt(f"{out_name}.ld.filtered", ld, fmt='%1.4e', delimiter=' ')
+
+    return None
+
+
+def FilterLocusLD(out_name : str, pos : str) -> None :
+    """
+    removes the snps repeated at the same position from an existing out_name.ld / out_name.processed pair
+    and writes out_name.ld.filtered / out_name.processed.filtered
+    """
+    processed = pd.read_csv(f"{out_name}.processed", sep=' ', index_col=False, dtype=str, keep_default_na=False)
+    ld = ReadLDMatrix(f"{out_name}.ld", len(processed))
+    WriteLocusLD(*FilterDuplicatePositions(processed, ld, pos), out_name)
+    if isinstance(ld, np.memmap):
+        os.remove(ld.filename)
+
+    return None
+
+
+def ProcessChromosome(chr_loci : tuple, ld_files : dict, samples : "set[str]", pos : str, effect_allele : str, alt_allele : str, Zhead : str,
+                      panel_dir : str = None, map_file : str = None, max_snps : int = 0, prune_r2 : float = 0.8,
+                      ld_format : str = 'text', ld_dtype : str = 'float32', ld_store : str = None, ld_store_bytes : int = 0,
+                      ld_window : int = 0, ld_min_r2 : float = 0) -> str :
+    """
+    computes and writes the LD files of all the loci of one chromosome, reading its vcf (or its packed store) once
+    chr_loci is a tuple (chromosome number, list of loci as returned by LocusSources)
+    with ld_store, the LD matrices go through the LD store of this directory (bounded to ld_store_bytes)
+    with the sparse format, only the pairs within ld_window bp or with an r2 above ld_min_r2 are computed (no LD store)
+    """
+    start_time = time.time()
+    chr,locus_files = chr_loci
+    loci = [ReadLocus(f, Zhead) for f in locus_files]
+    positions = set(int(p) for l in loci for p in l[pos])
+    if panel_dir is None:
+        genotypes = ReadGenotypes(ld_files[chr], chr, MergeRegions(loci, pos), positions, samples)
+    else:
+        if not IsPanelBuilt(panel_dir, chr, ld_files[chr]):
+            BuildChromosomePanel(chr, ld_files[chr], map_file, panel_dir)
+        genotypes = ReadPanelGenotypes(panel_dir, chr, positions, samples)
+
+    store = LDStore(ld_store, ld_store_bytes) if ld_store and ld_format != 'sparse' else None
+    sparse = (ld_window, ld_min_r2) if ld_format == 'sparse' else None
+    # the panel vcf is identified by its name and size, which do not depend on where a run stages it
+    source = f"{os.path.basename(ld_files[chr])}:{os.path.getsize(ld_files[chr])}"
+    for locus_file,locus in zip(locus_files, loci):
+        processed,ld = FilterDuplicatePositions(*LocusLD(locus, genotypes, pos, effect_allele, alt_allele, Zhead, max_snps, prune_r2,
+                                                         store, chr, source, sparse), pos)
+        WriteLocusLD(processed, ld, f"{LocusOutName(locus_file)}.ld_out", ld_format, ld_dtype)
+        print(f"{LocusOutName(locus_file)} : {len(processed)} of {len(locus)} SNPs kept")
+        if isinstance(ld, dict) and ld.get('error') is not None:
+            e = ld['error']
+            print(f"    sparse LD : {len(ld['data'])} pairs stored ({100 * len(ld['data']) / max(len(processed), 1) ** 2:.2f}%), "
+                  f"versus the dense LD of the {e['snps']} first SNPs : max absolute error {e['max_abs']:.4g}, "
+                  f"relative frobenius error {e['rel_frobenius']:.4g}")
+    if store is not None:
+        print(f"LD store of chromosome {chr}: {store.Report()}")
+
+    print(f"--- LD of the {len(loci)} loci of chromosome {chr} computed in %s seconds ---\n" % (time.time() - start_time))
+    return chr
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog [options] locus1 locus2 ... | %prog [options] CHR01.loci CHR02.loci ...")
+    parser.add_option("-r", "--reference", dest="ld_file", default="ldFile.txt")                        #File with the chromosome number and the reference panel vcf of each chromosome
+    parser.add_option("-m", "--map_file", dest="map_file", default="mapFile.txt")                       #Sample to population map file of the reference panel
+    parser.add_option("--population", dest="population", default="EUR")                                 #Population (or super population) of the samples used to compute LD
+    parser.add_option("--effect_allele", dest="effect_allele", default="Allele1")                       #Effect allele header
+    parser.add_option("--alt_allele", dest="alt_allele", default="Allele2")                             #Alternative allele header
+    parser.add_option("--Zhead", dest="Zhead", default="Zscore")                                        #Zscore header
+    parser.add_option("--position", dest="pos", default="BP")                                           #Position of SNP header
+    parser.add_option("-t", "--threads", dest="threads", default=1)                                     #Number of chromosomes processed in parallel
+    parser.add_option("-p", "--panel", dest="panel_dir", default=None)                                  #Directory of the packed genotype store (see panel_store.py), the vcfs are read directly by default
+    parser.add_option("--max_snps", dest="max_snps", default=0)                                         #Maximum number of SNPs of a locus, larger loci are pruned by LD (0 means no cap)
+    parser.add_option("--prune_r2", dest="prune_r2", default=0.8)                                       #r2 threshold of the LD pruning of the loci above --max_snps
+    parser.add_option("--ld_format", dest="ld_format", default="text")                                  #Format of the LD matrices: text (CalcLD_1KG_VCF.py format), npy (packed upper triangle) or sparse (CSR .npz)
+    parser.add_option("--ld_dtype", dest="ld_dtype", default="float32")                                 #Type of the values of the npy LD matrices: float32 or float16
+    parser.add_option("--ld_window_kb", dest="ld_window_kb", default=0)                                 #Largest distance in kb between the SNPs of a pair of the sparse LD matrices (0 means no limit)
+    parser.add_option("--ld_min_r2", dest="ld_min_r2", default=0)                                       #Smallest r2 of a pair of the sparse LD matrices (0 means no floor)
+    parser.add_option("--ld_store", dest="ld_store", default=None)                                      #Directory of the persistent LD store of the reference panel (see ld_store.py), one store per population in it
+    parser.add_option("--ld_store_max_gb", dest="ld_store_max_gb", default=0)                           #Maximum size of the LD store of the population in GB, least recently used blocks are removed above it (0 means no limit)
+    parser.add_option("--filter_only", dest="filter_only", action="store_true", default=False)          #Only remove the repeated positions of existing LOCUS.ld_out.ld / LOCUS.ld_out.processed pairs
+    (options, args) = parser.parse_args()
+
+    if len(args) == 0:
+        parser.error("no locus file given")
+    if options.ld_store and options.ld_format == 'sparse':
+        print("The LD store holds dense matrices, it is not used with the sparse LD format\n")
+
+    debut = time.time()
+
+    if options.filter_only:
+        for locus_file in args:
+            FilterLocusLD(f"{locus_file}.ld_out", options.pos)
+        print("~~~~~ ld_calculation finished in %s seconds ~~~~~\n" % (time.time() - debut))
+        return 0
+
+    ld_files = ReadLdFile(options.ld_file)
+    samples = ReadPopulationSamples(options.map_file, options.population)
+    print(f"{len(samples)} samples in population {options.population}\n")
+
+    # loci are grouped by chromosome (first column of the first snp of the locus), the biggest chromosomes first
+    chr_loci = sorted(LocusSources(args).items(), key=lambda c: len(c[1]), reverse=True)
+
+    process_chromosome = partial(ProcessChromosome, ld_files=ld_files, samples=samples, pos=options.pos,
+                                 effect_allele=options.effect_allele, alt_allele=options.alt_allele, Zhead=options.Zhead,
+                                 panel_dir=options.panel_dir, map_file=options.map_file,
+                                 max_snps=int(options.max_snps), prune_r2=float(options.prune_r2),
+                                 ld_format=options.ld_format, ld_dtype=options.ld_dtype,
+                                 ld_store=os.path.join(options.ld_store, options.population) if options.ld_store else None,
+                                 ld_store_bytes=int(float(options.ld_store_max_gb) * 2**30),
+                                 ld_window=int(float(options.ld_window_kb) * 1000), ld_min_r2=float(options.ld_min_r2))
+    threads = min(int(options.threads), len(chr_loci))
+    if threads <= 1:
+        for c in chr_loci:
+            process_chromosome(c)
+    else:
+        with multiprocessing.get_context("fork").Pool(threads) as p:
+            for chr in p.imap_unordered(process_chromosome, chr_loci, chunksize=1):
+                print(f"Chromosome {chr} done !\n")
+
+    print("~~~~~ ld_calculation finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
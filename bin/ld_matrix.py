@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+# This script reads and writes the binary LD matrices of the pipeline.
+# An LD matrix of n snps is symmetric, so only its upper triangle (diagonal included) is stored: the n*(n+1)/2 values
+# of the rows ld[i, i:] one after the other, in a float32 (or float16) .npy file that can be memory-mapped.
+# This is 4 to 8 times smaller than the %1.4e text matrices of CalcLD_1KG_VCF.py, which are only needed by PAINTOR
+# and CANVIS: they are exported from the binary matrices in the task that runs these tools.
+#   ld_matrix.py --text LOCUS.ld_out.ld.filtered.npy LOCUS.ld        exports a binary matrix as text
+#   ld_matrix.py --pack LOCUS.ld_out.ld.filtered LOCUS.ld.npy         converts a text matrix into a binary matrix
+# The sparse LD matrices of ld_calculation.py --ld_format sparse (only the pairs of snps closer than a window or above an
+# r2 floor) are .npz files holding the symmetric matrix in CSR form (data, indices, indptr and shape, the layout of
+# scipy.sparse.save_npz), densified only when they are exported as text or read by a tool that needs the whole matrix.
+#   ld_matrix.py --text LOCUS.ld_out.ld.filtered.npz LOCUS.ld        exports a sparse matrix as text (missing pairs are 0)
+#   ld_matrix.py --error LOCUS.ld.npz LOCUS.ld.npy                    reports the error of a sparse matrix versus the dense one
+# LocusName gives the locus of a pipeline file (LD matrix, processed locus, annotations, results), for the scripts
+# that group the files of the loci.
+
+
+# IMPORTS --------------------------------------------------------------------
+import numpy as np
+import time
+import os
+from optparse import OptionParser
+# ----------------------------------------------------------------------------
+
+
+# number of rows formatted at once by the text export
+EXPORT_BLOCK = 256
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def LocusName(file : str) -> str :
+    """
+    returns the locus name of a pipeline file (what comes before the first dot, e.g. CHR01locus1)
+    """
+    return os.path.basename(file).split('.')[0]
+
+
+def TriangleOffsets(nb_snp : int) -> np.ndarray :
+    """
+    returns the position of ld[i, i] in the packed upper triangle, for each row i
+    """
+    i = np.arange(nb_snp, dtype=np.int64)
+
+    return i * nb_snp - i * (i - 1) // 2
+
+
+def TriangleSize(nb_value : int) -> int :
+    """
+    returns the number of snps of a packed upper triangle of nb_value values
+    """
+    return int((np.sqrt(8 * nb_value + 1) - 1) // 2)
+
+
+def WritePackedLD(ld : np.ndarray, out_file : str, dtype : str = 'float32') -> None :
+    """
+    writes the upper triangle of a square LD matrix to a .npy file, row after row
+    """
+    nb_snp = len(ld)
+    offsets = TriangleOffsets(nb_snp)
+    packed = np.lib.format.open_memmap(out_file, mode='w+', dtype=dtype, shape=(nb_snp * (nb_snp + 1) // 2,))
+    for i in range(nb_snp):
+        packed[offsets[i]:offsets[i] + nb_snp - i] = ld[i, i:]
+    packed.flush()
+    del packed
+
+    return None
+
+
+def ReadPackedLD(ld_file : str) -> tuple :
+    """
+    returns (number of snps, memory-mapped packed upper triangle) of a binary LD matrix
+    """
+    packed = np.load(ld_file, mmap_mode='r')
+
+    return TriangleSize(len(packed)), packed
+
+
+def LDRows(packed : np.ndarray, nb_snp : int, first : int, last : int) -> np.ndarray :
+    """
+    returns the rows first to last-1 of the square LD matrix, as float32
+    """
+    offsets = TriangleOffsets(nb_snp)
+    rows = np.empty((last - first, nb_snp), dtype=np.float32)
+    for k,i in enumerate(range(first, last)):
+        # ld[i, :i] is the column i of the rows above, ld[i, i:] is the stored row
+        rows[k, :i] = packed[offsets[:i] + i - np.arange(i)]
+        rows[k, i:] = packed[offsets[i]:offsets[i] + nb_snp - i]
+
+    return rows
+
+
+def LDSubMatrix(packed : np.ndarray, nb_snp : int, index : np.ndarray) -> np.ndarray :
+    """
+    returns the square LD matrix of the snps of index (row numbers in the packed matrix), as float32, EXPORT_BLOCK
+    rows at a time
+    """
+    offsets = TriangleOffsets(nb_snp)
+    index = np.asarray(index, dtype=np.int64)
+    sub = np.empty((len(index), len(index)), dtype=np.float32)
+    for first in range(0, len(index), EXPORT_BLOCK):
+        i = index[first:first + EXPORT_BLOCK, None]
+        low,high = np.minimum(i, index[None, :]),np.maximum(i, index[None, :])
+        sub[first:first + len(i)] = packed[offsets[low] + high - low]
+
+    return sub
+
+
+def WriteSparseLD(sparse : dict, out_file : str, dtype : str = 'float32') -> None :
+    """
+    writes a sparse LD matrix (dictionary nb_snp, indptr, indices, data of the symmetric matrix in CSR form) to a
+    .npz file, in the layout of scipy.sparse.save_npz
+    """
+    nb_snp = sparse['nb_snp']
+    # np.savez adds .npz to the names without it, the temporary name keeps it so that the rename finds the file
+    np.savez(f"{out_file}.tmp.npz", format=np.array(b'csr'), shape=np.array([nb_snp, nb_snp]), indptr=sparse['indptr'],
+             indices=sparse['indices'], data=sparse['data'].astype(dtype))
+    os.replace(f"{out_file}.tmp.npz", out_file)
+
+    return None
+
+
+def ReadSparseLD(ld_file : str) -> dict :
+    """
+    returns the sparse LD matrix of a .npz file (dictionary nb_snp, indptr, indices, data)
+    """
+    with np.load(ld_file) as f:
+        if f['format'].item() not in (b'csr', 'csr'):
+            raise ValueError(f"{ld_file}: {f['format'].item()} matrix, csr expected")
+        return {'nb_snp' : int(f['shape'][0]), 'indptr' : f['indptr'], 'indices' : f['indices'], 'data' : f['data']}
+
+
+def SparseLDRows(sparse : dict, first : int, last : int, nb_col : int = None) -> np.ndarray :
+    """
+    returns the rows first to last-1 of a sparse LD matrix as dense float32 rows, restricted to the nb_col first
+    columns when given (the pairs that are not stored are 0)
+    """
+    nb_col = sparse['nb_snp'] if nb_col is None else nb_col
+    start,end = sparse['indptr'][first],sparse['indptr'][last]
+    rows = np.repeat(np.arange(last - first), np.diff(sparse['indptr'][first:last + 1]))
+    cols = sparse['indices'][start:end]
+    kept = cols < nb_col
+    dense = np.zeros((last - first, nb_col), dtype=np.float32)
+    dense[rows[kept], cols[kept]] = sparse['data'][start:end][kept]
+
+    return dense
+
+
+def SparseLDSubset(sparse : dict, keep : np.ndarray) -> dict :
+    """
+    returns the sparse LD matrix of the snps of the boolean mask keep, in both dimensions
+    """
+    rows = np.repeat(np.arange(sparse['nb_snp']), np.diff(sparse['indptr']))
+    kept = keep[rows] & keep[sparse['indices']]
+    new_index = np.cumsum(keep) - 1
+    counts = np.bincount(new_index[rows[kept]], minlength=int(keep.sum()))
+
+    return {'nb_snp' : int(keep.sum()), 'indptr' : np.append(0, np.cumsum(counts)).astype(np.int64),
+            'indices' : new_index[sparse['indices'][kept]].astype(np.int32), 'data' : sparse['data'][kept]}
+
+
+def SparseLDError(sparse : dict, dense : np.ndarray) -> dict :
+    """
+    returns the error of a sparse LD matrix versus the dense matrix of its len(dense) first snps: largest absolute
+    difference, frobenius norm of the difference relative to the one of the dense matrix, and fraction of the pairs
+    stored
+    """
+    nb_snp = len(dense)
+    diff = SparseLDRows(sparse, 0, nb_snp, nb_snp) - dense
+    stored = np.count_nonzero(sparse['indices'][:sparse['indptr'][nb_snp]] < nb_snp)
+
+    return {'snps' : nb_snp, 'max_abs' : float(np.abs(diff).max()) if nb_snp else 0.0,
+            'rel_frobenius' : float(np.linalg.norm(diff) / max(np.linalg.norm(dense), 1e-12)),
+            'stored' : stored / max(nb_snp * nb_snp, 1)}
+
+
+def UnpackLD(ld_file : str) -> np.ndarray :
+    """
+    returns the square LD matrix of a binary (.npy) or sparse (.npz) LD file, as float32
+    """
+    if ld_file.endswith('.npz'):
+        sparse = ReadSparseLD(ld_file)
+        return SparseLDRows(sparse, 0, sparse['nb_snp'])
+
+    nb_snp,packed = ReadPackedLD(ld_file)
+
+    return LDRows(packed, nb_snp, 0, nb_snp)
+
+
+def ExportLDText(ld_file : str, out_file : str) -> int :
+    """
+    writes a binary or sparse LD matrix as a text matrix (%1.4e, space separated), EXPORT_BLOCK rows at a time,
+    returns the number of snps
+    """
+    if ld_file.endswith('.npz'):
+        sparse = ReadSparseLD(ld_file)
+        nb_snp,rows = sparse['nb_snp'],lambda first, last: SparseLDRows(sparse, first, last)
+    else:
+        nb_snp,packed = ReadPackedLD(ld_file)
+        rows = lambda first, last: LDRows(packed, nb_snp, first, last)
+    with open(out_file, 'w') as f:
+        for first in range(0, nb_snp, EXPORT_BLOCK):
+            np.savetxt(f, rows(first, min(first + EXPORT_BLOCK, nb_snp)), fmt='%1.4e', delimiter=' ')
+
+    return nb_snp
+
+
+def PackLDText(ld_file : str, out_file : str, dtype : str = 'float32') -> int :
+    """
+    converts a text LD matrix into a binary LD matrix, one line at a time, returns the number of snps
+    """
+    with open(ld_file) as f:
+        first = np.array(f.readline().split(), dtype=np.float32)
+        nb_snp = len(first)
+        offsets = TriangleOffsets(nb_snp)
+        packed = np.lib.format.open_memmap(out_file, mode='w+', dtype=dtype, shape=(nb_snp * (nb_snp + 1) // 2,))
+        if nb_snp:
+            packed[:nb_snp] = first
+        for i,line in enumerate(f, start=1):
+            packed[offsets[i]:offsets[i] + nb_snp - i] = np.array(line.split()[i:], dtype=np.float32)
+    packed.flush()
+
+    return nb_snp
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog --text matrix.npy matrix.txt | %prog --pack matrix.txt matrix.npy | %prog --error sparse.npz dense.npy")
+    parser.add_option("--text", dest="text", action="store_true", default=False)                        #Export a binary or sparse LD matrix as a text matrix
+    parser.add_option("--pack", dest="pack", action="store_true", default=False)                        #Convert a text LD matrix into a binary LD matrix
+    parser.add_option("--error", dest="error", action="store_true", default=False)                      #Report the error of a sparse LD matrix versus the dense (binary or text) matrix of the same locus
+    parser.add_option("--dtype", dest="dtype", default="float32")                                       #Type of the values of the binary matrix written by --pack (float32 or float16)
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2 or options.text + options.pack + options.error != 1:
+        parser.error("one of --text, --pack or --error, and two files are needed")
+
+    debut = time.time()
+
+    if options.error:
+        sparse = ReadSparseLD(args[0])
+        dense = UnpackLD(args[1]) if args[1].endswith('.npy') else np.loadtxt(args[1], ndmin=2, dtype=np.float32)
+        if len(dense) != sparse['nb_snp']:
+            parser.error(f"{args[0]} has {sparse['nb_snp']} SNPs and {args[1]} {len(dense)}")
+        error = SparseLDError(sparse, dense)
+        print(f"{args[0]} versus {args[1]} ({error['snps']} SNPs, {100 * error['stored']:.2f}% of the pairs stored) : "
+              f"max absolute error {error['max_abs']:.4g}, relative frobenius error {error['rel_frobenius']:.4g}")
+        return 0
+    if options.text:
+        nb_snp = ExportLDText(args[0], args[1])
+    else:
+        nb_snp = PackLDText(args[0], args[1], options.dtype)
+    print(f"--- LD matrix of {nb_snp} SNPs written to {args[1]} in %s seconds ---" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# This script holds the persistent LD store shared by the runs of the pipeline, so that the LD of loci already computed
+# for another trait (same reference panel and population) is read back instead of being computed again.
+# The store of a panel and population (STORE/PANEL/POPULATION) holds LD blocks, each one made of:
+#   DIGEST.snps.npy   the panel snps of the block (chromosome:position:ref:alt), in the order of the matrix
+#   DIGEST.ld.npy     the LD matrix of the block, packed upper triangle in float32 (see ld_matrix.py)
+# and index.json, with for each block its source (panel vcf of the chromosome, name and size), chromosome, first and
+# last positions, number of snps, size and last use.
+# DIGEST is the sha1 of the source and of the snps of the block.
+# The LD of a set of snps is taken, in this order of preference, from the blocks of the same source (the blocks of a
+# panel vcf that was replaced are never used, and leave the store as the least recently used ones):
+#   - the block of exactly these snps
+#   - a block holding all these snps, whose sub-matrix is extracted
+#   - the block sharing the most snps with the set: only the rows of the other snps are computed, and the matrix
+#     assembled from both is added to the store as a new block
+#   - a full computation, added to the store as a new block
+# The store is bounded in size: when it grows above its maximum size, the least recently used blocks are removed.
+# Several tasks and runs share a store: the index is only updated under a lock, and the block files are written under
+# a temporary name first.
+#   ld_store.py --store STORE/PANEL/POPULATION [--max_gb N]      lists the blocks of a store, evicting down to N GB
+
+
+# IMPORTS --------------------------------------------------------------------
+import numpy as np
+import hashlib
+import fcntl
+import json
+import time
+import os
+from optparse import OptionParser
+from ld_matrix import WritePackedLD, ReadPackedLD, LDSubMatrix
+# ----------------------------------------------------------------------------
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def SnpKeys(chr : str, positions : np.ndarray, ref : np.ndarray, alt : np.ndarray) -> np.ndarray :
+    """
+    returns the keys chromosome:position:ref:alt of panel snps
+    """
+    return np.array([f"{chr}:{p}:{r}:{a}" for p,r,a in zip(positions, ref, alt)], dtype=str)
+
+
+def StandardizedLDRows(g : np.ndarray, rows : np.ndarray) -> np.ndarray :
+    """
+    returns the LD between the snps of rows and all the snps, from their standardized dosages (see
+    ld_calculation.StandardizeDosages), clipped to [-1, 1] as ld_calculation.ComputeLD
+    """
+    ld = g[rows] @ g.T
+    np.clip(ld, -1, 1, out=ld)
+    ld[np.arange(len(rows)), rows] = 1
+
+    return ld
+
+
+class LDStore:
+    """
+    LD blocks of a reference panel and population, with their index
+    """
+    def __init__(self, store_dir : str, max_bytes : int = 0):
+        self.dir = os.path.abspath(store_dir)
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(self.dir, "index.json")
+        self.counters = {'exact' : 0, 'submatrix' : 0, 'partial' : 0, 'computed' : 0, 'snps_computed' : 0, 'snps_reused' : 0}
+        os.makedirs(self.dir, exist_ok=True)
+
+    def Path(self, digest : str, kind : str) -> str :
+        return os.path.join(self.dir, f"{digest}.{kind}.npy")
+
+    def ReadIndex(self) -> dict :
+        if not os.path.exists(self.index_file):
+            return {}
+        with open(self.index_file) as f:
+            return json.load(f)
+
+    def UpdateIndex(self, update) -> dict :
+        """
+        applies update to the index (read again under the lock, as other tasks and runs write it too), then removes
+        the least recently used blocks while the store is above its maximum size, returns the index
+        """
+        with open(self.index_file + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self.ReadIndex()
+            update(index)
+            total = sum(e['bytes'] for e in index.values())
+            for digest in sorted(index, key=lambda d: index[d]['last_used']):
+                if self.max_bytes <= 0 or total <= self.max_bytes:
+                    break
+                total -= index.pop(digest)['bytes']
+                for kind in ('snps', 'ld'):
+                    if os.path.exists(self.Path(digest, kind)):
+                        os.remove(self.Path(digest, kind))
+            with open(self.index_file + ".tmp", 'w') as f:
+                json.dump(index, f, indent=1, sort_keys=True)
+            os.replace(self.index_file + ".tmp", self.index_file)
+
+        return index
+
+    def Touch(self, digest : str) -> None :
+        def touch(index):
+            if digest in index:
+                index[digest]['last_used'] = time.time()
+        self.UpdateIndex(touch)
+
+        return None
+
+    def Add(self, digest : str, source : str, chr : str, positions : np.ndarray, snps : np.ndarray, ld : np.ndarray) -> None :
+        """
+        writes a block (under temporary names, then renamed) and adds it to the index
+        blocks larger than the maximum size of the store are not kept
+        """
+        nb_bytes = 4 * len(snps) * (len(snps) + 1) // 2 + snps.nbytes
+        if self.max_bytes > 0 and nb_bytes > self.max_bytes:
+            return None
+        tmp = f"{os.getpid()}.tmp"
+        np.save(self.Path(digest, f"snps.{tmp}"), snps)
+        WritePackedLD(ld, self.Path(digest, f"ld.{tmp}"), 'float32')
+        for kind in ('snps', 'ld'):
+            os.replace(self.Path(digest, f"{kind}.{tmp}"), self.Path(digest, kind))
+
+        def add(index):
+            index[digest] = {'source' : source, 'chr' : chr, 'first' : int(positions.min()), 'last' : int(positions.max()),
+                             'nb_snp' : len(snps), 'bytes' : nb_bytes, 'last_used' : time.time()}
+        self.UpdateIndex(add)
+
+        return None
+
+    def ReadBlock(self, digest : str, snps : np.ndarray) -> tuple :
+        """
+        returns (positions of snps in the block, -1 when not in it; packed matrix, number of snps of the block), or
+        None when the block was removed meanwhile
+        """
+        try:
+            block = np.load(self.Path(digest, 'snps'))
+            nb_snp,packed = ReadPackedLD(self.Path(digest, 'ld'))
+        except FileNotFoundError:
+            return None
+        order = np.argsort(block)
+        found = np.minimum(np.searchsorted(block[order], snps), len(block) - 1)
+        where = np.where(block[order][found] == snps, order[found], -1)
+
+        return where, packed, nb_snp
+
+    def LD(self, source : str, chr : str, positions : np.ndarray, snps : np.ndarray, g : np.ndarray) -> np.ndarray :
+        """
+        returns the LD matrix of panel snps (keys of SnpKeys, at the given positions), from the store when it holds
+        some of them; g are their standardized dosages, from which the LD of the snps not in the store is computed
+        source identifies the panel vcf of the chromosome
+        """
+        if len(snps) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        digest = hashlib.sha1("\n".join([source] + list(snps)).encode()).hexdigest()
+        index = self.ReadIndex()
+
+        # blocks of the same panel vcf overlapping the snps, the ones most likely to hold them all first
+        first,last = int(positions.min()),int(positions.max())
+        candidates = [d for d,e in index.items() if e.get('source') == source and e['chr'] == chr and e['first'] <= last and e['last'] >= first]
+        candidates.sort(key=lambda d: (d != digest, -index[d]['nb_snp']))
+        best = None
+        for candidate in candidates:
+            block = self.ReadBlock(candidate, snps)
+            if block is None:
+                continue
+            where = block[0]
+            if (where >= 0).all():
+                ld = LDSubMatrix(block[1], block[2], where)
+                self.counters['exact' if candidate == digest else 'submatrix'] += 1
+                self.counters['snps_reused'] += len(snps)
+                self.Touch(candidate)
+                return ld
+            if best is None or (where >= 0).sum() > (best[1][0] >= 0).sum():
+                best = (candidate, block)
+
+        if best is not None and (best[1][0] >= 0).sum() > 0:
+            where,packed,nb_snp = best[1]
+            known = np.flatnonzero(where >= 0)
+            missing = np.flatnonzero(where < 0)
+            ld = np.empty((len(snps), len(snps)), dtype=np.float32)
+            ld[np.ix_(known, known)] = LDSubMatrix(packed, nb_snp, where[known])
+            rows = StandardizedLDRows(g, missing)
+            ld[missing] = rows
+            ld[:, missing] = rows.T
+            self.counters['partial'] += 1
+            self.counters['snps_reused'] += len(known)
+            self.counters['snps_computed'] += len(missing)
+            self.Touch(best[0])
+        else:
+            ld = StandardizedLDRows(g, np.arange(len(snps)))
+            self.counters['computed'] += 1
+            self.counters['snps_computed'] += len(snps)
+        self.Add(digest, source, chr, positions, snps, ld)
+
+        return ld
+
+    def Report(self) -> str :
+        return ", ".join(f"{n} {c}" for c,n in self.counters.items())
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog --store STORE/PANEL/POPULATION [--max_gb N]")
+    parser.add_option("-s", "--store", dest="store", default=None)                                      #Directory of the LD store of a panel and population
+    parser.add_option("--max_gb", dest="max_gb", default=0)                                             #Maximum size of the store in GB, the least recently used blocks above it are removed (0 means no eviction)
+    (options, args) = parser.parse_args()
+
+    if options.store is None:
+        parser.error("no store given")
+
+    debut = time.time()
+
+    store = LDStore(options.store, int(float(options.max_gb) * 2**30))
+    index = store.UpdateIndex(lambda index: None)
+    for digest,e in sorted(index.items(), key=lambda item: (item[1]['chr'], item[1]['first'])):
+        print(f"{digest} chr{e['chr']}:{e['first']}-{e['last']} {e['nb_snp']} SNPs {e['bytes'] / 2**20:.1f} MB "
+              f"last used {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e['last_used']))}")
+    print(f"\n{len(index)} blocks, {sum(e['bytes'] for e in index.values()) / 2**30:.3f} GB")
+
+    print("~~~~~ ld_store finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# This script does, for all the loci of a chromosome in one process, the per-locus steps that surround PAINTOR, in
+# place of one awk task per locus for the bed files and one paste task per locus for the annotated results.
+# --annotate (after the LD calculation), for each LOCUS.processed.filtered file (snps kept by ld_calculation.py,
+# sorted by position):
+#   LOCUS.processed.filtered.ucsc.bed                           the bed of the snps (chrN, pos, pos+1), UCSC chromosome names
+#   LOCUS.processed.filtered.ucsc.bed.coord.over.allannots.txt  the 0/1 annotation matrix of the snps (see annotations_merge.py)
+# --paste (after PAINTOR), for each LOCUS.results file and its annotation matrix:
+#   LOCUS.results.annotated                                     the lines of both files side by side, tab separated
+# The loci are matched by locus name (what comes before the first dot), and the outputs are the same files as the
+# former ANNOTATIONS_bedfiles (awk and ens2ucsc.awk), ANNOTATIONS_mergeannotations and PAINTOR_annotatedlocus tasks.
+
+
+# IMPORTS --------------------------------------------------------------------
+import pandas as pd
+import numpy as np
+import itertools
+import time
+import os
+from optparse import OptionParser
+from annotations_merge import ReadAnnotationsList, AnnotationMatrices, WriteAnnotationMatrix
+from ld_matrix import LocusName
+# ----------------------------------------------------------------------------
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def UcscChromosome(chr : str) -> str :
+    """
+    returns the UCSC name of an Ensembl chromosome name (1 -> chr1, MT -> chrM), as ens2ucsc.awk
+    """
+    if chr.startswith('chr'):
+        return chr
+
+    return 'chrM' if chr == 'MT' else f"chr{chr}"
+
+
+def ReadProcessedSnps(processed_file : str) -> pd.DataFrame :
+    """
+    returns the (chr, pos) of the snps of a processed locus file (first two columns), with UCSC chromosome names,
+    checking that they are sorted by position as PAINTOR and CANVIS expect them
+    """
+    snps = pd.read_csv(processed_file, sep=' ', usecols=[0, 1], dtype=str, keep_default_na=False)
+    snps.columns = ['chr', 'pos']
+    snps['chr'] = snps['chr'].map(UcscChromosome)
+    snps['pos'] = snps['pos'].astype(np.int64)
+    if (np.diff(snps['pos'].to_numpy()) < 0).any():
+        raise ValueError(f"{processed_file}: snps not sorted by position")
+
+    return snps
+
+
+def WriteLocusBed(snps : pd.DataFrame, out_file : str) -> None :
+    """
+    writes the 1 bp bed intervals (chr, pos, pos+1) of the snps, tab separated
+    """
+    bed = pd.DataFrame({'chr' : snps['chr'], 'start' : snps['pos'], 'end' : snps['pos'] + 1})
+    bed.to_csv(out_file, sep='\t', header=False, index=False)
+
+    return None
+
+
+def AnnotateLoci(processed_files : "list[str]", annotations : "list[tuple]", outdir : str, index_dir : str = None) -> None :
+    """
+    writes the bed file and the annotation matrix of each processed locus file; the annotation bed files (or their
+    index entries) are read once for all the loci
+    """
+    loci = [ReadProcessedSnps(f) for f in processed_files]
+    beds = [os.path.join(outdir, f"{os.path.basename(f)}.ucsc.bed") for f in processed_files]
+    for snps,bed in zip(loci, beds):
+        WriteLocusBed(snps, bed)
+    print(f"{len(loci)} loci ({sum(len(l) for l in loci)} SNPs) and {len(annotations)} annotations\n")
+
+    # repeated positions are reported once in the annotation matrices, as annotations_merge.py does for the beds
+    unique = [l.drop_duplicates().reset_index(drop=True) for l in loci]
+    for bed,matrix in zip(beds, AnnotationMatrices(unique, annotations, index_dir)):
+        WriteAnnotationMatrix(matrix, annotations, f"{bed}.coord.over.allannots.txt")
+
+    return None
+
+
+def PasteResults(files : "list[str]", outdir : str) -> int :
+    """
+    writes LOCUS.results.annotated for each locus with both a .results file and an allannots file, the lines of
+    both side by side separated by a tab (as paste, missing lines being empty), returns the number of loci pasted
+    """
+    results = {LocusName(f) : f for f in files if f.endswith('.results')}
+    annotations = {LocusName(f) : f for f in files if f.endswith('allannots.txt')}
+    for locus in sorted(results.keys() & annotations.keys()):
+        with open(results[locus]) as r, open(annotations[locus]) as a:
+            pairs = [(x.rstrip('\n'), y.rstrip('\n')) for x,y in itertools.zip_longest(r, a, fillvalue='')]
+        with open(os.path.join(outdir, f"{os.path.basename(results[locus])}.annotated"), 'w') as f:
+            f.writelines(f"{x}\t{y}\n" for x,y in pairs)
+
+    return len(results.keys() & annotations.keys())
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog --annotate -a annotations.txt LOCUS.processed.filtered ... | %prog --paste LOCUS.results LOCUS.*.allannots.txt ...")
+    parser.add_option("--annotate", dest="annotate", action="store_true", default=False)                #Write the bed files and annotation matrices of the processed locus files
+    parser.add_option("--paste", dest="paste", action="store_true", default=False)                      #Write the annotated results of the results and annotation matrix files
+    parser.add_option("-a", "--annotations", dest="annotations", default="annotations.txt")             #File with the id and the bed file of each annotation (--annotate)
+    parser.add_option("-i", "--index", dest="index_dir", default=None)                                  #Directory of the annotation index shared across runs (see annotations_merge.py, bed files are read directly by default)
+    parser.add_option("--od", "--outdir", dest="outdir", default=".")                                   #Output directory
+    (options, args) = parser.parse_args()
+
+    if options.annotate == options.paste:
+        parser.error("one of --annotate and --paste is needed")
+    if len(args) == 0:
+        parser.error("no locus file given")
+
+    debut = time.time()
+
+    if options.annotate:
+        AnnotateLoci([f for f in args if f.endswith('.processed.filtered')], ReadAnnotationsList(options.annotations),
+                     options.outdir, options.index_dir)
+    else:
+        print(f"{PasteResults(args, options.outdir)} annotated results written")
+
+    print("\n~~~~~ locus_annotations finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
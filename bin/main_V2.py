@@ -13,130 +13,330 @@ import time
 from pathlib import Path as path
 from optparse import OptionParser
 import sys
-from multiprocess import Pool
+import multiprocessing
+from functools import partial
+import hashlib
+import os
+import shutil
+import logging
+import gzip
+from instrumentation import SetupLogging, ActiveMetrics, Collect, Count, Timed, Profile
+from ld_calculation import ReadLdFile, ReadPopulationSamples, ReadGenotypes, StandardizeDosages
+from panel_store import IsPanelBuilt, BuildChromosomePanel, ReadPanelGenotypes
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
 # ----------------------------------------------------------------------------
 
 
+log = logging.getLogger("main_V2")
+
+
 # FUNCTIONS  -----------------------------------------------------------------
 # this function outputs a list of 22 dataframes indexed by the chr id
 # in fact the index of the list is a tuple (chrnumber, dataframe including the snps present in this chr)
+@Timed
 def ChromosomeSplitter(bank : str, separator : str, cname : str) -> "list[pd.DataFrame]" :    
     """
     data bank file name -> list[CHR1,CHR2,...,CHR22]
     Splits Data bank into chromosomes contained in a dataframe and stored in a list
     """
-    print("Starting GWAS dataset splitter...")
+    log.info("Starting GWAS dataset splitter...")
     start_time = time.time()
     chr_list = []  # tuple: (chrosome_number, [chromosome])
 
     #reading data
-    print("\nReading data...")
+    log.info("\nReading data...")
     data_bank = pd.read_csv(bank,index_col=False, sep=separator)
-    print("Data read !\n")
+    Count("snps_read", len(data_bank))
+    log.info("Data read !\n")
 
     #temporary pandas DataFrame to store snp data corresponding to current chromosome
     chr = pd.DataFrame(None)
 
     #building chromosome files
     for i in range(1,22+1):
-        print("Building chromosome %s file..." % i)
+        log.debug("Building chromosome %s file..." % i)
         chr_list.append((i,data_bank[data_bank[cname] == i]))
 
-    print("Done splitting chromosmes !")
-    print("--- done splitting chromosomes in %s seconds ---\n" % (time.time() - start_time))
-    print("\nChromosomes generated :")
-    print([n for (n,chr) in chr_list])
-    print("\n\n")
+    log.info("Done splitting chromosmes !")
+    log.info("--- done splitting chromosomes in %s seconds ---\n" % (time.time() - start_time))
+    log.info("\nChromosomes generated :")
+    log.info([n for (n,chr) in chr_list])
+    log.info("\n\n")
 
     return chr_list
 
 
-def SortPerPValue(chr : tuple, Phead : str) -> pd.DataFrame : 
+# this function does the same as ChromosomeSplitter but reads the gwas file by chunks
+# only the columns given in dtypes are read (the ones kept in the locus files), with compact types
+# each chunk is split right away into the per-chromosome buffers, so the whole file is never held in memory
+@Timed
+def StreamingChromosomeSplitter(bank : str, separator : str, cname : str, dtypes : dict, chunksize : int) -> "list[tuple]" :
     """
-    Quicksorts (and writes) the SNP's of the i-th chromosome file, in ascending order according to the P-Value
-    from better to worst pvalue
+    data bank file name -> list[CHR1,CHR2,...,CHR22]
+    Reads the data bank (plain or gzipped) by chunks of chunksize lines, keeping only the columns of dtypes,
+    and appends each chunk to per-chromosome buffers which are concatenated once the file is read
     """
+    log.info("Starting streaming GWAS dataset splitter...")
     start_time = time.time()
-    i,chromosome = chr
-    quicksorted = chromosome.sort_values(by=Phead, ascending=True, kind = 'quicksort', ignore_index=True)
+    buffers = {i : [] for i in range(1,22+1)}
+    categories = {c : set() for c,t in dtypes.items() if t == 'category'}
+
+    # the chromosome column is read as is and converted afterwards, so that chrX, chrY... lines are simply skipped
+    read_dtypes = {c : t for c,t in dtypes.items() if c != cname}
+    nb_snp = 0
+
+    log.info("\nReading data...")
+    for chunk in pd.read_csv(bank, index_col=False, sep=separator, usecols=list(dtypes), dtype=read_dtypes, chunksize=chunksize):
+        nb_snp += len(chunk)
+        chr_ids = pd.to_numeric(chunk[cname], errors='coerce')
+        autosomal = chr_ids.between(1,22)
+        chunk = chunk[autosomal].assign(**{cname : chr_ids[autosomal].astype(dtypes[cname])})
+        for c in categories:
+            categories[c].update(chunk[c].cat.categories)
+        for i,chr_chunk in chunk.groupby(cname, sort=False, observed=True):
+            buffers[int(i)].append(chr_chunk)
+    log.info(f"Data read ! ({nb_snp} SNPs)\n")
+    Count("snps_read", nb_snp)
+
+    # chunks are concatenated with the same categories, so that the allele columns stay categorical
+    chr_list = []
+    for i in range(1,22+1):
+        log.debug("Building chromosome %s file..." % i)
+        pieces = buffers.pop(i)
+        if len(pieces) == 0:
+            chr_list.append((i,pd.DataFrame({c : pd.Series(dtype=t) for c,t in dtypes.items()})))
+            continue
+        for piece in pieces:
+            for c in categories:
+                piece[c] = piece[c].cat.set_categories(sorted(categories[c]))
+        chr_list.append((i,pd.concat(pieces, ignore_index=True)))
 
-    print(f"--- chromosome {i} sorted in %s secondes ---\n" % (time.time() - start_time))
+    log.info("Done splitting chromosmes !")
+    log.info("--- done splitting chromosomes in %s seconds ---\n" % (time.time() - start_time))
+    log.info("\nChromosomes generated :")
+    log.info([n for (n,chr) in chr_list])
+    log.info("\n\n")
 
-    return quicksorted
+    return chr_list
 
 
-def SortPerPosition(l : pd.DataFrame, pos : str) -> pd.DataFrame : 
+# the 3 functions below implement an on-disk cache of the splitted data bank
+# the cache directory holds one folder per (data bank checksum, header options) key, with one feather file per chromosome
+# feather files are written uncompressed so that they are memory-mapped at reading time, and only the requested columns are loaded
+def CacheKey(bank : str, options : "list[str]") -> str :
     """
-    sorting one locus which is a dataframe by pos
+    returns the cache key of a data bank: sha256 of the file content and of the options used to parse it
     """
-    start_time = time.time()
-    quicksorted = l.sort_values(by=pos, ascending=True, kind = 'quicksort', ignore_index=True)
-
-    print(f"--- locus sorted in %s secondes ---\n" % (time.time() - start_time))
+    checksum = hashlib.sha256()
+    with open(bank, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            checksum.update(block)
+    checksum.update("\t".join(str(o) for o in options).encode())
 
-    return quicksorted    
+    return checksum.hexdigest()
 
 
-def LocusUnion(l1 : pd.DataFrame, l2 : pd.DataFrame,pos) -> pd.DataFrame :
+@Timed
+def WriteChromosomeCache(chr_list : "list[tuple]", cache_path : str, columns : "list[str]") -> None :
     """
-    returns union of 2 loci
+    writes the columns of each chromosome dataframe in cache_path/CHRnn.feather, uncompressed (the default lz4 compression
+    would have to be undone at reading time, defeating the memory map)
+    the files are first written in a temporary folder which is renamed at the end, so that an interrupted run leaves no partial cache
     """
-    quicksorted_l1 = l1.sort_values(by=pos, ascending=True, kind = 'quicksort', ignore_index=True)
-    quicksorted_l2 = l2.sort_values(by=pos, ascending=True, kind = 'quicksort', ignore_index=True)
-
-    return pd.merge(quicksorted_l1,quicksorted_l2, how="outer")
+    start_time = time.time()
+    tmp_path = path(f"{cache_path}.tmp{os.getpid()}")
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    for i,chromosome in chr_list:
+        feather.write_feather(chromosome[columns].reset_index(drop=True), tmp_path / f"CHR{i:02d}.feather", compression='uncompressed')
+    try:
+        tmp_path.rename(cache_path)
+    except OSError:
+        # another run wrote the same cache in the meantime
+        shutil.rmtree(tmp_path)
+
+    log.info(f"--- GWAS cache written in {cache_path} in %s seconds ---\n" % (time.time() - start_time))
+    return None
 
 
-def isIntersected(l1 : pd.DataFrame, l2 : pd.DataFrame) -> bool :
+@Timed
+def ReadChromosomeCache(cache_path : str, chromosomes : "list[int]", columns : "list[str]") -> "list[tuple]" :
     """
-    returns True if there is a common SNP in l1 and l2, returns False otherwise
+    returns the list of (chromosome number, dataframe) read from the cache, restricted to the given chromosomes and columns
+    the columns are selected on the memory-mapped table, as read_table(columns=...) copies the whole file in memory
     """
-    return len(pd.merge(l1, l2, how="inner")) != 0
+    start_time = time.time()
+    chr_list = [(i, feather.read_table(path(cache_path) / f"CHR{i:02d}.feather", memory_map=True).select(columns).to_pandas())
+                for i in chromosomes]
 
+    log.info(f"--- GWAS cache read from {cache_path} in %s seconds ---\n" % (time.time() - start_time))
+    return chr_list
 
-def checkListLocus(liste : "list[tuple]", pos) -> "list(tuple)":
+
+# this function defines the loci of one chromosome from plain numpy arrays
+# positions and pvalues are the columns of the chromosome dataframe (in any order)
+# outputs a list of arrays of row indices, one array per locus, each sorted by position
+@Timed
+def LocusBounds(positions : np.ndarray, pvalues : np.ndarray, kb, Pseuil_lead, Pseuil_nonlead) -> "list[np.ndarray]":
     """
-    checking in the list of locus if there is no overlaping loci 
-    if there is, merge the loci and delete the second locus
+    returns the row indices of all loci of one chromosome
+
+    Keeps the SNPs passing the non-lead pvalue threshold, sorted by position. Each lead SNP (pvalue below the lead
+    threshold) opens a window of +- kb around its position, found with searchsorted on the sorted positions.
+    Windows sharing at least one SNP are merged in a single sweep over the windows sorted by their start.
+    Loci are returned in the order of their best lead SNP (from better to worst pvalue).
     """
-    list_locus_to_remove = []
-    new_liste = []
- 
-    for locus_index in range(len(liste)): 
-        ii,current_locus = liste[locus_index]
-            
-        #if current_locus.equals(list_locus_to_remove[x][1].reindex(columns=current_locus.columns)) for x in range(len(list_locus_to_remove)):
-        if any(current_locus.equals(locus[1]) for locus in list_locus_to_remove):
-            # skip the current locus if it's marked for removal
-            continue  
-            
-        for locus_index2 in range(locus_index+1, len(liste)):
-            _,test_locus = liste[locus_index2]
+    kb_nb = int(kb) * 1000
+
+    # snps that can belong to a locus, sorted by position
+    nonlead = np.flatnonzero(pvalues <= float(Pseuil_nonlead))
+    nonlead = nonlead[np.argsort(positions[nonlead], kind='stable')]
+    sorted_pos = positions[nonlead]
+
+    # lead snps, from better to worst pvalue
+    leads = np.flatnonzero(pvalues <= float(Pseuil_lead))
+    leads = leads[np.argsort(pvalues[leads], kind='stable')]
+
+    # each window is the slice [starts[k], ends[k]) of sorted_pos, empty windows are not loci
+    starts = np.searchsorted(sorted_pos, positions[leads] - kb_nb, side='left')
+    ends = np.searchsorted(sorted_pos, positions[leads] + kb_nb, side='right')
+    ranks = np.flatnonzero(ends > starts)
+    Count("snps_tested", len(positions))
+    Count("leads_tested", len(leads))
+    Count("windows", len(ranks))
+
+    # sweep over the windows sorted by start, merging a window into the current locus when they share a snp
+    bounds = []   # list of [start, end, rank of the best lead]
+    for k in ranks[np.argsort(starts[ranks], kind='stable')]:
+        if bounds and starts[k] < bounds[-1][1]:
+            bounds[-1][1] = max(bounds[-1][1], ends[k])
+            bounds[-1][2] = min(bounds[-1][2], k)
+            Count("merges")
+        else:
+            bounds.append([starts[k], ends[k], k])
 
-            print(f"\nii,current_locus : {ii}, {current_locus}")
-            print(f"\n_,test_locus : {_}, {test_locus}") 
+    bounds.sort(key=lambda b: b[2])
 
-            if current_locus.equals(test_locus) == False and isIntersected(current_locus, test_locus):
-                print("Overlapping2\n")
-                liste[locus_index] = (ii, SortPerPosition(LocusUnion(current_locus, test_locus, pos),pos))
-                    
-                locus_to_remove : tuple = (ii, test_locus)
-                list_locus_to_remove.append(locus_to_remove)
-                    
-                print(f"list_locus_to_remove : {list_locus_to_remove}")
-                
-                #print(f"\nNew locus {locus_index} created after merging 2: {liste[locus_index]}\n")
-                print(f"liste of locus at this point2 : {liste}")
+    return [nonlead[start:end] for start,end,_ in bounds]
 
-            else:
-                print("No overlapping\n")
 
+# the two functions below define the loci by LD clumping instead of fixed windows
+# the genotypes of all the snps that can belong to a locus of the chromosome are read once from the reference panel,
+# restricted to the samples of the population, as a block of standardized dosages (one row per position)
+@Timed
+def ClumpPanel(chr_nb : int, positions : np.ndarray, pvalues : np.ndarray, kb, Pseuil_lead, Pseuil_nonlead,
+               ld_files : dict, samples : "set[str]", panel_dir : str = None, map_file : str = None) -> tuple :
+    """
+    returns (sorted positions, standardized dosages) of the panel snps of the +- kb windows around the lead SNPs
 
-    # remove elements of the list liste which do not match with the elements of the list list_locus_to_remove
-    # store the new tuples in a new list
-    new_liste = [x for x in liste if not any(y[1].equals(x[1]) for y in list_locus_to_remove)]
-   
-    return new_liste
+    Only the positions with a single bi-allelic and polymorphic snp in the panel are kept, so that the dot product of two
+    rows is the correlation of two snps of the GWAS file. Chromosomes missing from the panel give an empty block.
+    """
+    kb_nb = int(kb) * 1000
+    empty = (np.zeros(0, dtype=np.int64), np.zeros((0, len(samples)), dtype=np.float32))
+    if str(chr_nb) not in ld_files:
+        log.warning(f"chromosome {chr_nb} is not in the reference panel, its loci are fixed windows")
+        return empty
+
+    # merged windows around the leads, and the candidate snps they contain
+    regions = []
+    for p in np.sort(positions[pvalues <= float(Pseuil_lead)]):
+        start,end = max(1, int(p) - kb_nb), int(p) + kb_nb
+        if regions and start <= regions[-1][1]:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    if not regions:
+        return empty
+    candidates = positions[pvalues <= float(Pseuil_nonlead)]
+    starts = np.array([r[0] for r in regions])
+    k = np.searchsorted(starts, candidates, side='right') - 1
+    inside = (k >= 0) & (candidates <= np.array([r[1] for r in regions])[np.maximum(k, 0)])
+    wanted = set(int(p) for p in candidates[inside])
+
+    if panel_dir is None:
+        genotypes = ReadGenotypes(ld_files[str(chr_nb)], str(chr_nb), [tuple(r) for r in regions], wanted, samples)
+    else:
+        if not IsPanelBuilt(panel_dir, str(chr_nb), ld_files[str(chr_nb)]):
+            BuildChromosomePanel(str(chr_nb), ld_files[str(chr_nb)], map_file, panel_dir)
+        genotypes = ReadPanelGenotypes(panel_dir, str(chr_nb), wanted, samples)
+
+    panel_pos = np.array(sorted(p for p,snps in genotypes.items() if len(snps) == 1), dtype=np.int64)
+    if len(panel_pos) == 0:
+        return empty
+    dosages = np.vstack([genotypes[p][0][2] for p in panel_pos])
+    polymorphic = dosages.min(axis=1) != dosages.max(axis=1)
+    Count("clump_panel_snps", polymorphic.sum())
+
+    return panel_pos[polymorphic], StandardizeDosages(dosages[polymorphic])
+
+
+@Timed
+def ClumpBounds(positions : np.ndarray, pvalues : np.ndarray, kb, Pseuil_lead, Pseuil_nonlead, clump_r2 : float,
+                panel : tuple) -> "list[np.ndarray]":
+    """
+    returns the row indices of all loci of one chromosome, the lead SNPs being clumped by LD
+
+    Lead SNPs are taken from better to worst pvalue. A lead that is not in a locus yet is the index SNP of a new locus:
+    its r2 with the panel SNPs of its +- kb window is computed from the dosage block (one matrix-vector product), and the
+    locus spans from the first to the last SNP of the window with r2 >= clump_r2, so that its bounds follow the decay of
+    LD around the index SNP (the whole window when the index SNP is not in the panel). A locus stops where a locus of a
+    better index SNP starts, and the leads inside a locus are clumped into it: loci are disjoint, made of consecutive
+    SNPs, and returned in the order of their index SNP (same output as LocusBounds).
+    """
+    kb_nb = int(kb) * 1000
+    panel_pos,panel_g = panel
+
+    # snps that can belong to a locus, sorted by position, with their row in the panel block (-1 when not in the panel)
+    nonlead = np.flatnonzero(pvalues <= float(Pseuil_nonlead))
+    nonlead = nonlead[np.argsort(positions[nonlead], kind='stable')]
+    sorted_pos = positions[nonlead]
+    panel_rows = np.full(len(sorted_pos), -1)
+    if len(panel_pos):
+        k = np.minimum(np.searchsorted(panel_pos, sorted_pos), len(panel_pos) - 1)
+        panel_rows = np.where(panel_pos[k] == sorted_pos, k, -1)
+
+    # lead snps, from better to worst pvalue, and their rank in sorted_pos
+    leads = np.flatnonzero(pvalues <= float(Pseuil_lead))
+    leads = leads[np.argsort(pvalues[leads], kind='stable')]
+    rank = np.full(len(positions), -1)
+    rank[nonlead] = np.arange(len(nonlead))
+    Count("snps_tested", len(positions))
+    Count("leads_tested", len(leads))
+
+    covered = np.zeros(len(sorted_pos), dtype=bool)
+    bounds = []
+    for lead in leads:
+        i = rank[lead]
+        if i < 0:
+            continue
+        if covered[i]:
+            Count("leads_clumped")
+            continue
+        start = np.searchsorted(sorted_pos, positions[lead] - kb_nb, side='left')
+        end = np.searchsorted(sorted_pos, positions[lead] + kb_nb, side='right')
+        Count("windows")
+
+        # snps of the window in LD with the index snp
+        if panel_rows[i] >= 0:
+            rows = panel_rows[start:end]
+            r2 = np.zeros(end - start, dtype=np.float32)
+            r2[rows >= 0] = (panel_g[rows[rows >= 0]] @ panel_g[panel_rows[i]]) ** 2
+            r2[i - start] = 1
+            linked = np.flatnonzero(r2 >= clump_r2)
+            start,end = start + linked[0], start + linked[-1] + 1
+
+        # the locus stops at the loci of the better index snps
+        before = np.flatnonzero(covered[start:i])
+        after = np.flatnonzero(covered[i:end])
+        start = start + before[-1] + 1 if len(before) else start
+        end = i + after[0] if len(after) else end
+        covered[start:end] = True
+        bounds.append(nonlead[start:end])
+
+    return bounds
 
 
 # this function is the most important of all (contains the intelligence of the whole process)
@@ -146,153 +346,262 @@ def checkListLocus(liste : "list[tuple]", pos) -> "list(tuple)":
 # outputs a list with as many elements as loci in the chromosome entered
 # the output is in fact a list of tuples where
 # each tuple 1st element is the chromosome id and tuple second element is the dataframe including the snps of the locus defined 
-def LocusList(chr : tuple, Phead : str, pos, kb, Pseuil_lead,Pseuil_nonlead) -> "list(tuple)":
+@Timed
+def LocusList(chr : tuple, Phead : str, pos, kb, Pseuil_lead,Pseuil_nonlead, clump_r2 : float = 0, panel : tuple = None) -> "list(tuple)":
     """
     returns a list of all locus in given chromosome
 
     Splits SNP's in the data bank (in one chromosome):
-    After SNP's were sorted by SortPerPValue(), takes the first most significative SNP in the list, takes a region of +- kb number (500 by default)
-    around the SNP in the non-pv-sorted file (but sorted according to position) and writes them into a file.
-    Then, repeats the same process for the next most significative SNP if it is not already in the previous locus
+    For each SNP below the lead pvalue threshold, takes a region of +- kb number (500 by default) around the SNP,
+    keeping the SNPs below the non-lead pvalue threshold. Regions sharing SNPs are merged into a single locus
+    (see LocusBounds), and each locus is sorted by position.
+    With clump_r2 > 0, the lead SNPs are clumped by LD with the panel block of the chromosome instead (see ClumpBounds).
     """
     start_time = time.time()
-    locus = pd.DataFrame(None)
 
     # i is the chr number, chromosome is a dataframe with all the snps of chr i
     i,chromosome = chr
-    #print(f"\nStarting splitting chromosome {i} into loci...")
-    print(f"\nliste de SNP du chr {i} non triée:\n {chromosome}\n")
-    
-    # sorted is a tuple (chrid, sorted dataframe of the snps of the chr)
-    sorted = SortPerPValue(chr,Phead)
-
-    print(f"liste de SNP du chr {i} triée par pvalue: \n{sorted}")
-
-    locus_nb = 0
-    test = True
-    liste = []
-    new_liste = []
-    # len(sorted) is the number of snp in the list, for one chr
-    for snp_index in range(len(sorted)):
-        test = True
-        #print(f"snp index: {snp_index} \n")
-        
-        # first, we only keep snp that have a significant pvalue
-        if sorted.iloc[snp_index][Phead] > float(Pseuil_lead):
-            print(f"\nNo more significant SNP pvalues in the chromosome {i}\n")
-            break
-    
-        # the 1st time, line contains the whole line of the best SNP : line = (chrid,snp with best pvalue)
-        line = sorted[snp_index:snp_index+1]
-        #print(f"\n line : \n{line} \n")
-      
-        # pos_line extracts from line the position on chrid of the snp with the best pvalue
-        pos_line = int(line[pos])
-        
-        # kb_nb is the number of bases upstream and downstream we want to search around our best SNP
-        # kb_range is this computed interval (500kb +/- by default) around the position on chrid of the snp with the best pvalue
-        kb_nb = int(kb) * 1000
-        kb_range = range(pos_line - kb_nb, pos_line + kb_nb + 1)
-        
-        # new_locus is a tuple : (chrid , dataframe of snps at 500kb from +/- best pvalue snp)
-        # the dataframes are ordered by SNP position
-        new_locus : tuple = (i,chromosome.loc[chromosome[pos].isin(kb_range) & (chromosome[Phead] <= float(Pseuil_nonlead))])
-
-        print(f"new locus :\n {new_locus}")
-    
-        #first time len(liste) is 0
-        if len(liste)==0:
-            liste.append(new_locus)
-            #count of the locus created
-            locus_nb = locus_nb + 1
-            print(f"\nCHR{i}locus{locus_nb} created !\n")
+    log.info(f"\nStarting splitting chromosome {i} into loci...")
+
+    if clump_r2 > 0:
+        locus_indices = ClumpBounds(chromosome[pos].to_numpy(), chromosome[Phead].to_numpy(), kb, Pseuil_lead, Pseuil_nonlead, clump_r2, panel)
+    else:
+        locus_indices = LocusBounds(chromosome[pos].to_numpy(), chromosome[Phead].to_numpy(), kb, Pseuil_lead, Pseuil_nonlead)
+    liste = [(i, chromosome.iloc[indices]) for indices in locus_indices]
+
+    log.info(f"{len(liste)} loci found in chromosome {i}")
+    log.info(f"--- chromosome {i} split into loci in %s seconds ---\n" % (time.time() - start_time))
+    return liste
+
+
+# this function bounds the size of a locus before its LD matrix is computed
+# locus is a dataframe sorted by position, max_snps the maximum number of snps (0 means no cap)
+@Timed
+def CapLocus(locus : pd.DataFrame, Phead : str, pos : str, max_snps : int) -> pd.DataFrame:
+    """
+    returns the locus restricted to its max_snps SNPs with the best pvalues (lead SNPs first), sorted by position
+    """
+    if max_snps <= 0 or len(locus) <= max_snps:
+        return locus
+
+    best = np.argsort(locus[Phead].to_numpy(), kind='stable')[:max_snps]
+    Count("snps_capped", len(locus) - max_snps)
+
+    return locus.iloc[np.sort(best)]
+
+
+# this function predicts the resources needed by a locus in the LD and PAINTOR steps
+# nb_snp is the number of snps of the LD matrix (at most max_snps when the loci are capped)
+def LocusManifestRow(name : str, chr_nb, locus : pd.DataFrame, pos : str, nb_snp : int, digest : str = "") -> list:
+    """
+    returns the manifest row of a locus: name, chromosome, number of SNPs, first and last position, span,
+    predicted LD matrix bytes (nb_snp x nb_snp doubles, as PAINTOR holds it), PAINTOR cost (nb_snp squared)
+    and sha256 of the locus file
+    """
+    start,end = (int(locus[pos].min()), int(locus[pos].max())) if len(locus) else (0, 0)
+
+    return [name, chr_nb, nb_snp, start, end, end - start, 8 * nb_snp ** 2, nb_snp ** 2, digest]
+
+
+# this function gives a locus a name that only depends on its content, so that a rerun with other parameters
+# finds the loci that did not change under the same names (and the tasks computed from them in the cache)
+# digest is the sha256 of the locus file content, i.e. of its snps with their alleles, effects and zscores
+def ContentLocusName(chr_nb, locus : pd.DataFrame, pos : str, digest : str) -> str:
+    """
+    returns the name CHRnnlocus_start_end_digest of a locus (16 hexadecimal digits of the digest are kept)
+    """
+    start,end = (int(locus[pos].min()), int(locus[pos].max())) if len(locus) else (0, 0)
+
+    return f"CHR{int(chr_nb):02d}locus_{start}_{end}_{digest[:16]}"
+
+
+# this function computes the zscores of a whole chromosome at once, before it is split into loci
+# columns are the columns written in the locus files (CHR BP ALLELE1 ALLELE2 EFFECT STDERR PVALUE RSID), the zscore is added after them
+@Timed
+def ZscoreColumns(chromosome : pd.DataFrame, columns : "list[str]", Zhead : str, Effect : str, StdErr : str) -> pd.DataFrame:
+    """
+    returns the chromosome restricted to the columns of the locus files, with the zscore column (effect / stderr)
+    """
+    return chromosome[columns].assign(**{Zhead : chromosome[Effect] / chromosome[StdErr]})
+
+
+# this function formats a locus file, sorted as sort -k2,2n sorts it (in the C locale)
+# the snps of the locus are already sorted by position, only the lines of the snps sharing a position are reordered
+def LocusText(locus : pd.DataFrame, pos : str) -> str:
+    """
+    returns the text of a locus file: header and snps sorted by position, then by line for the snps at the same position
+    """
+    content = locus.to_csv(index=False, sep=' ')
+    positions = locus[pos].to_numpy()
+    if len(positions) > 1 and (positions[1:] == positions[:-1]).any():
+        header,*lines = content.splitlines(keepends=True)
+        lines.sort(key=lambda line: (int(line.split(' ', 2)[1]), line.encode()))
+        content = header + "".join(lines)
+
+    return content
+
+
+# this function writes all the loci of a chromosome at once
+# loci is a list of (name, chromosome number, content, number of snps), the files are named name+suffix
+# locus_format is text (one file per locus), gzip (one gzipped file per locus, name+suffix.gz) or
+# indexed (one CHRnn.loci file with all the loci one after the other, each with its header, and the CHRnn.loci.idx
+# index with the name, chromosome, byte offset, byte length and number of snps of each locus)
+@Timed
+def WriteLoci(loci : "list[tuple]", outdir : str, locus_format : str = "text", suffix : str = "", skip_existing : bool = False) -> None:
+    """
+    writes the locus files of a chromosome in the chosen format
+    with skip_existing (content named loci), the text and gzip files already in outdir are not written again
+    """
+    if locus_format == "indexed":
+        for chr_nb in sorted(set(l[1] for l in loci)):
+            offset = 0
+            with open(f"{outdir}/CHR{int(chr_nb):02d}.loci", 'wb') as data, open(f"{outdir}/CHR{int(chr_nb):02d}.loci.idx", 'w') as index:
+                index.write("locus\tchr\toffset\tlength\tnb_snp\n")
+                for name,_,content,nb_snp in (l for l in loci if l[1] == chr_nb):
+                    content = content.encode()
+                    data.write(content)
+                    index.write(f"{name}{suffix}\t{chr_nb}\t{offset}\t{len(content)}\t{nb_snp}\n")
+                    offset += len(content)
+                    Count("loci_written")
+                    Count("snps_written", nb_snp)
+            Count("bytes_written", offset)
+        return None
+
+    for name,_,content,nb_snp in loci:
+        locus_file = f"{outdir}/{name}{suffix}" + (".gz" if locus_format == "gzip" else "")
+        if skip_existing and os.path.isfile(locus_file):
+            Count("loci_unchanged")
+            log.debug(f"{name} unchanged !\n")
             continue
-        # after the if we have only one locus in the list (one locus created)
-        
-        else:
-            for new_locus_index in range(len(liste)):
-                # _ and ii are the chrid (the same)
-                # prev_locus is the locus (list of SNP) we appened is the list of loci
-                # nnew_locus is the locus (list of SNP) following in the list
-                # new locus is the tuple containing (chrid, nnew_locus)
-                ii,prev_locus = liste[new_locus_index]   
-                _,nnew_locus = new_locus
-
-                print(f"\nii,prev_locus : {ii}, {prev_locus}")
-                print(f"\n_,nnew_locus : {_}, {nnew_locus}")     
-        
-                if isIntersected(prev_locus, nnew_locus):
-                    print("Overlapping loci found !\n")
-                    print("Merging the loci...")
-                    liste[new_locus_index] = (ii, SortPerPosition(LocusUnion(prev_locus, nnew_locus, pos),pos))
-                    print("Done merging the loci !\n")
-                    print(f"\nNew locus {new_locus_index} created after merging : {liste[new_locus_index]}\n")
-                    print(f"liste of locus at this point : {liste}")
-                    test = False
-                    break
-
-        # if no intersection (test still true):
-        # this is not done at the 1st iteration (see continue after if len(liste)==0)
-        if test:
-            # REPETITION due to TEST which is true so 2 APPEND per new locus
-            # at the fisrt time we have 2 locus in the list
-            print("No intersection, appended new locus")
-            liste.append(new_locus)  
-            locus_nb = locus_nb + 1
-            print(f"\nCHR{i}locus{locus_nb} is created !\n")
-            print(f"\n\n\n\nWe have {locus_nb} loci in our list : {liste}\n\n\n\n\n\n")
-
-    # checking if no overlaping loci
-    # merging loci while overlapping remaining
-    for i in range(len(liste)):
-        new_liste = checkListLocus(liste, pos)
-
-    #print("len final : " + str(len(new_liste))+"\n\n")
-    #print(f"nb locus final : {locus_nb}\n\n")
-
-    #print(f"\nliste after LocusList():{new_liste} \n")
-    print(f"\nDone splitting chromosome {i} into loci ! ")
-    # new_liste contains no more overlapping loci
-    return new_liste
-
-
-
-
-def ZscoreAdder(locus : tuple, Zhead : str, Effect : str, StdErr : str, pos : str, allele1 : str , allele2: str , chr : str, rsid : str, Phead : str ) -> pd.DataFrame:
-    chr_nb,zLocus = locus
-
-    zLocus[Zhead] = (zLocus[Effect]/zLocus[StdErr])
-
-    #Drop all columns that ARE NOT : CHR BP ALLELE1 ALLELE2 EFFECT STDERR PVALUE RSID ZSCORE
-    columns_to_keep = [chr, pos, allele1, allele2, Effect, StdErr, Phead, rsid, Zhead]
-    #print(f"columns_to_keep : {columns_to_keep}")
-        # Determine columns to drop
-    columns_to_drop = zLocus.columns.difference(columns_to_keep)
-        # Drop columns
-    zLocus.drop(inplace=True, columns=columns_to_drop)
-        # Keep specified columns
-    zLocus = zLocus[columns_to_keep]
-    
-    return (chr_nb,zLocus)
+        # gzip files are written without a date, so that the same locus always gives the same file
+        content = gzip.compress(content.encode(), mtime=0) if locus_format == "gzip" else content.encode()
+        with open(locus_file, 'wb') as f:
+            f.write(content)
+        Count("loci_written")
+        Count("snps_written", nb_snp)
+        Count("bytes_written", len(content))
+        log.debug(f"{name} printed !\n")
 
+    return None
 
 
-def printLocus(liste : "list[tuple]", Zhead : str, Effect : str, StdErr : str, outdir : str, pos : str, allele1 : str, allele2 : str, chr : str, rsid : str, pvalue_header : str) -> None:
+@Timed
+def printLocus(liste : "list[tuple]", outdir : str, pos : str, pvalue_header : str, max_snps : int = 0, cap_mode : str = "pvalue",
+               locus_names : str = "positional", locus_format : str = "text", suffix : str = "") -> "list[list]":
     """
-    writes locus files
+    writes the locus files of the loci of a chromosome (slices of the frame returned by ZscoreColumns, sorted by position),
+    returns their manifest rows (see LocusManifestRow)
+    with max_snps, loci are capped to their best SNPs by pvalue (cap_mode pvalue), or written whole and pruned by LD
+    when their matrix is computed (cap_mode ld)
+    loci are named by chromosome and rank (locus_names positional, CHR01locus1...) or by content (locus_names content,
+    see ContentLocusName): a content named locus already in outdir is left untouched, its file being the same
+    the files are written at once by WriteLoci, in the locus_format format
     """
+    manifest = []
+    loci = []
     for i in range(len(liste)) :
-        chr_nb,_ = liste[i]
+        chr_nb,locus = liste[i]
+        if cap_mode == "pvalue":
+            locus = CapLocus(locus, pvalue_header, pos, max_snps)
 
-        # liste[i] is the tuple (chrid,locus)
-        #_,_,locusZ = ZscoreAdder(liste[i], Zhead, Effect, StdErr)
-        _,locusZ = ZscoreAdder(liste[i], Zhead, Effect, StdErr, pos, allele1, allele2, chr, rsid, pvalue_header)
+        content = LocusText(locus, pos)
+        digest = hashlib.sha256(content.encode()).hexdigest()
 
-        if len(str(chr_nb)) == 1:
-            locusZ.to_csv(f"{outdir}/CHR0{chr_nb}locus{i+1}", index=False, sep=' ')
+        if locus_names == "content":
+            name = ContentLocusName(chr_nb, locus, pos, digest)
+        elif len(str(chr_nb)) == 1:
+            name = f"CHR0{chr_nb}locus{i+1}"
         elif len(str(chr_nb)) == 2:
-            locusZ.to_csv(f"{outdir}/CHR{chr_nb}locus{i+1}", index=False, sep=' ')
-        print(f"CHR{chr_nb}Locus{i+1} printed !\n")
+            name = f"CHR{chr_nb}locus{i+1}"
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"{name} :\n{locus.to_string()}\n")
+        loci.append((name, chr_nb, content, len(locus)))
+        manifest.append(LocusManifestRow(name, chr_nb, locus, pos, min(len(locus), max_snps) if max_snps > 0 else len(locus), digest))
+
+    WriteLoci(loci, outdir, locus_format, suffix, skip_existing=(locus_names == "content"))
+
+    return manifest
+
+
+# the functions below schedule the chromosomes over a pool of worker processes
+# the chromosome dataframes are stored in SHARED_CHROMOSOMES before the pool is created: the workers are forked
+# and inherit them (copy-on-write), so each task only sends a chromosome number instead of a pickled dataframe
+SHARED_CHROMOSOMES = {}
+
+
+def AvailableCpus() -> int :
+    """
+    returns the number of cpus this process may use: cpu affinity, slurm allocation and cgroup cpu quota (v2 then v1)
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+    if os.environ.get("SLURM_CPUS_PER_TASK", "").isdigit():
+        cpus = min(cpus, int(os.environ["SLURM_CPUS_PER_TASK"]))
+
+    quota = None
+    try:
+        cpu_max = open("/sys/fs/cgroup/cpu.max").read().split()
+        if cpu_max[0] != "max":
+            quota = int(cpu_max[0]) / int(cpu_max[1])
+    except (OSError, ValueError, IndexError):
+        try:
+            cfs_quota = int(open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read())
+            if cfs_quota > 0:
+                quota = cfs_quota / int(open("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read())
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))
+
+    return max(1, cpus)
+
+
+def ChromosomeOrder(chr_list : "list[tuple]", Phead : str, Pseuil_lead) -> "list[int]" :
+    """
+    returns the chromosome numbers from the most to the least expensive to split: number of lead SNPs, then number of SNPs
+    dispatching the biggest chromosomes first keeps the workers evenly loaded until the end
+    """
+    costs = {i : ((chromosome[Phead] <= float(Pseuil_lead)).sum(), len(chromosome)) for i,chromosome in chr_list}
+
+    return sorted(costs, key=lambda i: costs[i], reverse=True)
+
+
+def ProcessChromosome(i : int, Phead : str, pos : str, kb, Pseuil_lead, Pseuil_nonlead, Zhead : str, Effect : str, StdErr : str,
+                      outdir : str, allele1 : str, allele2 : str, chr : str, rsid : str, max_snps : int = 0, cap_mode : str = "pvalue",
+                      locus_names : str = "positional", metrics_dir : str = None, profile_dir : str = None,
+                      locus_format : str = "text", suffix : str = "", clump_r2 : float = 0, ld_files : dict = None,
+                      samples : "set[str]" = None, panel_dir : str = None, map_file : str = None) -> tuple :
+    """
+    splits the i-th chromosome of SHARED_CHROMOSOMES into loci and writes them (run in the worker processes)
+    returns (i, manifest rows of the loci)
+    with metrics_dir, the timers and counters of the chromosome are written to metrics_dir/CHRnn.metrics.json
+    with profile_dir, the chromosome is profiled to profile_dir/CHRnn.pidN.prof and .tracemalloc.txt
+    with clump_r2 > 0, the leads are clumped by LD with the samples of the reference panel (vcfs of ld_files, or the
+    packed store of panel_dir)
+    """
+    profile = os.path.join(profile_dir, f"CHR{i:02d}.pid{os.getpid()}") if profile_dir is not None else None
+    with Collect(f"CHR{i:02d}") as metrics, Profile(profile):
+        chromosome = ZscoreColumns(SHARED_CHROMOSOMES[i], [chr, pos, allele1, allele2, Effect, StdErr, Phead, rsid], Zhead, Effect, StdErr)
+        panel = None
+        if clump_r2 > 0:
+            panel = ClumpPanel(i, chromosome[pos].to_numpy(), chromosome[Phead].to_numpy(), kb, Pseuil_lead, Pseuil_nonlead,
+                               ld_files, samples, panel_dir, map_file)
+        manifest = printLocus(LocusList((i, chromosome), Phead, pos, kb, Pseuil_lead, Pseuil_nonlead, clump_r2, panel), outdir, pos, Phead,
+                              max_snps, cap_mode, locus_names, locus_format, suffix)
+    if metrics_dir is not None:
+        metrics.Write(os.path.join(metrics_dir, f"CHR{i:02d}.metrics.json"), chromosome=i, pid=os.getpid(), loci=len(manifest))
+
+    return i, manifest
+
+
+@Timed
+def WriteManifest(manifest : "list[list]", manifest_file : str) -> None :
+    """
+    writes the manifest of all the loci, sorted by locus name
+    """
+    header = ["locus", "chr", "nb_snp", "start", "end", "span", "ld_bytes", "paintor_cost", "digest"]
+    pd.DataFrame(sorted(manifest), columns=header).to_csv(manifest_file, index=False, sep='\t')
 
     return None
 
@@ -318,6 +627,23 @@ def main() -> int:
     parser.add_option("--kb", "--up-down-kb", dest="kb", default=500)                                   #Number of kb upstream and downstream of the best SNP(best pvalue) for each locus
     parser.add_option("--pv-lead", "--pvalue-lead", dest="pvalue_lead", default=5e-08)                  #Value for the pvalue treshold for the lead SNP
     parser.add_option("--pv-nonlead", "--pvalue-nonlead", dest="pvalue_nonlead", default=1)             #Value for the pvalue treshold for all SNPs around the lead SNP
+    parser.add_option("--chunksize", dest="chunksize", default=0)                                       #Number of lines read at once in streaming mode (0 reads the whole file at once)
+    parser.add_option("--cache-dir", dest="cache_dir", default=None)                                    #Directory of the columnar cache of the splitted data bank (no cache by default)
+    parser.add_option("-t", "--threads", dest="threads", default=0)                                     #Number of worker processes (0 uses all the cpus available to the job)
+    parser.add_option("--max-snps", dest="max_snps", default=0)                                         #Maximum number of SNPs per locus (0 means no cap)
+    parser.add_option("--cap-mode", dest="cap_mode", default="pvalue")                                  #How loci are capped: pvalue (best pvalues kept here) or ld (pruned by LD in ld_calculation.py)
+    parser.add_option("--manifest", dest="manifest", default=None)                                      #File where the manifest of the loci (sizes and predicted costs) is written
+    parser.add_option("--locus-names", dest="locus_names", default="positional")                        #How loci are named: positional (CHR01locus1...) or content (chromosome, start, end and digest of the locus)
+    parser.add_option("--locus-format", dest="locus_format", default="text")                            #Format of the locus files: text, gzip (one gzipped file per locus) or indexed (one file per chromosome with a byte offset index)
+    parser.add_option("--suffix", dest="suffix", default="")                                            #Suffix added to the names of the locus files
+    parser.add_option("--clump-r2", dest="clump_r2", default=0)                                         #r2 threshold of the LD clumping of the lead SNPs (0 uses fixed +- kb windows)
+    parser.add_option("--ld-file", dest="ld_file", default="ldFile.txt")                                #File with the chromosome number and the reference panel vcf of each chromosome (LD clumping)
+    parser.add_option("--map-file", dest="map_file", default="mapFile.txt")                             #Sample to population map file of the reference panel (LD clumping)
+    parser.add_option("--population", dest="population", default="EUR")                                #Population (or super population) of the samples used for the LD clumping
+    parser.add_option("--panel", dest="panel_dir", default=None)                                        #Directory of the packed genotype store (see panel_store.py) read by the LD clumping instead of the vcfs
+    parser.add_option("--log-level", dest="log_level", default="INFO")                                  #Level of the messages printed: WARNING, INFO or DEBUG (DEBUG also prints every locus)
+    parser.add_option("--metrics", dest="metrics_dir", default=None)                                    #Directory where the timers and counters of the run and of each chromosome are written as JSON
+    parser.add_option("--profile", dest="profile_dir", default=None)                                    #Directory where the cProfile and tracemalloc outputs of the reading step and of each chromosome are written
     parser.add_option("-o", "--outname", dest="outname", default ="CHRnLocusm")                         #Locus output name format 
     parser.add_option("--od", "--outdir", dest="outdir", default ="data/output/locus_output")           #Locus output directory
     (options, args) = parser.parse_args()
@@ -337,6 +663,18 @@ def main() -> int:
     kb = options.kb
     pvalue_lead = options.pvalue_lead
     pvalue_nonlead = options.pvalue_nonlead
+    chunksize = int(options.chunksize)
+    cache_dir = options.cache_dir
+    threads = int(options.threads)
+    max_snps = int(options.max_snps)
+    cap_mode = options.cap_mode
+    manifest_file = options.manifest
+    locus_names = options.locus_names
+    metrics_dir = options.metrics_dir
+    locus_format = options.locus_format
+    suffix = options.suffix
+    clump_r2 = float(options.clump_r2)
+    profile_dir = options.profile_dir
     out = options.outname
     outdir = options.outdir
     
@@ -356,6 +694,22 @@ def main() -> int:
         --kb specifiy the wanted number of kilo base upstream and downstream of the best SNP(best pvalue) for each locus
         --pv-lead specifiy the wanted pvalue threshold for the lead SNPs of a locus
         --pv-nonlead specifiy the wanted pvalue threshold for all the SNPs of a locus around the lead SNP
+        --chunksize specifiy the number of lines read at once to split the data bank in bounded memory (default is 0, the whole file is read at once)
+        --cache-dir specifiy a directory where the splitted data bank is cached in feather format, and read back by the next runs on the same file (requires pyarrow)
+        -t specifiy the number of worker processes (default is 0, all the cpus allowed by the cpu affinity, slurm and cgroup limits)
+        --max-snps specifiy the maximum number of SNPs of a locus (default is 0, no cap)
+        --cap-mode specifiy how loci above --max-snps are capped: pvalue keeps their best SNPs, ld leaves the LD pruning to ld_calculation.py (default is pvalue)
+        --manifest specifiy a file where the number of SNPs, span, predicted LD matrix bytes and PAINTOR cost of each locus are written
+        --locus-names specifiy how loci are named: positional (CHR01locus1, CHR01locus2...) or content (CHR01locus_start_end_digest, where digest is the sha256 of the locus file), so that unchanged loci keep their name across runs (default is positional)
+        --locus-format specifiy the format of the locus files, sorted by position: text (one file per locus), gzip (one gzipped file per locus) or indexed (one CHRnn.loci file per chromosome with the loci one after the other, and its CHRnn.loci.idx index of byte offsets) (default is text)
+        --suffix specifiy a suffix added to the names of the locus files (default is none)
+        --clump-r2 specifiy an r2 threshold to define the loci by LD clumping: each lead SNP not already in a locus opens a locus spanning the SNPs of its +- kb window in LD with it (r2 above the threshold), up to the loci of better lead SNPs (default is 0, fixed +- kb windows merged when they overlap)
+        --ld-file, --map-file specifiy the reference panel vcf of each chromosome and the population of its samples, used by the LD clumping (default is ldFile.txt and mapFile.txt)
+        --population specifiy the population (or super population) of the reference panel samples used by the LD clumping (default is EUR)
+        --panel specifiy the directory of the packed reference panel store of panel_store.py, read by the LD clumping instead of the vcfs
+        --log-level specifiy the level of the messages printed: WARNING, INFO or DEBUG, which also prints the content of every locus (default is INFO)
+        --metrics specifiy a directory where the timers and counters (SNPs read, leads tested, windows merged, loci, SNPs and bytes written) of the run (main.metrics.json) and of each chromosome (CHRnn.metrics.json) are written
+        --profile specifiy a directory where the cProfile (.prof) and tracemalloc (.tracemalloc.txt) outputs of the reading step and of each chromosome are written
         --od specifiy the wanted output directory (default is the output directory in the data directory)
         -o (WIP) (optional) specifiy output format name
         """
@@ -363,16 +717,78 @@ def main() -> int:
     if(data_bank == None):
         sys.exit(usage)
 
+    SetupLogging(options.log_level)
+    for directory in (metrics_dir, profile_dir):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
     debut = time.time()
     
     # makes a lits of 22 dataframes, one for each chromosome, each including the snps of the chromosome in question
-    chromosomes_list = ChromosomeSplitter(data_bank, sep, chr)
-
-    p=Pool(22)
-    p.map(lambda c : printLocus(LocusList(c, pvalue_header, pos, kb, pvalue_lead, pvalue_nonlead), zhead, effect, std, outdir, pos, allele1, allele2, chr, rsid, pvalue_header),chromosomes_list)
-
-    print("\n\n\n")
-    print("~~~~~ main finished in %s seconds ~~~~~\n" % (time.time() - debut))
+    # columns written in the locus files (the zscore column is computed from effect and stderr)
+    columns = [chr, pos, allele1, allele2, effect, std, pvalue_header, rsid]
+
+    # the reading step runs in the main process, it is profiled as main.prof
+    with Profile(os.path.join(profile_dir, "main") if profile_dir is not None else None):
+        # the cache key depends on the data bank content and on every option used to parse it
+        cache_path = None
+        if cache_dir is not None:
+            if feather is None:
+                log.warning("pyarrow is not installed, the GWAS cache is disabled\n")
+            else:
+                cache_path = os.path.join(cache_dir, CacheKey(data_bank, [sep, chunksize > 0] + columns))
+
+        # in streaming mode only the columns written in the locus files are read, with compact types
+        # (the pvalue stays in float64 so that very small pvalues are not rounded to 0)
+        if cache_path is not None and os.path.isdir(cache_path):
+            chromosomes_list = ReadChromosomeCache(cache_path, list(range(1,22+1)), columns)
+        elif chunksize > 0:
+            dtypes = {chr : 'int8', pos : 'int32', allele1 : 'category', allele2 : 'category',
+                      effect : 'float32', std : 'float32', pvalue_header : 'float64', rsid : 'object'}
+            chromosomes_list = StreamingChromosomeSplitter(data_bank, sep, chr, dtypes, chunksize)
+        else:
+            chromosomes_list = ChromosomeSplitter(data_bank, sep, chr)
+
+        if cache_path is not None and not os.path.isdir(cache_path):
+            WriteChromosomeCache(chromosomes_list, cache_path, columns)
+
+        # chromosomes are dispatched one at a time, the most expensive first
+        order = ChromosomeOrder(chromosomes_list, pvalue_header, pvalue_lead)
+        SHARED_CHROMOSOMES.update(chromosomes_list)
+        del chromosomes_list
+
+    available = AvailableCpus()
+    threads = min(threads, available) if threads > 0 else available
+    threads = min(threads, len(order))
+    log.info(f"Splitting chromosomes into loci with {threads} worker(s), in the order {order}\n")
+
+    process_chromosome = partial(ProcessChromosome, Phead=pvalue_header, pos=pos, kb=kb, Pseuil_lead=pvalue_lead, Pseuil_nonlead=pvalue_nonlead,
+                                 Zhead=zhead, Effect=effect, StdErr=std, outdir=outdir, allele1=allele1, allele2=allele2, chr=chr, rsid=rsid,
+                                 max_snps=max_snps, cap_mode=cap_mode, locus_names=locus_names, metrics_dir=metrics_dir, profile_dir=profile_dir,
+                                 locus_format=locus_format, suffix=suffix, clump_r2=clump_r2)
+    if clump_r2 > 0:
+        samples = ReadPopulationSamples(options.map_file, options.population)
+        log.info(f"Clumping the lead SNPs at r2 >= {clump_r2} with the {len(samples)} samples of population {options.population}\n")
+        process_chromosome = partial(process_chromosome, ld_files=ReadLdFile(options.ld_file), samples=samples,
+                                     panel_dir=options.panel_dir, map_file=options.map_file)
+    manifest = []
+    if threads == 1:
+        for i in order:
+            manifest.extend(process_chromosome(i)[1])
+    else:
+        with multiprocessing.get_context("fork").Pool(threads) as p:
+            for i,rows in p.imap_unordered(process_chromosome, order, chunksize=1):
+                manifest.extend(rows)
+                log.info(f"Chromosome {i} done !\n")
+
+    if manifest_file is not None:
+        WriteManifest(manifest, manifest_file)
+
+    if metrics_dir is not None:
+        ActiveMetrics().Write(os.path.join(metrics_dir, "main.metrics.json"), threads=threads, chromosomes=len(order), loci=len(manifest))
+
+    log.info("\n\n\n")
+    log.info("~~~~~ main finished in %s seconds ~~~~~\n" % (time.time() - debut))
 
     return 0
 # ----------------------------------------------------------------------------
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# This script splits the loci into shards run by separate PAINTOR tasks, and merges the outputs of these tasks back
+# into the layout of a single PAINTOR run over all the loci.
+# --split N: the cost of a locus is its number of snps squared (the size of its LD matrix), read from the
+#   LOCUS.*.processed.filtered files; the loci are assigned, from the most to the least expensive, to the shard with
+#   the lowest total cost so far, and shardK.files lists the loci of shard K (a PAINTOR -input file).
+# --merge: the outputs of the shard tasks, prefixed with their shard name (shardK.LOCUS.results, shardK.Enrichment.Values,
+#   shardK.Log.BayesFactor, shardK.LogFile.results, shardK.PAINTOR.out) are written as
+#   LOCUS.results           the results of each locus, unchanged
+#   LogFile.results         the rows of all the loci, by locus name
+#   Enrichment.Values       the enrichment estimates of the shards, averaged with their number of snps as weights, or
+#                           a copy of the --enrichment file of the global pass the shards were run with
+#   Log.BayesFactor         the sum of the log Bayes factors of the shards (the loci are independent)
+#   PAINTOR.out             the logs of the shards one after the other
+
+
+# IMPORTS --------------------------------------------------------------------
+import numpy as np
+import heapq
+import time
+import os
+import re
+import shutil
+from optparse import OptionParser
+from ld_matrix import LocusName
+# ----------------------------------------------------------------------------
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def LocusCosts(processed : "list[str]") -> dict :
+    """
+    returns the dictionary locus -> cost (number of snps squared) from the .processed.filtered files
+    """
+    costs = {}
+    for f in processed:
+        with open(f) as fh:
+            nb_snp = max(sum(1 for _ in fh) - 1, 0)
+        costs[LocusName(f)] = nb_snp ** 2
+
+    return costs
+
+
+def BalancedShards(costs : dict, nb_shard : int) -> "list[list[str]]" :
+    """
+    returns the loci of each shard: from the most to the least expensive, each locus goes to the shard with the lowest
+    total cost (longest processing time first), empty shards are dropped
+    """
+    shards = [(0, k, []) for k in range(nb_shard)]
+    for locus in sorted(costs, key=lambda l: (-costs[l], l)):
+        total,k,loci = heapq.heappop(shards)
+        loci.append(locus)
+        heapq.heappush(shards, (total + costs[locus], k, loci))
+
+    return [sorted(loci) for _,_,loci in sorted(shards, key=lambda s: s[1]) if loci]
+
+
+def WriteShards(shards : "list[list[str]]", costs : dict, outdir : str) -> None :
+    """
+    writes one shardK.files file per shard, with the names of its loci
+    """
+    for k,loci in enumerate(shards):
+        with open(os.path.join(outdir, f"shard{k}.files"), 'w') as f:
+            f.writelines(f"{locus}\n" for locus in loci)
+        print(f"shard{k}: {len(loci)} loci, cost {sum(costs[l] for l in loci)}")
+
+    return None
+
+
+def MergeShards(files : "list[str]", outdir : str, enrichment : str = None) -> None :
+    """
+    writes the outputs of a single PAINTOR run (see the top of this file) from the prefixed outputs of the shards
+    with enrichment (Enrichment.Values of a global pass), the enrichment was fixed in the shards and is copied as is
+    """
+    outputs = {}
+    for f in files:
+        match = re.match(r'(shard\d+)\.(.+)$', os.path.basename(f))
+        if match:
+            outputs.setdefault(match.group(1), {})[match.group(2)] = f
+    shards = sorted(outputs, key=lambda s: int(s[len('shard'):]))
+
+    names,values,weights = None,[],[]
+    log_rows,log_header = [],None
+    log_bf = 0.0
+    with open(os.path.join(outdir, "PAINTOR.out"), 'w') as out:
+        for shard in shards:
+            nb_snp = 0
+            for name,f in outputs[shard].items():
+                if name.endswith('.results') and name != 'LogFile.results':
+                    with open(f) as fh, open(os.path.join(outdir, name), 'w') as res:
+                        for i,line in enumerate(fh):
+                            res.write(line)
+                            nb_snp += i > 0
+
+            with open(outputs[shard]['Enrichment.Values']) as fh:
+                names = fh.readline()
+                values.append(np.array(fh.readline().split(), dtype=np.float64))
+            weights.append(nb_snp)
+
+            with open(outputs[shard]['Log.BayesFactor']) as fh:
+                log_bf += float(fh.read().split()[0])
+
+            with open(outputs[shard]['LogFile.results']) as fh:
+                log_header = fh.readline()
+                log_rows.extend(fh)
+
+            if 'PAINTOR.out' in outputs[shard]:
+                out.write(f"# {shard}\n")
+                with open(outputs[shard]['PAINTOR.out']) as fh:
+                    out.write(fh.read())
+
+    if enrichment is not None:
+        shutil.copyfile(enrichment, os.path.join(outdir, "Enrichment.Values"))
+    else:
+        with open(os.path.join(outdir, "Enrichment.Values"), 'w') as f:
+            f.write(names)
+            average = np.average(np.vstack(values), axis=0, weights=weights if sum(weights) else None)
+            f.write(" ".join("%g" % v for v in average) + "\n")
+
+    with open(os.path.join(outdir, "Log.BayesFactor"), 'w') as f:
+        f.write("%f\n" % log_bf)
+
+    with open(os.path.join(outdir, "LogFile.results"), 'w') as f:
+        f.write(log_header)
+        f.writelines(sorted(log_rows, key=lambda row: row.split()[0]))
+
+    print(f"{len(shards)} shards merged")
+
+    return None
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog --split N locus1.processed.filtered ... | %prog --merge shard0.* shard1.* ...")
+    parser.add_option("-s", "--split", dest="split", default=None)                                      #Number of shards to split the loci into (inputs are the .processed.filtered files)
+    parser.add_option("-m", "--merge", dest="merge", action="store_true", default=False)                #Merge the prefixed outputs of the shards (inputs are the shard output files)
+    parser.add_option("-e", "--enrichment", dest="enrichment", default=None)                            #Enrichment.Values of the global pass the shards were run with (--merge), copied instead of averaging the shards
+    parser.add_option("--od", "--outdir", dest="outdir", default=".")                                   #Output directory
+    (options, args) = parser.parse_args()
+
+    debut = time.time()
+
+    if options.split:
+        costs = LocusCosts([f for f in args if f.endswith('.processed.filtered')])
+        WriteShards(BalancedShards(costs, int(options.split)), costs, options.outdir)
+    elif options.merge:
+        MergeShards(args, options.outdir, options.enrichment)
+    else:
+        parser.error("one of --split or --merge is needed")
+
+    print("\n~~~~~ paintor_shards finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
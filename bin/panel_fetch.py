@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+# This script fetches the 1000 Genomes reference panel (one VCF per chromosome and the panel file of the samples)
+# into a persistent cache directory, and writes the ldFile.txt and mapFile.txt files used by the LD calculation.
+#   - the chromosomes are fetched by a bounded pool of workers, each file is retried with an exponential backoff
+#   - a download goes to FILE.part first, and an interrupted download is resumed where it stopped (HTTP Range request,
+#     or seek for local sources); the file only gets its final name once complete
+#   - a file is verified against the md5 of the --checksums file when it is listed there, otherwise against the size
+#     announced by the source, and a VCF must end with the bgzip end-of-file block
+#   - verified files are recorded in CACHE/fetched.json (md5, size, modification time) and are not fetched again by
+#     later runs, as long as they are unchanged; a per-file lock lets several runs share the cache
+#   - the tabix index of each VCF is fetched too, or built once when the source has none; its manifest entry holds the
+#     md5 of the VCF it was verified with, and it is fetched or built again when the VCF changed
+# The source is the official one of the reference genome, or a --mirror holding the same file names: a local
+# directory, a file:// URL or another http(s) URL.
+
+
+# IMPORTS --------------------------------------------------------------------
+import concurrent.futures
+import urllib.request
+import urllib.error
+import hashlib
+import shutil
+import fcntl
+import json
+import time
+import sys
+import os
+from optparse import OptionParser
+try:
+    import pysam
+except ImportError:
+    pysam = None
+# ----------------------------------------------------------------------------
+
+
+# source directory and vcf name (with a {chr} field) of each reference genome
+PANELS = {'hg19' : ("https://hgdownload.cse.ucsc.edu/gbdb/hg19/1000Genomes/phase3",
+                    "ALL.chr{chr}.phase3_shapeit2_mvncall_integrated_v5a.20130502.genotypes.vcf.gz"),
+          'hg38' : ("https://web-genobioinfo.toulouse.inrae.fr/~sdjebali/1000Genomes/hg38.vcf.2504sample",
+                    "CCDG_14151_B01_GRM_WGS_2020-08-05_chr{chr}.filtered.shapeit2-duohmm-phased.2504samples.bcftools.vcf.gz")}
+MAP_URL = "https://ftp.1000genomes.ebi.ac.uk/vol1/ftp/release/20130502/integrated_call_samples_v3.20130502.ALL.panel"
+
+# last 28 bytes of a complete bgzip file (empty block)
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# size of the blocks copied and hashed at once
+BLOCK_SIZE = 1 << 20
+
+# seconds before the first retry of a failed download (doubled at each retry)
+RETRY_DELAY = 5
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+class SourceMissing(Exception):
+    """
+    the file does not exist at the source (not retried)
+    """
+
+
+def SourceUrl(source : str, name : str) -> str :
+    """
+    returns the url of the file name in a source directory (local directory, file:// or http(s) url)
+    """
+    if "://" not in source:
+        source = "file://" + os.path.abspath(source)
+
+    return source.rstrip('/') + '/' + name
+
+
+def OpenSource(url : str, offset : int) -> tuple :
+    """
+    returns (stream, offset, total size or None) of the url, the stream starting at offset when the source supports it
+    (offset is then returned unchanged, otherwise 0)
+    """
+    if url.startswith("file://"):
+        path = urllib.request.url2pathname(url[len("file://"):])
+        if not os.path.exists(path):
+            raise SourceMissing(url)
+        size = os.path.getsize(path)
+        stream = open(path, 'rb')
+        offset = offset if offset <= size else 0
+        stream.seek(offset)
+        return stream, offset, size
+
+    request = urllib.request.Request(url, headers={'Range' : f"bytes={offset}-"} if offset else {})
+    try:
+        response = urllib.request.urlopen(request, timeout=60)
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            raise SourceMissing(url)
+        if e.code == 416:
+            # the partial file is not shorter than the source: start again
+            return OpenSource(url, 0)
+        raise
+    length = response.headers.get('Content-Length')
+    if response.status == 206:
+        return response, offset, offset + int(length) if length else None
+
+    return response, 0, int(length) if length else None
+
+
+def FileMd5(path : str) -> str :
+    """
+    returns the md5 checksum of a file
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            md5.update(block)
+
+    return md5.hexdigest()
+
+
+def ReadChecksums(checksums : str) -> dict :
+    """
+    returns the dictionary file name -> md5 of a checksum file in md5sum format (local path or url)
+    """
+    if not checksums:
+        return {}
+    if "://" in checksums:
+        with urllib.request.urlopen(checksums, timeout=60) as f:
+            lines = f.read().decode().splitlines()
+    else:
+        with open(checksums) as f:
+            lines = f.read().splitlines()
+
+    return {os.path.basename(fields[-1].lstrip('*')) : fields[0].lower() for fields in map(str.split, lines) if len(fields) >= 2}
+
+
+class PanelCache:
+    """
+    directory of the fetched files, with the manifest of the verified ones
+    """
+    def __init__(self, cache_dir : str, checksums : dict, retries : int = 3):
+        self.dir = os.path.abspath(cache_dir)
+        self.checksums = checksums
+        self.retries = retries
+        self.manifest_file = os.path.join(self.dir, "fetched.json")
+        os.makedirs(self.dir, exist_ok=True)
+
+    def Path(self, name : str) -> str :
+        return os.path.join(self.dir, name)
+
+    def ReadManifest(self) -> dict :
+        if not os.path.exists(self.manifest_file):
+            return {}
+        with open(self.manifest_file) as f:
+            return json.load(f)
+
+    def Record(self, name : str, md5 : str, vcf_md5 : str = None) -> None :
+        """
+        adds a verified file to the manifest (read again under the lock, as other workers and runs write it too)
+        vcf_md5 is the md5 of the vcf a tabix index goes with
+        """
+        with open(self.manifest_file + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self.ReadManifest()
+            stat = os.stat(self.Path(name))
+            manifest[name] = {'md5' : md5, 'size' : stat.st_size, 'mtime' : stat.st_mtime}
+            if vcf_md5 is not None:
+                manifest[name]['vcf_md5'] = vcf_md5
+            with open(self.manifest_file + ".tmp", 'w') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(self.manifest_file + ".tmp", self.manifest_file)
+
+        return None
+
+    def IsVerified(self, name : str, full : bool = False, vcf_md5 : str = None) -> bool :
+        """
+        tells whether a file of the cache is the one that was verified (same size and modification time, or same md5
+        with full), and, for a tabix index, verified with the vcf of md5 vcf_md5
+        """
+        entry = self.ReadManifest().get(name)
+        path = self.Path(name)
+        if entry is None or not os.path.exists(path):
+            return False
+        if vcf_md5 is not None and entry.get('vcf_md5') != vcf_md5:
+            return False
+        if name in self.checksums and self.checksums[name] != entry['md5']:
+            return False
+        if full:
+            return FileMd5(path) == entry['md5']
+        stat = os.stat(path)
+
+        return stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']
+
+    def Download(self, url : str, name : str) -> None :
+        """
+        downloads url to FILE.part, resuming the part already downloaded, and renames it once complete
+        """
+        part = self.Path(name) + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        stream,offset,total = OpenSource(url, offset)
+        with stream, open(part, 'ab' if offset else 'wb') as f:
+            if offset:
+                print(f"{name}: resuming at byte {offset}")
+            shutil.copyfileobj(stream, f, BLOCK_SIZE)
+        size = os.path.getsize(part)
+        if total is not None and size != total:
+            raise IOError(f"{name}: {size} bytes downloaded out of {total}")
+        os.replace(part, self.Path(name))
+
+        return None
+
+    def Verify(self, name : str) -> str :
+        """
+        checks a downloaded file against its expected md5 and, for a vcf, its bgzip end-of-file block, returns its md5
+        """
+        path = self.Path(name)
+        md5 = FileMd5(path)
+        if name in self.checksums and self.checksums[name] != md5:
+            raise IOError(f"{name}: md5 {md5} instead of {self.checksums[name]}")
+        if name.endswith('.vcf.gz'):
+            with open(path, 'rb') as f:
+                f.seek(max(os.path.getsize(path) - len(BGZF_EOF), 0))
+                if f.read() != BGZF_EOF:
+                    raise IOError(f"{name}: truncated bgzip file")
+
+        return md5
+
+    def Fetch(self, source : str, name : str, full : bool = False, vcf_md5 : str = None) -> str :
+        """
+        returns the path of the file name of the cache, downloading and verifying it from the source when it is not
+        there yet (retried with an exponential backoff, SourceMissing when the source does not have it)
+        vcf_md5 is the md5 of the vcf a tabix index goes with
+        """
+        with open(self.Path(name) + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.IsVerified(name, full, vcf_md5):
+                return self.Path(name)
+            url = SourceUrl(source, name)
+            for attempt in range(self.retries + 1):
+                try:
+                    self.Download(url, name)
+                    self.Record(name, self.Verify(name), vcf_md5)
+                    break
+                except SourceMissing:
+                    raise
+                except (OSError, urllib.error.URLError) as e:
+                    print(f"{name}: attempt {attempt + 1} failed ({e})")
+                    if os.path.exists(self.Path(name)):
+                        # a complete but corrupted file is downloaded again from the start
+                        os.remove(self.Path(name))
+                    if attempt == self.retries:
+                        raise
+                    time.sleep(RETRY_DELAY * 2 ** attempt)
+
+        return self.Path(name)
+
+
+def IndexVcf(vcf : str) -> None :
+    """
+    builds the tabix index of a bgzipped vcf file
+    """
+    if pysam is not None:
+        pysam.tabix_index(vcf, preset='vcf', force=True, keep_original=True)
+    elif os.system(f"tabix -f -p vcf {vcf}") != 0:
+        raise IOError(f"{vcf}: tabix indexing failed")
+
+    return None
+
+
+def FetchChromosome(cache : PanelCache, source : str, vcf_name : str, full : bool = False) -> str :
+    """
+    fetches the vcf of a chromosome and its tabix index (built when the source has none), returns the vcf path
+    an index verified with another version of the vcf is fetched or built again
+    """
+    vcf = cache.Fetch(source, vcf_name, full)
+    vcf_md5 = cache.ReadManifest()[vcf_name]['md5']
+    tbi = vcf_name + ".tbi"
+    try:
+        cache.Fetch(source, tbi, full, vcf_md5)
+    except SourceMissing:
+        with open(cache.Path(tbi) + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not cache.IsVerified(tbi, full, vcf_md5):
+                print(f"{tbi}: not at the source, building it")
+                IndexVcf(vcf)
+                cache.Record(tbi, FileMd5(cache.Path(tbi)), vcf_md5)
+
+    return vcf
+
+
+def FetchPanel(ref_genome : str, chromosomes : "list[int]", cache : PanelCache, mirror : str = None, workers : int = 4,
+               full : bool = False) -> tuple :
+    """
+    fetches the panel file and the vcf of the chromosomes with a pool of workers, returns (panel file path, dictionary
+    chromosome -> vcf path of the chromosomes fetched, list of the chromosomes that failed)
+    """
+    vcf_source,vcf_template = PANELS[ref_genome]
+    map_source,map_name = MAP_URL.rsplit('/', 1)
+    if mirror:
+        vcf_source = map_source = mirror
+
+    map_file = cache.Fetch(map_source, map_name, full)
+
+    vcfs,failed = {},[]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(FetchChromosome, cache, vcf_source, vcf_template.format(chr=chr), full) : chr for chr in chromosomes}
+        for future in concurrent.futures.as_completed(futures):
+            chr = futures[future]
+            try:
+                vcfs[chr] = future.result()
+                print(f"--- chromosome {chr} ready ---")
+            except Exception as e:
+                print(f"chromosome {chr} could not be fetched: {e}", file=sys.stderr)
+                failed.append(chr)
+
+    return map_file, vcfs, sorted(failed)
+
+
+def ParseChromosomes(chromosomes : str) -> "list[int]" :
+    """
+    returns the chromosome numbers of a list such as 1-22 or 1,2,7-9
+    """
+    numbers = []
+    for part in chromosomes.split(','):
+        first,_,last = part.partition('-')
+        numbers.extend(range(int(first), int(last or first) + 1))
+
+    return sorted(set(numbers))
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-g", "--ref_genome", dest="ref_genome", default="hg19")                          #Reference genome (hg19 or hg38)
+    parser.add_option("-c", "--cache", dest="cache", default=".")                                       #Persistent directory of the fetched files
+    parser.add_option("--mirror", dest="mirror", default=None)                                          #Directory, file:// or http(s) url holding the panel files (instead of the official source)
+    parser.add_option("--checksums", dest="checksums", default=None)                                    #File or url of the md5 of the panel files (md5sum format)
+    parser.add_option("--chr", dest="chr", default="1-22")                                              #Chromosomes to fetch (e.g. 1-22 or 1,2,7-9)
+    parser.add_option("-w", "--workers", dest="workers", default=4)                                     #Number of files downloaded at once
+    parser.add_option("--retries", dest="retries", default=3)                                           #Number of retries of a failed download
+    parser.add_option("--verify", dest="verify", action="store_true", default=False)                    #Check the md5 of the cached files again instead of their size and date
+    parser.add_option("--od", "--outdir", dest="outdir", default=".")                                   #Output directory of ldFile.txt and mapFile.txt
+    (options, args) = parser.parse_args()
+
+    if options.ref_genome not in PANELS:
+        parser.error(f"unknown reference genome {options.ref_genome}, must be one of {', '.join(PANELS)}")
+
+    debut = time.time()
+
+    cache = PanelCache(options.cache, ReadChecksums(options.checksums), int(options.retries))
+    map_file,vcfs,failed = FetchPanel(options.ref_genome, ParseChromosomes(options.chr), cache, options.mirror,
+                                      int(options.workers), options.verify)
+
+    if failed:
+        # no ldFile.txt with missing or broken chromosomes
+        print(f"chromosomes {', '.join(map(str, failed))} could not be fetched", file=sys.stderr)
+        return 1
+
+    shutil.copyfile(map_file, os.path.join(options.outdir, "mapFile.txt"))
+    with open(os.path.join(options.outdir, "ldFile.txt"), 'w') as f:
+        f.writelines(f"{chr}\t{vcfs[chr]}\n" for chr in sorted(vcfs))
+    print(f"{len(vcfs)} chromosomes in {cache.dir}\n")
+
+    print("~~~~~ panel_fetch finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": sys.exit(main())
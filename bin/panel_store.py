@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# This script builds and reads a compact, memory-mappable store of the reference panel genotypes.
+# Each chromosome VCF listed in ldFile.txt is converted once into:
+#   chrN.geno.bin   the dosages (0/1/2) of the bi-allelic snps, packed 4 samples per byte (2 bits per genotype)
+#   chrN.pos.npy    the sorted positions of the snps (position index)
+#   chrN.ref.npy    the reference allele of the snps
+#   chrN.alt.npy    the alternative allele of the snps
+#   chrN.freq.npy   the alternative allele frequency of the snps in each population and super population
+#   chrN.json       the samples, populations and source vcf of the chromosome (written last, marks the store as built)
+# Later runs then read only the snp rows they need, without decompressing nor parsing the vcf.
+# The store of a chromosome is rebuilt when its source vcf changes (path, size or modification time).
+# Several tasks and runs share a store: a chromosome is built under an exclusive lock of chrN.lock (a task waiting for
+# it finds the store built and does not build it again), its files are written under names unique to the process and
+# renamed into place once all of them are written, and readers open the files under a shared lock, so that they never
+# mix the files of two versions (a read-only store, where no chrN.lock can be created, is read without the lock).
+
+
+# IMPORTS --------------------------------------------------------------------
+import pandas as pd
+import numpy as np
+import time
+import os
+import gzip
+import json
+import fcntl
+import multiprocessing
+from functools import partial
+from optparse import OptionParser
+# ----------------------------------------------------------------------------
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def SourceSignature(vcf : str) -> dict :
+    """
+    returns what identifies a version of a vcf file: its real path, size and modification time
+    """
+    stat = os.stat(vcf)
+
+    return {'vcf' : os.path.realpath(vcf), 'size' : stat.st_size, 'mtime' : int(stat.st_mtime)}
+
+
+def IsPanelBuilt(panel_dir : str, chr : str, vcf : str) -> bool :
+    """
+    returns True if the store of the chromosome exists and was built from the current version of the vcf
+    """
+    manifest = os.path.join(panel_dir, f"chr{chr}.json")
+    if not os.path.isfile(manifest):
+        return False
+    with open(manifest) as f:
+        return json.load(f)['source'] == SourceSignature(vcf)
+
+
+def PackDosages(dosages : np.ndarray) -> np.ndarray :
+    """
+    packs a (snps x samples) matrix of 0/1/2 dosages into a (snps x ceil(samples/4)) uint8 matrix, 2 bits per genotype
+    """
+    nb_snp,nb_sample = dosages.shape
+    padded = np.zeros((nb_snp, -(-nb_sample // 4) * 4), dtype=np.uint8)
+    padded[:, :nb_sample] = dosages
+    padded = padded.reshape(nb_snp, -1, 4)
+
+    return padded[:,:,0] | (padded[:,:,1] << 2) | (padded[:,:,2] << 4) | (padded[:,:,3] << 6)
+
+
+def UnpackDosages(packed : np.ndarray, nb_sample : int) -> np.ndarray :
+    """
+    unpacks a matrix packed by PackDosages into the (snps x samples) int8 matrix of dosages
+    """
+    unpacked = (packed[:,:,None] >> np.array([0,2,4,6], dtype=np.uint8)) & 3
+
+    return unpacked.reshape(len(packed), -1)[:, :nb_sample].astype(np.int8)
+
+
+def VcfSnps(vcf : str, nb_sample : int):
+    """
+    yields (position, ref, alt, dosages) for each bi-allelic snp of the vcf
+    """
+    with gzip.open(vcf, 'rt') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t', 9)
+            ref,alt = fields[3].upper(),fields[4].upper()
+            if len(ref) != 1 or len(alt) != 1:
+                continue
+            genotypes = fields[9].rstrip('\n') + '\t'
+            if len(genotypes) == 4 * nb_sample:
+                # every sample field is a 3 characters genotype (0|1...), read them as a fixed width byte matrix
+                gt = np.frombuffer(genotypes.encode(), dtype=np.uint8).reshape(-1,4)
+            else:
+                gt = np.frombuffer(''.join(g[:3].ljust(3) for g in genotypes.split('\t')[:nb_sample]).encode(), dtype=np.uint8).reshape(-1,3)
+            yield int(fields[1]), ref, alt, (gt[:,0] == ord('1')).astype(np.int8) + (gt[:,2] == ord('1'))
+
+
+def BuildChromosomePanel(chr : str, vcf : str, map_file : str, panel_dir : str, block : int = 10000) -> str :
+    """
+    converts the vcf of one chromosome into the packed store (see the top of this file), block snps at a time, under
+    the lock of the chromosome (nothing is done when another process built it meanwhile)
+    """
+    start_time = time.time()
+    os.makedirs(panel_dir, exist_ok=True)
+    prefix = os.path.join(panel_dir, f"chr{chr}")
+    with open(f"{prefix}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if IsPanelBuilt(panel_dir, chr, vcf):
+            print(f"--- panel of chromosome {chr} already built by another process ---\n")
+            return chr
+        nb_snp = WriteChromosomePanel(prefix, vcf, map_file, block)
+
+    print(f"--- panel of chromosome {chr} ({nb_snp} SNPs) built in %s seconds ---\n" % (time.time() - start_time))
+    return chr
+
+
+def WriteChromosomePanel(prefix : str, vcf : str, map_file : str, block : int = 10000) -> int :
+    """
+    writes the files of the store of one chromosome under temporary names unique to the process, then renames them
+    into place (the manifest last), returns the number of snps
+    """
+    tmp = f"{os.getpid()}.tmp"
+
+    with gzip.open(vcf, 'rt') as f:
+        for line in f:
+            if line.startswith('#CHROM'):
+                samples = line.rstrip('\n').split('\t')[9:]
+                break
+
+    # population indicator matrix (samples x populations), used to compute all the frequencies with one product per block
+    sample_map = pd.read_csv(map_file, sep='\t', index_col=False, usecols=[0,1,2], dtype=str)
+    sample_map = sample_map.set_index(sample_map.columns[0])
+    sample_map = sample_map.reindex(samples)
+    populations = sorted(set(sample_map.iloc[:,0].dropna()) | set(sample_map.iloc[:,1].dropna()))
+    indicator = np.array([(sample_map.iloc[:,0] == p) | (sample_map.iloc[:,1] == p) for p in populations], dtype=np.float32).T
+    counts = np.maximum(indicator.sum(axis=0), 1)
+
+    positions,refs,alts,freqs = [],[],[],[]
+    buffer = []
+    with open(f"{prefix}.{tmp}.geno.bin", 'wb') as geno:
+        def flush():
+            dosages = np.vstack([d for _,_,_,d in buffer])
+            freqs.append((dosages.astype(np.float32) @ indicator) / (2 * counts))
+            PackDosages(dosages).tofile(geno)
+            positions.extend(p for p,_,_,_ in buffer)
+            refs.extend(r for _,r,_,_ in buffer)
+            alts.extend(a for _,_,a,_ in buffer)
+            buffer.clear()
+
+        for snp in VcfSnps(vcf, len(samples)):
+            buffer.append(snp)
+            if len(buffer) == block:
+                flush()
+        if buffer:
+            flush()
+
+    np.save(f"{prefix}.{tmp}.pos.npy", np.array(positions, dtype=np.int32))
+    np.save(f"{prefix}.{tmp}.ref.npy", np.array(refs, dtype='S1'))
+    np.save(f"{prefix}.{tmp}.alt.npy", np.array(alts, dtype='S1'))
+    np.save(f"{prefix}.{tmp}.freq.npy", np.vstack(freqs) if freqs else np.zeros((0, len(populations)), dtype=np.float32))
+    manifest = {'source' : SourceSignature(vcf), 'samples' : samples, 'populations' : populations, 'nb_snp' : len(positions)}
+    with open(f"{prefix}.{tmp}.json", 'w') as f:
+        json.dump(manifest, f)
+
+    for kind in ('geno.bin', 'pos.npy', 'ref.npy', 'alt.npy', 'freq.npy', 'json'):
+        os.replace(f"{prefix}.{tmp}.{kind}", f"{prefix}.{kind}")
+
+    return len(positions)
+
+
+def LoadChromosomePanel(panel_dir : str, chr : str) -> dict :
+    """
+    returns the store of one chromosome: its manifest entries plus the memory-mapped arrays
+    """
+    prefix = os.path.join(panel_dir, f"chr{chr}")
+    # the files are opened under the shared lock, the memory maps keep reading them if a rebuild replaces them later
+    # the lock file is only opened for reading, and a store where it cannot be created (read-only, or owned by another
+    # user, so that no task can rebuild it either) is read without the lock
+    try:
+        lock = os.open(f"{prefix}.lock", os.O_RDONLY | os.O_CREAT, 0o666)
+    except OSError:
+        lock = None
+    try:
+        if lock is not None:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+        with open(f"{prefix}.json") as f:
+            panel = json.load(f)
+        nb_byte = -(-len(panel['samples']) // 4)
+        panel['pos'] = np.load(f"{prefix}.pos.npy", mmap_mode='r')
+        panel['ref'] = np.load(f"{prefix}.ref.npy", mmap_mode='r')
+        panel['alt'] = np.load(f"{prefix}.alt.npy", mmap_mode='r')
+        panel['freq'] = np.load(f"{prefix}.freq.npy", mmap_mode='r')
+        panel['geno'] = np.memmap(f"{prefix}.geno.bin", dtype=np.uint8, mode='r', shape=(panel['nb_snp'], nb_byte)) if panel['nb_snp'] else np.zeros((0, nb_byte), dtype=np.uint8)
+    finally:
+        if lock is not None:
+            os.close(lock)
+
+    return panel
+
+
+def ReadPanelGenotypes(panel_dir : str, chr : str, positions : "set[int]", samples : "set[str]") -> dict :
+    """
+    returns the dictionary position -> list of (ref, alt, dosages) of the stored snps at the given positions,
+    dosages being restricted to the given samples (same output as ld_calculation.ReadGenotypes)
+    """
+    start_time = time.time()
+    panel = LoadChromosomePanel(panel_dir, chr)
+    wanted = np.array(sorted(positions), dtype=np.int64)
+
+    # all the stored rows at the wanted positions, found with searchsorted on the position index
+    starts = np.searchsorted(panel['pos'], wanted, side='left')
+    ends = np.searchsorted(panel['pos'], wanted, side='right')
+    rows = np.concatenate([np.arange(s, e) for s,e in zip(starts, ends)]) if len(wanted) else np.zeros(0, dtype=np.int64)
+    columns = np.array([j for j,s in enumerate(panel['samples']) if s in samples])
+    dosages = UnpackDosages(np.asarray(panel['geno'][rows]), len(panel['samples']))[:, columns]
+
+    genotypes = {}
+    for k,row in enumerate(rows):
+        genotypes.setdefault(int(panel['pos'][row]), []).append((panel['ref'][row].decode(), panel['alt'][row].decode(), dosages[k]))
+
+    print(f"--- {len(genotypes)} positions of chromosome {chr} read from the panel in %s seconds ---\n" % (time.time() - start_time))
+    return genotypes
+
+
+def PopulationFrequencies(panel_dir : str, chr : str, population : str) -> tuple :
+    """
+    returns (positions, alternative allele frequencies in the population) of the stored snps of one chromosome
+    """
+    panel = LoadChromosomePanel(panel_dir, chr)
+
+    return panel['pos'], panel['freq'][:, panel['populations'].index(population)]
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser()
+    parser.add_option("-r", "--reference", dest="ld_file", default="ldFile.txt")                        #File with the chromosome number and the reference panel vcf of each chromosome
+    parser.add_option("-m", "--map_file", dest="map_file", default="mapFile.txt")                       #Sample to population map file of the reference panel
+    parser.add_option("-p", "--panel", dest="panel_dir", default="panel")                               #Directory of the packed genotype store
+    parser.add_option("-c", "--chromosomes", dest="chromosomes", default=None)                          #Comma separated chromosomes to build (all the chromosomes of the ld file by default)
+    parser.add_option("-t", "--threads", dest="threads", default=1)                                     #Number of chromosomes built in parallel
+    (options, args) = parser.parse_args()
+
+    debut = time.time()
+
+    # imported here, ld_calculation.py imports this module
+    from ld_calculation import ReadLdFile
+    ld_files = ReadLdFile(options.ld_file)
+    chromosomes = options.chromosomes.split(',') if options.chromosomes else list(ld_files)
+    todo = [c for c in chromosomes if not IsPanelBuilt(options.panel_dir, c, ld_files[c])]
+    print(f"Chromosomes already in the panel: {[c for c in chromosomes if c not in todo]}")
+    print(f"Chromosomes to build: {todo}\n")
+
+    build = partial(BuildChromosomePanel, map_file=options.map_file, panel_dir=options.panel_dir)
+    threads = min(int(options.threads), len(todo))
+    if threads <= 1:
+        for c in todo:
+            build(c, ld_files[c])
+    else:
+        with multiprocessing.get_context("fork").Pool(threads) as p:
+            for chr in p.starmap(build, [(c, ld_files[c]) for c in todo], chunksize=1):
+                print(f"Chromosome {chr} done !\n")
+
+    print("~~~~~ panel_store finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# This script selects the snps with the highest posterior probabilities among the annotated PAINTOR results of all
+# the loci, in place of the concatenations and global sorts of RESULTS_posteriorprob.
+# The LOCUS.results.annotated files are read one at a time, and in the same pass:
+#   - their rows are appended to posteriorprob_merged.txt (all the snps, in the file order)
+#   - the rows above the posterior probability threshold go through a heap bounded to the number of snps to keep,
+#     which gives posteriorprob_merged_filtered.txt
+#   - the rows of the locus are sorted and written to a temporary run file; all.annotated.SNP.sorted.by.pp.txt is then
+#     the k-way merge of these runs
+# so that memory depends on the number of snps to keep and on the largest locus, not on the total number of snps.
+# Rows are ordered by decreasing posterior probability, ties by increasing line, as sort -k10,10gr orders them.
+
+
+# IMPORTS --------------------------------------------------------------------
+import heapq
+import time
+import os
+import shutil
+import tempfile
+from optparse import OptionParser
+# ----------------------------------------------------------------------------
+
+
+# maximum number of run files merged at once (kept under the usual limit of open files)
+MERGE_FANIN = 256
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+class WorstFirst:
+    """
+    heap entry of a row ordered from the worst to the best row: the lowest posterior probability first, then, for
+    equal probabilities, the highest line
+    """
+    __slots__ = ('pp', 'line')
+
+    def __init__(self, pp : float, line : str):
+        self.pp = pp
+        self.line = line
+
+    def __lt__(self, other) -> bool:
+        return self.pp < other.pp or (self.pp == other.pp and self.line > other.line)
+
+
+def SortKey(pp_column : int):
+    """
+    returns the key ordering the rows by decreasing posterior probability (column pp_column, 1-based), then by line
+    """
+    return lambda line: (-float(line.split()[pp_column - 1]), line)
+
+
+def MergeRuns(runs : "list[str]", out, key, tmp_dir : str) -> None :
+    """
+    writes to out the k-way merge of the sorted run files, merging at most MERGE_FANIN runs at once
+    (intermediate merges are written as new runs in tmp_dir)
+    """
+    while len(runs) > MERGE_FANIN:
+        merged = []
+        for i in range(0, len(runs), MERGE_FANIN):
+            merged.append(os.path.join(tmp_dir, f"merge{len(runs)}.{i}"))
+            with open(merged[-1], 'w') as f:
+                MergeRuns(runs[i:i+MERGE_FANIN], f, key, tmp_dir)
+        runs = merged
+
+    files = [open(run) for run in runs]
+    try:
+        out.writelines(heapq.merge(*files, key=key))
+    finally:
+        for f in files:
+            f.close()
+
+    return None
+
+
+def SelectPosteriorProb(annotated : "list[str]", nbsnp : int, pp_threshold : float, outdir : str, pp_column : int = 10) -> int :
+    """
+    writes posteriorprob_merged.txt, posteriorprob_merged_filtered.txt and all.annotated.SNP.sorted.by.pp.txt from the
+    annotated results files (see the top of this file), returns the number of snps
+    """
+    key = SortKey(pp_column)
+    top = []
+    runs = []
+    nb_snp = 0
+    header = ''
+    tmp_dir = tempfile.mkdtemp(prefix="posteriorprob_runs.", dir=outdir)
+    try:
+        with open(os.path.join(outdir, "posteriorprob_merged.txt"), 'w') as merged:
+            for i,f in enumerate(annotated):
+                with open(f) as fh:
+                    first = fh.readline()
+                    rows = [line if line.endswith('\n') else line + '\n' for line in fh]
+                if i == 0:
+                    header = first
+                    merged.write(header)
+                merged.writelines(rows)
+                nb_snp += len(rows)
+
+                rows.sort(key=key)
+                runs.append(os.path.join(tmp_dir, f"run{i}"))
+                with open(runs[-1], 'w') as run:
+                    run.writelines(rows)
+
+                for line in rows:
+                    pp = float(line.split()[pp_column - 1])
+                    if pp <= pp_threshold:
+                        # the rows are sorted, the next ones are below the threshold too
+                        break
+                    if len(top) < nbsnp:
+                        heapq.heappush(top, WorstFirst(pp, line))
+                    elif top and top[0] < WorstFirst(pp, line):
+                        heapq.heapreplace(top, WorstFirst(pp, line))
+                    else:
+                        break
+
+        with open(os.path.join(outdir, "posteriorprob_merged_filtered.txt"), 'w') as f:
+            f.write(header)
+            f.writelines(row.line for row in sorted(top, reverse=True))
+
+        with open(os.path.join(outdir, "all.annotated.SNP.sorted.by.pp.txt"), 'w') as f:
+            f.write(header)
+            MergeRuns(runs, f, key, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return nb_snp
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog [options] locus1.results.annotated locus2.results.annotated ...")
+    parser.add_option("-n", "--snp", dest="snp", default=100000000)                                     #Number of snps to keep
+    parser.add_option("--pp_threshold", dest="pp_threshold", default=0.001)                             #Posterior probability threshold (snps above it are kept)
+    parser.add_option("--pp_column", dest="pp_column", default=10)                                      #Column of the posterior probability (1-based)
+    parser.add_option("--od", "--outdir", dest="outdir", default=".")                                   #Output directory
+    (options, args) = parser.parse_args()
+
+    debut = time.time()
+
+    annotated = sorted(args, key=os.path.basename)
+    nb_snp = SelectPosteriorProb(annotated, int(options.snp), float(options.pp_threshold), options.outdir, int(options.pp_column))
+    print(f"{nb_snp} SNPs of {len(annotated)} loci\n")
+
+    print("~~~~~ posteriorprob_select finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+# This script computes the summary statistics of the PAINTOR results, in place of the awk and sort passes of
+# RESULTS_statistics (which read every .results file several times and walked the cumulative posterior sums once
+# per credible set level).
+# Every LOCUS.results file is read once; the snps of all the loci are kept as columns (locus, posterior probability,
+# line) and sorted with a single argsort, then the 50/80/95% credible sets of each locus and of all the snps are found
+# with a cumulative sum and one searchsorted per set of levels.
+# It writes the same files as the former shell block:
+#   annot.probsnpcausal.given.baseline.txt                          probability of a snp to be causal given each annotation
+#   pcent_snp_in_each_annot.txt                                     percentage of the snps of the loci in each annotation
+#   LOCUS.variant.achieving.50.80.95pcent.sumppri.nb.pcent.txt      number and percentage of snps of the 50/80/95% credible sets
+#   LOCUS.credibleset.95pcent.tsv                                   snps of the 95% credible set, by decreasing posterior probability
+#   locus.variant.achieving.95pcent.sumppri.nb.pcent.txt            95% credible set of each locus
+#   locus.variant.achieving.95pcent.sumppri.stats.txt               summary of the percentages of the 95% credible sets
+#   snp.ppr.txt                                                     posterior probability of every snp
+#   all.variants.pcent.snps.achieving.50.80.95pcent.sumppri.txt     credible sets of all the snps together
+#   LOCUS.results.for.canvis                                        results with the position column named pos, for CANVIS
+
+
+# IMPORTS --------------------------------------------------------------------
+import numpy as np
+import time
+import os
+from optparse import OptionParser
+# ----------------------------------------------------------------------------
+
+
+# credible set levels (percent of the posterior probability mass)
+LEVELS = (50, 80, 95)
+
+
+# FUNCTIONS  -----------------------------------------------------------------
+def AwkNumber(x : float) -> str :
+    """
+    formats a number the way awk prints it: integral values as integers, other values with %.6g
+    """
+    return str(int(x)) if x == int(x) else "%.6g" % x
+
+
+def ReadResults(results : "list[str]") -> tuple :
+    """
+    reads the PAINTOR results files, returns (loci names, headers, columns) where columns is a dictionary of arrays
+    with one entry per snp: locus index, posterior probability (last column), snp id (chr:pos) and the line itself
+    """
+    loci,headers,locus,pp,snp,lines = [],[],[],[],[],[]
+    for i,f in enumerate(results):
+        with open(f) as fh:
+            rows = fh.read().splitlines()
+        loci.append(os.path.basename(f)[:-len('.results')])
+        headers.append(rows[0] if rows else '')
+        for line in rows[1:]:
+            fields = line.split()
+            snp.append(f"{fields[0]}:{fields[1]}")
+            pp.append(fields[-1])
+        locus.append(np.full(len(rows[1:]), i, dtype=np.int32))
+        lines.extend(rows[1:])
+
+    columns = {'locus' : np.concatenate(locus) if locus else np.zeros(0, dtype=np.int32),
+               'ppr' : np.array(pp, dtype=object),
+               'pp' : np.array(pp, dtype=np.float64),
+               'snp' : np.array(snp, dtype=object),
+               'line' : np.array(lines, dtype=str)}
+
+    return loci, headers, columns
+
+
+def CredibleSets(pp : np.ndarray) -> tuple :
+    """
+    returns (sum, [number of snps of each credible set level]) for posterior probabilities sorted in decreasing order:
+    the credible set of a level is made of the first snps whose cumulative sum reaches level% of the sum
+    """
+    cumulative = np.cumsum(pp)
+    total = cumulative[-1] if len(pp) else 0.0
+    targets = np.array([level * total / 100 for level in LEVELS])
+
+    return total, np.minimum(np.searchsorted(cumulative, targets, side='left') + 1, len(pp))
+
+
+def WriteCredibleSets(n : int, total : float, sizes : np.ndarray, out_file : str) -> None :
+    """
+    writes the number of snps, the sum of their posterior probabilities and the size (number and percentage of the
+    snps) of each credible set
+    """
+    with open(out_file, 'w') as f:
+        f.write(f"all\t{n}\t{AwkNumber(total)}\n")
+        for level,size in zip(LEVELS, sizes):
+            f.write(f"ok{level}\t{size}\t{AwkNumber(size / n * 100) if n else 0}\n")
+
+    return None
+
+
+def AnnotationProbabilities(enrichment : str, out_file : str) -> None :
+    """
+    writes the probability of a snp to be causal given each annotation, from the PAINTOR Enrichment.Values file
+    (the baseline alone for the first one, the baseline plus the annotation for the others)
+    """
+    with open(enrichment) as f:
+        names = f.readline().split()
+        values = np.array(f.readline().split(), dtype=np.float64)
+    logits = values[0] + np.append(0, values[1:])
+    with open(out_file, 'w') as f:
+        f.writelines(f"{name}\t{AwkNumber(p)}\n" for name,p in zip(names, 1 / (1 + np.exp(logits))))
+
+    return None
+
+
+def AnnotationPercentages(allannots : "list[str]", annotations : str, out_file : str) -> None :
+    """
+    writes the percentage of the snps of all the annotation matrices that fall in each annotation
+    """
+    with open(annotations) as f:
+        names = [line.split()[0] for line in f if line.strip()]
+    matrices = [np.loadtxt(f, skiprows=1, ndmin=2, dtype=np.int64) for f in allannots if os.path.getsize(f)]
+    matrices = [m for m in matrices if m.size]
+    counts = np.vstack(matrices) if matrices else np.zeros((0, len(names)), dtype=np.int64)
+    pcent = [f"{s / len(counts) * 100:.2f}%" for s in counts.sum(axis=0)] if len(counts) else []
+    with open(out_file, 'w') as f:
+        for i in range(max(len(names), len(pcent))):
+            f.write(f"{names[i] if i < len(names) else ''}\t{pcent[i] if i < len(pcent) else ''}\n")
+
+    return None
+
+
+def SummaryStats(values : np.ndarray, out_file : str) -> None :
+    """
+    writes the summary (min, quartiles, mean, max, rank of the max) of the values, formatted like R summary()
+    """
+    names = ["Min.", "1st Qu.", "Median", "Mean", "3rd Qu.", "Max."]
+    stats = [values.min(), np.quantile(values, 0.25), np.median(values), values.mean(), np.quantile(values, 0.75), values.max()]
+    # 4 significant digits, with the number of decimals the values need in common
+    stats = [float(f"{s:.4g}") for s in stats]
+    decimals = max(next(d for d in range(10) if round(s, d) == s) for s in stats)
+    stats = [f"{s:.{decimals}f}" for s in stats]
+    width = max(len(x) for x in names + stats)
+    with open(out_file, 'w') as f:
+        f.write(f"# Read {len(values)} items\n")
+        f.write("#" + "".join(f" {n.rjust(width)}" for n in names) + " \n")
+        f.write("#" + "".join(f" {s.rjust(width)}" for s in stats) + " \n")
+        f.write(f"# argmax {np.argmax(values) + 1}\n")
+
+    return None
+
+
+def ResultsStatistics(results : "list[str]", allannots : "list[str]", annotations : str, enrichment : str, outdir : str) -> None :
+    """
+    writes all the output files listed at the top of this file
+    """
+    AnnotationProbabilities(enrichment, os.path.join(outdir, "annot.probsnpcausal.given.baseline.txt"))
+    AnnotationPercentages(allannots, annotations, os.path.join(outdir, "pcent_snp_in_each_annot.txt"))
+
+    loci,headers,columns = ReadResults(results)
+
+    # snps by locus, then by decreasing posterior probability (ties by increasing line, as sort -k10,10gr does)
+    order = np.lexsort((columns['line'], -columns['pp'], columns['locus']))
+    bounds = np.searchsorted(columns['locus'][order], np.arange(len(loci) + 1))
+    summary = []
+    for i,locus in enumerate(loci):
+        rows = order[bounds[i]:bounds[i+1]]
+        n = len(rows)
+        total,sizes = CredibleSets(columns['pp'][rows])
+        WriteCredibleSets(n, total, sizes, os.path.join(outdir, f"{locus}.variant.achieving.50.80.95pcent.sumppri.nb.pcent.txt"))
+        with open(os.path.join(outdir, f"{locus}.credibleset.95pcent.tsv"), 'w') as f:
+            f.writelines(f"{line}\n" for line in columns['line'][rows[:sizes[-1]]])
+        summary.append((locus, sizes[-1], sizes[-1] / n * 100 if n else 0))
+
+    with open(os.path.join(outdir, "locus.variant.achieving.95pcent.sumppri.nb.pcent.txt"), 'w') as f:
+        f.writelines(f"{locus}\t{size}\t{AwkNumber(pcent)}\n" for locus,size,pcent in summary)
+    if summary:
+        SummaryStats(np.array([float(AwkNumber(pcent)) for _,_,pcent in summary]), os.path.join(outdir, "locus.variant.achieving.95pcent.sumppri.stats.txt"))
+
+    with open(os.path.join(outdir, "snp.ppr.txt"), 'w') as f:
+        f.write("snp\tppr\n")
+        f.writelines(f"{snp}\t{ppr}\n" for snp,ppr in zip(columns['snp'], columns['ppr']))
+
+    # credible sets of all the snps together (ties do not change the cumulative sums)
+    total,sizes = CredibleSets(np.sort(columns['pp'])[::-1])
+    WriteCredibleSets(len(columns['pp']), total, sizes, os.path.join(outdir, "all.variants.pcent.snps.achieving.50.80.95pcent.sumppri.txt"))
+
+    # the snps of each file are contiguous in the columns, in the file order
+    bounds = np.searchsorted(columns['locus'], np.arange(len(loci) + 1))
+    for i,(locus,header) in enumerate(zip(loci, headers)):
+        fields = header.split()
+        fields[1:2] = ["pos"]
+        with open(os.path.join(outdir, f"{locus}.results.for.canvis"), 'w') as f:
+            f.write(" ".join(fields) + "\n")
+            f.writelines(f"{line}\n" for line in columns['line'][bounds[i]:bounds[i+1]])
+
+    return None
+
+# ----------------------------------------------------------------------------
+
+
+
+# MAIN  ----------------------------------------------------------------------
+
+def main() -> int:
+    parser = OptionParser(usage="usage: %prog [options] paintor_outputs... annotation_matrices...")
+    parser.add_option("-a", "--annotations", dest="annotations", default="annotations.txt")             #File with the id and the bed file of each annotation
+    parser.add_option("-e", "--enrichment", dest="enrichment", default="Enrichment.Values")             #PAINTOR enrichment file
+    parser.add_option("--od", "--outdir", dest="outdir", default=".")                                   #Output directory
+    (options, args) = parser.parse_args()
+
+    debut = time.time()
+
+    # the .results files of the loci (not the PAINTOR LogFile.results) and the .allannots.txt annotation matrices
+    results = sorted((f for f in args if f.endswith('.results') and os.path.basename(f) != 'LogFile.results'), key=os.path.basename)
+    allannots = sorted((f for f in args if f.endswith('allannots.txt')), key=os.path.basename)
+    print(f"{len(results)} results files and {len(allannots)} annotation matrices\n")
+
+    ResultsStatistics(results, allannots, options.annotations, options.enrichment, options.outdir)
+
+    print("~~~~~ results_statistics finished in %s seconds ~~~~~\n" % (time.time() - debut))
+
+    return 0
+# ----------------------------------------------------------------------------
+
+
+if __name__ == "__main__": main()
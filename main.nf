@@ -69,10 +69,37 @@ params.pvalue_lead = "5e-08"
 params.pvalue_nonlead = "1"
 params.pp_threshold = "0.001"
 params.snp = "100000000"
+params.chunksize = "0"
+params.cacheDir = ""
+params.panelDir = ""
+params.panelCacheDir = ""
+params.panelMirror = ""
+params.panelChecksums = ""
+params.panelFetchWorkers = "4"
+params.annotationIndexDir = ""
+params.maxSnpsPerLocus = "0"
+params.locusCap = "pvalue"
+params.pruneR2 = "0.8"
+params.clumpR2 = "0"
+params.locusStoreDir = ""
+params.locusFormat = "text"
+params.splitLogLevel = "INFO"
+params.splitProfile = false
+params.ldFormat = "npy"
+params.ldDtype = "float32"
+params.ldWindowKb = "250"
+params.ldMinR2 = "0"
+params.ldStoreDir = ""
+params.ldStoreMaxGB = "100"
+params.paintorShards = "1"
+params.paintorEnrichment = ""
+params.fineMapper = "paintor"
+params.finemapMaxCausal = "0"
+params.canvisMode = "batch"
+params.canvisResolution = "200"
 
 // outputs
 params.outputDir_locus = "data/output_locus"
-params.outputDir_sorted_locus = "data/output_sorted_locus"
 params.outputDir_VCFandMAPfrom1000G = "data/output_VCF_map_files"
 params.outputDir_ld = "data/output_ld"
 params.outputDir_bed = "data/output_bed"
@@ -122,6 +149,34 @@ log.info """\
             Population                                    : ${params.population}
             Number of SNPs to keep                        : ${params.snp}
             Posterior probability threshold               : ${params.pp_threshold}
+            GWAS lines read at once (0 = whole file)      : ${params.chunksize}
+            Parsed GWAS cache directory                   : ${params.cacheDir}
+            Packed reference panel directory              : ${params.panelDir}
+            Reference panel download cache directory      : ${params.panelCacheDir}
+            Reference panel mirror                        : ${params.panelMirror}
+            Reference panel checksums file                : ${params.panelChecksums}
+            Reference panel files downloaded at once      : ${params.panelFetchWorkers}
+            Annotation index directory                    : ${params.annotationIndexDir}
+            Maximum SNPs per locus (0 = no cap)           : ${params.maxSnpsPerLocus}
+            Locus cap (pvalue or ld)                      : ${params.locusCap}
+            LD pruning r2 threshold (ld cap)              : ${params.pruneR2}
+            LD clumping r2 threshold (0 = fixed windows)  : ${params.clumpR2}
+            Content named locus store directory           : ${params.locusStoreDir}
+            Locus files format (text, gzip or indexed)    : ${params.locusFormat}
+            Locus splitting log level                     : ${params.splitLogLevel}
+            Locus splitting profile                       : ${params.splitProfile}
+            LD matrix format (npy, text or sparse)        : ${params.ldFormat}
+            LD matrix values type (npy and sparse formats): ${params.ldDtype}
+            Sparse LD window in kb (0 = no limit)         : ${params.ldWindowKb}
+            Sparse LD r2 floor                            : ${params.ldMinR2}
+            Persistent LD store directory                 : ${params.ldStoreDir}
+            Persistent LD store maximum size (GB)         : ${params.ldStoreMaxGB}
+            PAINTOR shards (1 = one run over all loci)    : ${params.paintorShards}
+            PAINTOR enrichment of a global pass           : ${params.paintorEnrichment}
+            Fine-mapping engine (paintor or finemap)      : ${params.fineMapper}
+            finemap causal SNPs cap (0 = no cap)          : ${params.finemapMaxCausal}
+            Locus figures (batch or canvis)               : ${params.canvisMode}
+            Locus figures LD heatmap resolution           : ${params.canvisResolution}
            
 
          USAGE EXAMPLE:
@@ -153,19 +208,20 @@ include {
 } from './modules/preppaintor.nf'
 
 include {
-  LDCALCULATION_sortlocus
   LDCALCULATION_getVCFandMAPfilesfrom1000GP
   LDCALCULATION_calculation
 } from './modules/ldcalculation.nf'
 
 include {
-  ANNOTATIONS_bedfiles
-  ANNOTATIONS_mergeannotations
+  ANNOTATIONS_loci
 } from './modules/annotations.nf'
 
 include {
   PAINTOR_run
-  PAINTOR_annotatedlocus
+  PAINTOR_shards
+  PAINTOR_runshard
+  PAINTOR_merge
+  PAINTOR_annotatedloci
 } from './modules/paintor.nf'
 
 include {
@@ -176,6 +232,7 @@ include {
 
 include {
   CANVIS_run
+  CANVIS_batch
 } from './modules/canvis.nf'
 
 // WORKFLOW --------------------------------------------------------------------
@@ -189,24 +246,6 @@ workflow {
   """
 
   // main
-  // Split GWAS file into loci
-  gwas_split_channel = PREPPAINTOR_splitlocus(gwas_input_channel, params.pvalue_lead, params.pvalue_nonlead, params.kb, params.pvalue_header, params.stderr_header, params.effect_header, params.chromosome_header, params.effectallele_header, params.altallele_header , params.position_header, params.rsid_header ,params.zheader_header)
-  """
-  [/work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus1, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus2, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus3, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus4, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus5, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus1, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus2, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus3, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus4, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus5]
-  """
-
- // Create a channel with the locus id and the locus(+path)
-  gwas_split_id_locus_channel = gwas_split_channel.flatten()
-  gwas_split_id_locus_channel
-    .map { it ->
-           a = it.toString().split('/')
-           l = a.length
-           return [a[l-1], it] }
-    .set { gwas_split_id_locus_channel }
-
-
-  // Sort locus and compute LD matrix + processed files
-  locus_sorted = LDCALCULATION_sortlocus(gwas_split_id_locus_channel)
   ld_map_files = LDCALCULATION_getVCFandMAPfilesfrom1000GP(params.ref_genome)
 
   ld_file = ld_map_files.flatten()
@@ -219,19 +258,91 @@ workflow {
     .filter { it -> it.toString().endsWith('mapFile.txt') }
     .set { map_file }
   
+  // With --clumpR2, the lead SNPs are clumped by LD with the reference panel when the GWAS file is split
+  clump_panel = (params.clumpR2 as float) > 0 ? ld_file.combine(map_file).first() : Channel.value([])
 
-  ld_matrix_processed = LDCALCULATION_calculation(locus_sorted.flatten(), ld_file.collect(), map_file.collect(), params.population, params.effectallele_header, params.altallele_header, params.zheader_header, params.position_header)
-
-
-  // Transform processed files into bed files
-  // The ANNOTATIONS_bedfiles process will use only LD processed file
-  ld_processed_to_bed = ANNOTATIONS_bedfiles(ld_matrix_processed.flatten())
+  // Split GWAS file into loci
+  PREPPAINTOR_splitlocus(gwas_input_channel, params.pvalue_lead, params.pvalue_nonlead, params.kb, params.pvalue_header, params.stderr_header, params.effect_header, params.chromosome_header, params.effectallele_header, params.altallele_header , params.position_header, params.rsid_header ,params.zheader_header, clump_panel)
+  gwas_split_channel = PREPPAINTOR_splitlocus.out.loci
+
+  // With a locus store, the loci are read from the store: the path, size and date of an unchanged locus are the
+  // same as in the previous run, so that the LD, bed and annotation tasks of a chromosome whose loci are all
+  // unchanged are resumed from the cache (these tasks take all the loci of a chromosome, so any changed locus
+  // reruns its whole chromosome)
+  if (params.locusStoreDir) {
+    if (params.locusFormat == 'indexed') {
+      exit 1, "--locusStoreDir needs one file per locus, with --locusFormat text or gzip"
+    }
+    locus_suffix = '.sorted' + (params.locusFormat == 'gzip' ? '.gz' : '')
+    gwas_split_channel = PREPPAINTOR_splitlocus.out.manifest
+      .splitCsv(header: true, sep: '\t')
+      .map { row -> file("${params.locusStoreDir}/${row.locus}${locus_suffix}") }
+      .toSortedList()
+  }
 
-  // Add annotations to bed files
-  annotated_bed = ANNOTATIONS_mergeannotations(ld_processed_to_bed.flatten(), params.annotationsFile)
+  // Predicted LD matrix bytes of each locus, used to size the LD and PAINTOR tasks
+  loci_manifest = PREPPAINTOR_splitlocus.out.manifest
+  loci_manifest
+    .splitCsv(header: true, sep: '\t')
+    .set { loci_manifest_rows }
+  loci_manifest_rows
+    .map { row -> [row.locus, row.ld_bytes as long] }
+    .set { loci_manifest }
+
+  // With the sparse LD format, the LD task only holds the pairs of SNPs within params.ldWindowKb of each other:
+  // nb_snp x the SNPs of a window, the SNPs being taken as evenly spread over the span of the locus
+  chr_ld_bytes = loci_manifest_rows
+  chr_ld_bytes
+    .map { row ->
+           def bytes = row.ld_bytes as long
+           def window = (params.ldWindowKb as double) * 1000
+           if (params.ldFormat == 'sparse' && window > 0) {
+             def n = row.nb_snp as long
+             def band = Math.min(n, (Math.ceil(n * 2 * window / Math.max(row.span as double, 1)) as long) + 1)
+             bytes = 8 * n * band
+           }
+           return [row.locus.split('locus')[0], bytes] }
+    .groupTuple()
+    .map { chr, bytes -> [chr, bytes.max()] }
+    .set { chr_ld_bytes }
+  """
+  [/work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus1, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus2, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus3, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus4, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR01locus5, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus1, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus2, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus3, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus4, /work/project/regenet/workspace/zgerber/Nextflow2/work/f3/cc04def1b3a2838b10bf32c4b6598a/data/output_locus/CHR02locus5]
+  """
 
-  // Run PAINTOR program
-  paintor = PAINTOR_run(ld_matrix_processed.collect(), annotated_bed.collect(), params.annotationsFile, params.zheader_header)
+  // The loci are written sorted by position (LOCUS.sorted files, or CHRnn.loci files with their index)
+  locus_sorted = gwas_split_channel
+
+
+  // Group the sorted loci by chromosome, so that each chromosome VCF is read once for all its loci
+  locus_sorted_per_chr = locus_sorted.flatten()
+  locus_sorted_per_chr
+    .map { it -> [it.name.take(5), it] }
+    .groupTuple(sort: true)
+    .join(chr_ld_bytes)
+    .set { locus_sorted_per_chr }
+
+  ld_matrix_processed = LDCALCULATION_calculation(locus_sorted_per_chr, ld_file.collect(), map_file.collect(), params.population, params.effectallele_header, params.altallele_header, params.zheader_header, params.position_header)
+
+
+  // Transform processed files into bed files and add annotations to them, one task per chromosome
+  // (the ANNOTATIONS_loci process will use only the LD processed files)
+  annotated_loci = ANNOTATIONS_loci(ld_matrix_processed, params.annotationsFile)
+  annotated_bed = annotated_loci.annotations
+
+  // Run PAINTOR program, over all the loci at once or over balanced shards of loci run in parallel
+  if (params.paintorShards.toString().toInteger() > 1) {
+    paintor_shards = PAINTOR_shards(ld_matrix_processed.collect(sort: true), params.paintorShards)
+    locus_ld_bytes = loci_manifest.toList().map { rows -> rows.collectEntries { it } }
+    paintor_shards
+      .flatten()
+      .combine(locus_ld_bytes)
+      .map { shard, bytes -> [shard, shard.readLines().sum { bytes[it] ?: 0L }] }
+      .set { paintor_shards }
+    paintor_shard_results = PAINTOR_runshard(paintor_shards, ld_matrix_processed.collect(sort: true), annotated_bed.collect(sort: true), params.annotationsFile, params.zheader_header)
+    paintor = PAINTOR_merge(paintor_shard_results.collect())
+  } else {
+    paintor = PAINTOR_run(ld_matrix_processed.collect(sort: true), annotated_bed.collect(sort: true), params.annotationsFile, params.zheader_header, loci_manifest.map { it[1] }.sum())
+  }
   """
   [/work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR01locus1.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR01locus2.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR01locus3.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR01locus4.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR01locus5.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR02locus1.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR02locus2.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR02locus3.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR02locus4.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/CHR02locus5.results, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/Enrichment.Values, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/Log.BayesFactor, /work/project/regenet/workspace/zgerber/Nextflow2/work/a2/87a7ca9fbf30b370e57dac79eca95a/LogFile.results]
   """
@@ -255,18 +366,19 @@ workflow {
            return [a[l-1].split('.sorted.ld_out.processed.filtered.ucsc.bed.coord.over.allannots.txt')[0], it] }
     .set { annotated_bed_channel }
   
-  // Combine 2 channels to paste the locus corresponding to its annotation file
+  // Combine 2 channels to paste the locus corresponding to its annotation file, grouped by chromosome
   paintor_annotated_results_channel = paintor_results_channel
   paintor_annotated_results_channel
     .combine(annotated_bed_channel, by:0)
-    .map{ id, res, allannots -> [res, allannots] }
+    .map{ id, res, allannots -> [id.take(5), res, allannots] }
+    .groupTuple(sort: true)
     .set{ paintor_annotated_results_channel }
 
-  // Add the annotations to paintor results
-  paintor_annotated_locus = PAINTOR_annotatedlocus(paintor_annotated_results_channel)
+  // Add the annotations to paintor results, one task per chromosome
+  paintor_annotated_locus = PAINTOR_annotatedloci(paintor_annotated_results_channel)
 
   // Interpretation of the PAINTOR results
-  statistics = RESULTS_statistics(paintor.collect(), annotated_bed.collect(), params.annotationsFile,params.chromosome_header)
+  statistics = RESULTS_statistics(paintor.collect(sort: true), annotated_bed.collect(sort: true), params.annotationsFile,params.chromosome_header)
 
   snps = RESULTS_posteriorprob(paintor_annotated_locus.collect(), params.snp, params.pp_threshold)
  
@@ -292,7 +404,7 @@ workflow {
 
   ld_matrix_channel = ld_matrix_processed.flatten()
   ld_matrix_channel
-    .filter { it -> it.toString().endsWith('.ld_out.ld.filtered') }
+    .filter { it -> it.toString().endsWith('.ld_out.ld.filtered') || it.toString().endsWith('.ld_out.ld.filtered.npy') || it.toString().endsWith('.ld_out.ld.filtered.npz') }
     .map { it ->
            a = it.toString().split('/')
            l = a.length
@@ -305,8 +417,12 @@ workflow {
     .map{ id, res, ld, allannots -> [res, ld, allannots] }
     .set{ canvis_channel }
 
-  //Run Canvis
-  CANVIS_run(canvis_channel, params.zheader_header)
+  //Run Canvis, one task per locus, or draw all the loci in a single task
+  if (params.canvisMode == "canvis") {
+    CANVIS_run(canvis_channel, params.zheader_header)
+  } else {
+    CANVIS_batch(canvis_channel.flatten().collect(), params.zheader_header)
+  }
   
 
   // Views
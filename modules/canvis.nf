@@ -5,6 +5,7 @@ process CANVIS_run {
     The input parameters include a tuple of paths to the results file, the LD file, 
     and a file containing all annotations; as well as a header for the z-score column. 
     The output is a path to the resulting SVG figure.
+    A binary or sparse LD matrix (.npy or .npz, see ld_matrix.py) is first exported to the text format CANVIS reads.
     '''
 
     publishDir params.outputDir_canvis, mode: 'copy'
@@ -17,11 +18,13 @@ process CANVIS_run {
         path '*fig.svg'
 
     script:
+    ldtext = ld.name.endsWith('.npy') || ld.name.endsWith('.npz') ? ld.baseName : ld.name
     """
+        ${ld.name != ldtext ? "ld_matrix.py --text ${ld} ${ldtext} > ${ldtext}.export.out" : ''}
         CANVIS.py \\
             --locus ${res} \\
             -z ${zheader_header} \\
-            -r ${ld} \\
+            -r ${ldtext} \\
             -a ${allannots} \\
             -t 90 \\
             -o ${res}_fig \\
@@ -30,3 +33,36 @@ process CANVIS_run {
             2> ${res}.err
     """
 }
+
+
+process CANVIS_batch {
+    '''
+    This process draws the figures of all the loci in a single task with the canvis_batch.py script, in place of 
+    one CANVIS_run task per locus (params.canvisMode set to batch). 
+    The input canvisfiles holds the results file, the LD file and the annotations file of every locus, grouped 
+    by locus name by the script, which draws the loci in task.cpus worker processes.
+    The LD matrices (text, binary .npy or sparse .npz) are read by chunks of rows and averaged over blocks of SNPs, so that the 
+    heatmaps have at most params.canvisResolution cells per side: the memory of the task depends on this resolution 
+    and not on the square of the number of SNPs of the loci. 
+    The output is a LOCUS.results.for.canvis_fig.svg figure per locus, like CANVIS_run.
+    '''
+
+    publishDir params.outputDir_canvis, mode: 'copy'
+
+    input:
+        path canvisfiles
+        val zheader_header
+
+    output:
+        path '*fig.svg'
+
+    script:
+    """
+        canvis_batch.py \\
+            -z ${zheader_header} \\
+            -r ${params.canvisResolution} \\
+            -t ${task.cpus} \\
+            ${canvisfiles} \\
+            > canvis_batch.out
+    """
+}
@@ -1,46 +1,19 @@
-process LDCALCULATION_sortlocus {
-    '''
-    This process takes as input a tuple consisting of an identifier (id) and a path to a file 
-    containing locus information (locus). The output of this process is a file with the same 
-    name as the input locus file but with the extension .sorted. The output file contains the 
-    same locus information as the input file but sorted by the second column in ascending order.
-
-    The script section of the process uses the awk command to remove the first line of the input 
-    file (which contains a header) and then pipes the remaining lines to the sort command, which 
-    sorts the lines based on the second column (-k2,2) in ascending order (-n). The output of sort 
-    is then redirected to a temporary file (tmp). Next, the header line is extracted from the input 
-    file and stored in a file called header. Finally, the cat command is used to concatenate the 
-    header file with the tmp file, and the output is redirected to a file with the same name as the 
-    input file but with the extension .sorted.
-    '''
-
-    publishDir params.outputDir_sorted_locus, mode: 'copy'
-
-    input:
-        tuple val(id), path(locus)
-
-    output:
-        path '*.sorted'
-
-    script:
-    """
-        awk 'NR>=2' $locus | sort -k2,2n > tmp 
-        head -1 $locus > header
-        cat header tmp > ${locus}.sorted
-    """
-}
-
 process LDCALCULATION_getVCFandMAPfilesfrom1000GP {
     '''
-    This process downloads VCF files and MAP files from the 1000 Genomes Project based 
-    on the reference genome specified in the input (hg19 or hg38), and creates a text 
-    file (ldFile.txt) containing a list of the downloaded files with their corresponding 
-    chromosome number. The wget command is used to download the files, and the downloaded 
-    files are processed to obtain the chromosome number and file path information, 
-    which are then written to the ld file using the echo command. The wait command is 
-    used to wait for all the download processes to finish before proceeding with the 
-    sorting of the ld file. Finally, the ld file is sorted using the sort command with 
-    the -V option, which sorts the file based on version numbers. 
+    This process fetches the VCF files of the 1000 Genomes Project for the reference genome 
+    specified in the input (hg19 or hg38), one per chromosome, and the panel file of the samples 
+    (mapFile.txt), with the panel_fetch.py script. It writes ldFile.txt, the list of the VCF files 
+    with their chromosome number, sorted by chromosome.
+    The files are downloaded by a pool of params.panelFetchWorkers workers, each download being 
+    retried and resumed where it stopped, and verified (md5 of params.panelChecksums when given, 
+    size announced by the source and bgzip end-of-file block otherwise) before it is used: the 
+    process fails instead of listing a broken file in ldFile.txt.
+    The files are kept in params.panelCacheDir/ref_genome when it is set, and later runs only fetch 
+    what is missing from it (the work directory is used by default). They are fetched from 
+    params.panelMirror instead of the official sources when it is set (a directory, a file:// or 
+    http(s) url holding the same file names).
+    The tabix index of each VCF file is downloaded too (or built once when it is not available), so 
+    that the LD calculation can read the loci regions without decompressing the whole file.
     The resulting ldFile.txt is then used in subsequent processes.
     '''
 
@@ -54,47 +27,58 @@ process LDCALCULATION_getVCFandMAPfilesfrom1000GP {
 
     shell:
     '''
-        touch ld
-
-        wget https://ftp.1000genomes.ebi.ac.uk/vol1/ftp/release/20130502/integrated_call_samples_v3.20130502.ALL.panel 
-        mv integrated_call_samples_v3.20130502.ALL.panel mapFile.txt
-        
-        if [ "!{ref_genome}" == "hg19" ]; then
-            for chr in {1..22} 
-            do
-                wget -O ALL.chr${chr}.phase3_shapeit2_mvncall_integrated_v5a.20130502.genotypes.vcf.gz   \\
-                -P 22 https://hgdownload.cse.ucsc.edu/gbdb/hg19/1000Genomes/phase3/ALL.chr${chr}.phase3_shapeit2_mvncall_integrated_v5a.20130502.genotypes.vcf.gz  \\
-                && echo "$chr\t$(readlink -f ALL.chr${chr}.phase3_shapeit2_mvncall_integrated_v5a.20130502.genotypes.vcf.gz)" >> ld &
-            done
-            wait
-
-
-        elif [ "!{ref_genome}" == "hg38" ]; then
-            for chr in {1..22} 
-            do
-                wget -O CCDG_14151_B01_GRM_WGS_2020-08-05_chr${chr}.filtered.shapeit2-duohmm-phased.2504samples.bcftools.vcf.gz \\
-                -P 22 https://web-genobioinfo.toulouse.inrae.fr/~sdjebali/1000Genomes/hg38.vcf.2504sample/CCDG_14151_B01_GRM_WGS_2020-08-05_chr${chr}.filtered.shapeit2-duohmm-phased.2504samples.bcftools.vcf.gz \\
-                && echo "$chr\t$(readlink -f CCDG_14151_B01_GRM_WGS_2020-08-05_chr${chr}.filtered.shapeit2-duohmm-phased.2504samples.bcftools.vcf.gz)" >> ld &
-            done
-            wait
-
-        fi
-
-        sort -V -k1,1 ld > ldFile.txt
+        panel_fetch.py \\
+        --ref_genome !{ref_genome} \\
+        --cache !{params.panelCacheDir ? params.panelCacheDir + "/" + ref_genome : '.'} \\
+        !{params.panelMirror ? "--mirror " + params.panelMirror : ''} \\
+        !{params.panelChecksums ? "--checksums " + params.panelChecksums : ''} \\
+        --workers !{params.panelFetchWorkers}
     '''
 }
 
 
 process LDCALCULATION_calculation {
     '''
-    This process perform the actual calculation of linkage disequilibrium (LD) between SNPs 
-    using the CalcLD_1KG_VCF.py script.
+    This process performs the actual calculation of linkage disequilibrium (LD) between SNPs 
+    for all the loci of one chromosome using the ld_calculation.py script.
+    The loci are the LOCUS.sorted files written by PREPPAINTOR_splitlocus, already sorted by position 
+    (gzipped with params.locusFormat gzip, or the CHRnn.loci file and its CHRnn.loci.idx index of byte 
+    offsets with params.locusFormat indexed).
+    The chromosome VCF is opened once through its tabix index, the genotypes of all the loci 
+    are read in a single pass, restricted to the samples of the population, and the LD matrices 
+    are computed as correlations between the 0/1/2 dosages of the SNPs.
+    When params.panelDir is set, genotypes are read from the packed reference panel store of 
+    panel_store.py in params.panelDir/ref_genome instead, the chromosome being added to the store 
+    the first time it is needed.
+    Z-scores are polarized on the panel alleles (allele swaps and strand flips, ambiguous A/T and 
+    C/G SNPs being removed) and the SNPs repeated at the same position are removed from the 
+    processed file and from both dimensions of the LD matrix before the filtered files are written.
+    With params.locusCap set to ld, the loci with more than params.maxSnpsPerLocus SNPs are pruned by LD 
+    (r2 below params.pruneR2, SNPs taken by decreasing |Z-score|) before their matrix is computed.
+    With params.ldFormat set to npy, the LD matrices are written as LOCUS.ld_out.ld.filtered.npy files, 
+    the packed upper triangle in params.ldDtype (see ld_matrix.py), and only exported as text by the 
+    PAINTOR and CANVIS tasks.
+    With params.ldFormat set to sparse, only the pairs of SNPs at most params.ldWindowKb apart (0 for no limit) with an 
+    r2 of at least params.ldMinR2 are computed, and the LD matrices are written as LOCUS.ld_out.ld.filtered.npz files in 
+    CSR form (see ld_matrix.py), densified only by the tasks that need the whole matrix; the error versus the dense 
+    matrix of the first SNPs of each locus is reported in ld_calculation.chr.out. The LD store is not used in this mode.
+    When params.ldStoreDir is set, the LD matrices go through the persistent LD store of ld_store.py in 
+    params.ldStoreDir/ref_genome/population, shared by the runs: the LD of the SNPs already computed for the loci 
+    of a previous trait is read from it, only the other SNPs are computed, and the store is kept below 
+    params.ldStoreMaxGB by removing its least recently used blocks.
+    Memory is requested from ld_bytes, the predicted size of the largest LD matrix of the chromosome 
+    (from the loci manifest written by PREPPAINTOR_splitlocus), only its band within params.ldWindowKb with the 
+    sparse format.
     '''
 
     publishDir params.outputDir_ld, mode: 'copy'
 
+    memory { 2.GB + new nextflow.util.MemoryUnit(2 * ld_bytes) }
+    // one chromosome per task, which ld_calculation.py processes in a single process
+    cpus 1
+
     input:
-        path sortedlocus
+        tuple val(chr), path(sortedloci), val(ld_bytes)
         path ldFile
         path mapFile
         val population
@@ -104,34 +88,29 @@ process LDCALCULATION_calculation {
         val position_header
 
     output:
-        path "*{.ld_out.ld.filtered,ld_out.processed.filtered}"
+        path "*{.ld_out.ld.filtered,.ld_out.ld.filtered.npy,.ld_out.ld.filtered.npz,ld_out.processed.filtered}"
 
 
     shell:
     '''
-        chr=`awk 'NR==2{print $1}' !{sortedlocus}`
-        ldfile=`awk -v chr=$chr '$1==chr{print $2}' !{ldFile}`
-
-        CalcLD_1KG_VCF.py \\
-        --locus !{sortedlocus} \\
-        --reference $ldfile \\
+        ld_calculation.py \\
+        --reference !{ldFile} \\
         --map_file !{mapFile} \\
         --effect_allele !{effectallele_header} \\
         --alt_allele !{altallele_header} \\
         --population !{population} \\
         --Zhead !{zheader_header} \\
-        --out_name !{sortedlocus}.ld_out \\
         --position !{position_header} \\
-        > CalcLD_1KG_VCF.!{sortedlocus}.out \\
-        2> CalcLD_1KG_VCF.!{sortedlocus}.err
-
-        awk '{if(($1":"$2)!=prevkey){print $0}else{print NR > "redundrows.txt" } prevkey=$1":"$2}' !{sortedlocus}.ld_out.processed > !{sortedlocus}.tmp
-
-        awk -v fileRef=redundrows.txt 'BEGIN{while (getline < fileRef >0){ko[$1-1]=1}} \\
-            ko[NR]!=1{s=""; for(i=1; i<NF; i++){if(ko[i]!=1){s=(s)($i)(" ")}} if(ko[i]!=1){print (s)($i)}}' !{sortedlocus}.ld_out.ld  \\
-                > !{sortedlocus}.tmp2
-        
-        mv !{sortedlocus}.tmp !{sortedlocus}.ld_out.processed.filtered
-        mv !{sortedlocus}.tmp2 !{sortedlocus}.ld_out.ld.filtered
+        --threads !{task.cpus} \\
+        !{params.panelDir ? "--panel " + params.panelDir + "/" + params.ref_genome : ''} \\
+        --ld_format !{params.ldFormat} \\
+        --ld_dtype !{params.ldDtype} \\
+        --ld_window_kb !{params.ldWindowKb} \\
+        --ld_min_r2 !{params.ldMinR2} \\
+        !{params.locusCap == 'ld' ? "--max_snps " + params.maxSnpsPerLocus + " --prune_r2 " + params.pruneR2 : ''} \\
+        !{params.ldStoreDir ? "--ld_store " + params.ldStoreDir + "/" + params.ref_genome + " --ld_store_max_gb " + params.ldStoreMaxGB : ''} \\
+        !{sortedloci} \\
+        > ld_calculation.!{chr}.out \\
+        2> ld_calculation.!{chr}.err
     '''
 }
@@ -22,6 +22,12 @@ process OVERLAPPINGANNOTATIONS_bedfiles {
 
 
 process OVERLAPPINGANNOTATIONS_overlapping {
+    '''
+    This process builds the annotation matrix of each locus BED file with annotations_merge.py, which finds the overlaps
+    with a binary search on the merged intervals of each annotation (read from params.annotationIndexDir when it is set),
+    and checks the resulting $base.coord.over.allannots.txt file with check_simple.sh.
+    '''
+
     publishDir params.outputDir_overlapping, mode: 'copy'
     
     input:
@@ -34,23 +40,11 @@ process OVERLAPPINGANNOTATIONS_overlapping {
     shell:
     '''
         base=`basename !{bedfiles}`
-        cat !{annotations} | while read annid annfile
-        do
-        intersectBed \\
-            -a !{bedfiles} -b $annfile -wao | awk \\
-                'BEGIN{OFS="\\t"} {seen[$1,$2]++; \\
-                if(seen[$1,$2]==1){i++; pos[i]=$1":"$2} if($NF==1){ok[i]=1}} \\
-                END{for(k=1; k<=i; k++){split(pos[k],a,":");\\
-                print a[1], a[2], (ok[k]==1 ? 1 : 0)}}' \\
-                > $base.coord.over.$annid.tsv
-        done
-        s1=`cat !{annotations} | awk '{s=(s)($1)(" ")} END{print s}'`
-        s2=`cat !{annotations} | while read annid annfile; \\
-            do echo $base.coord.over.$annid.tsv ; done | awk '{s=(s)($1)(" ")} END{print s}'`
-        echo $s2 | xargs paste  | awk \\
-            -v s1="$s1" 'BEGIN{OFS="\\t"; \\
-            print s1} {s=""; for(i=3; i<=(NF-3); i+=3){s=(s)($i)(" ")} print (s)($NF)}' \\
-            > $base.coord.over.allannots.txt
+        annotations_merge.py \\
+            --annotations !{annotations} \\
+            !{params.annotationIndexDir ? "--index " + params.annotationIndexDir : ''} \\
+            !{bedfiles} \\
+                > annotations_merge.out
         check_simple.sh $base.coord.over.allannots.txt
     '''
 
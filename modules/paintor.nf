@@ -8,17 +8,26 @@ process PAINTOR_run {
     which are written to the directory specified by params.outputDir_paintor.
 
     The script renames the LD files to have the suffix .ld, and the annotation files to have the suffix .annotations. 
+    Binary and sparse LD matrices (.npy and .npz, see ld_matrix.py) are exported to the text format PAINTOR reads in the task directory. 
     It then runs the PAINTOR command with the specified input and output files, the Z-score header, the name 
     of the LD files, and the annotations file.
+    With params.fineMapper set to finemap, the in-tree finemap.py engine runs instead of the PAINTOR binary, on the 
+    same inputs and with the same outputs: it reads the binary LD matrices directly (no text export) and processes 
+    the loci in task.cpus worker processes. Its configurations have at most params.finemapMaxCausal causal SNPs 
+    (0, the default, for no cap as PAINTOR -mcmc).
+    Memory is requested from ld_bytes, the predicted size of the LD matrices of all the loci (from the loci manifest).
     '''
 
     publishDir params.outputDir_paintor, mode: 'copy'
 
+    memory { 4.GB + new nextflow.util.MemoryUnit(4 * ld_bytes) }
+
     input:
         path ldfiles
         path allannots
         path annotationsfile
         val zheader_header
+        val ld_bytes
 
     output:
         path '*.{results,Values,BayesFactor,out}'
@@ -30,48 +39,195 @@ process PAINTOR_run {
         ls !{allannots} | while read annfile; do str=`echo $annfile | awk '{split($1,a,"."); print a[1]".annotations"}'` ; mv $annfile $str ; done
         ls !{ldfiles} | while read ld ; do \\
             str=`echo $ld | awk '{split($1,a,"."); if($1~/ld_out.ld.filtered/) {print a[1]".ld"} else {print a[1]}}'` ;\\
-                mv $ld $str ; 
+                case $ld in *.npy|*.npz) if [ "!{params.fineMapper}" = "finemap" ]; then mv $ld $str.${ld##*.} ; else ld_matrix.py --text $ld $str ; fi ;; *) mv $ld $str ;; esac ; 
+        done
+        
+        annotationsid=$(awk '{print $1}' !{annotationsfile} | paste -sd ',' )
+
+        if [ "!{params.fineMapper}" = "finemap" ]; then
+            finemap.py \\
+                --input filename.files \\
+                --in . \\
+                --out . \\
+                --Zhead !{zheader_header} \\
+                --LDname ld \\
+                --annotations $annotationsid \\
+                --max_causal !{params.finemapMaxCausal} \\
+                --threads !{task.cpus} \\
+                > PAINTOR.out \\
+                2> PAINTOR.err
+        else
+            PAINTOR \\
+                -input filename.files \\
+                -in . \\
+                -out . \\
+                -Zhead !{zheader_header} \\
+                -LDname ld \\
+                -mcmc  \\
+                -annotations $annotationsid \\
+                > PAINTOR.out \\
+                2> PAINTOR.err
+        fi
+    '''
+}
+
+
+process PAINTOR_shards {
+    '''
+    This process splits the loci into at most nbshards balanced shards for a sharded PAINTOR run (params.paintorShards > 1).
+    The paintor_shards.py script takes the number of SNPs squared of each locus (read from its .processed.filtered file) 
+    as its cost, and assigns the loci from the most to the least expensive to the shard with the lowest total cost.
+    It outputs one shardK.files file per shard, with the names of its loci, used as the PAINTOR -input file of the shard.
+    '''
+
+    input:
+        path ldfiles
+        val nbshards
+
+    output:
+        path 'shard*.files'
+
+    shell:
+    '''
+        paintor_shards.py \\
+            --split !{nbshards} \\
+            !{ldfiles} \\
+                > paintor_shards.out
+    '''
+}
+
+
+process PAINTOR_runshard {
+    '''
+    This process runs PAINTOR like PAINTOR_run, but only on the loci listed in the shardfile (one task per shard, 
+    so that the shards run in parallel on different nodes). All the LD and annotation files are staged (as links), 
+    but only the files of the loci of the shard are used, and only their LD matrices are exported as text.
+    When params.paintorEnrichment is set to the Enrichment.Values file of a first global PAINTOR run, the shards use 
+    these estimates instead of estimating them on their own loci: PAINTOR starts from them (-GAMinitial) with a 
+    single EM iteration (-MI 1, PAINTOR has no option that skips the enrichment update), and PAINTOR_merge publishes 
+    the global file rather than the values written by the shards.
+    With params.fineMapper set to finemap, finemap.py runs instead of PAINTOR, with the enrichment fixed to the 
+    global estimates (--gamma_initial and --max_iter 0, no EM update).
+    The outputs are prefixed with the shard name (shardK.LOCUS.results, shardK.Enrichment.Values, ...) for PAINTOR_merge.
+    Memory is requested from ld_bytes, the predicted size of the LD matrices of the loci of the shard.
+    '''
+
+    memory { 4.GB + new nextflow.util.MemoryUnit(4 * ld_bytes) }
+
+    input:
+        tuple path(shardfile), val(ld_bytes)
+        path ldfiles
+        path allannots
+        path annotationsfile
+        val zheader_header
+
+    output:
+        path 'shard*.{results,Values,BayesFactor,out}'
+
+    shell:
+    '''
+        shard=!{shardfile.baseName}
+
+        # only the loci of the shard are renamed, and only their LD matrices exported as text
+        cat !{shardfile} | while read locus ; do \\
+            mv $locus.*allannots.txt $locus.annotations ;\\
+            mv $locus.*ld_out.processed.filtered $locus ;\\
+            ld=`ls $locus.*ld_out.ld.filtered*` ;\\
+                case $ld in *.npy|*.npz) if [ "!{params.fineMapper}" = "finemap" ]; then mv $ld $locus.ld.${ld##*.} ; else ld_matrix.py --text $ld $locus.ld ; fi ;; *) mv $ld $locus.ld ;; esac ; 
         done
         
         annotationsid=$(awk '{print $1}' !{annotationsfile} | paste -sd ',' )
+        gaminitial=""
+        if [ -n "!{params.paintorEnrichment}" ]; then
+            gaminitial="$(awk 'NR==2{$1=$1; gsub(/ /, ","); print}' !{params.paintorEnrichment})"
+        fi
 
-        PAINTOR \\
-            -input filename.files \\
-            -in . \\
-            -out . \\
-            -Zhead !{zheader_header} \\
-            -LDname ld \\
-            -mcmc  \\
-            -annotations $annotationsid \\
-            > PAINTOR.out \\
-            2> PAINTOR.err
+        if [ "!{params.fineMapper}" = "finemap" ]; then
+            finemap.py \\
+                --input !{shardfile} \\
+                --in . \\
+                --out . \\
+                --Zhead !{zheader_header} \\
+                --LDname ld \\
+                --annotations $annotationsid \\
+                --max_causal !{params.finemapMaxCausal} \\
+                --threads !{task.cpus} \\
+                ${gaminitial:+--gamma_initial $gaminitial --max_iter 0} \\
+                > PAINTOR.out \\
+                2> PAINTOR.err
+        else
+            PAINTOR \\
+                -input !{shardfile} \\
+                -in . \\
+                -out . \\
+                -Zhead !{zheader_header} \\
+                -LDname ld \\
+                -mcmc  \\
+                -annotations $annotationsid \\
+                ${gaminitial:+-GAMinitial $gaminitial -MI 1} \\
+                > PAINTOR.out \\
+                2> PAINTOR.err
+        fi
+
+        cat !{shardfile} | while read locus; do mv $locus.results $shard.$locus.results; done
+        for f in Enrichment.Values Log.BayesFactor LogFile.results PAINTOR.out; do mv $f $shard.$f; done
     '''
 }
 
 
-process PAINTOR_annotatedlocus {
+process PAINTOR_merge {
+    '''
+    This process merges the outputs of the shards into the files of a single PAINTOR run (LOCUS.results, 
+    Enrichment.Values, Log.BayesFactor, LogFile.results and PAINTOR.out), which are written to the directory 
+    specified by params.outputDir_paintor. 
+    The paintor_shards.py script averages the enrichment estimates of the shards weighted by their number of SNPs 
+    (or copies params.paintorEnrichment, with which the shards were run), and sums their log Bayes factors.
     '''
-    This process takes a tuple input containing two paths, locusres and allannots. 
-    The locusres file contains the results of the PAINTOR run for a single locus, and allannots is 
-    a file containing annotations for all loci. The process outputs an annotated file in text format.
 
-    The process uses the paste command to concatenate the two input files into a single output file 
-    with the .annotated suffix. The output file is then published to the directory specified by the 
-    outputDir_annotated_locus parameter using the publishDir directive. The output file has a .txt suffix 
-    in addition to the .annotated suffix.
+    publishDir params.outputDir_paintor, mode: 'copy'
+
+    input:
+        path shardresults
+
+    output:
+        path '*.{results,Values,BayesFactor,out}'
+
+    shell:
+    '''
+        paintor_shards.py \\
+            --merge \\
+            !{params.paintorEnrichment ? "--enrichment " + params.paintorEnrichment : ''} \\
+            !{shardresults} \\
+                > paintor_merge.log
+    '''
+}
+
+
+process PAINTOR_annotatedloci {
+    '''
+    This process takes a tuple input with a chromosome and the PAINTOR results (locusres) and annotation 
+    matrices (allannots) of all its loci, and writes the annotated results of every locus in a single task.
+    For each locus, the locus_annotations.py script concatenates the lines of the two files side by side, tab 
+    separated (as the paste command), into a single output file with the .annotated suffix. The output files 
+    are then published to the directory specified by the outputDir_annotated_locus parameter using the publishDir 
+    directive.
     '''
 
     publishDir params.outputDir_annotated_locus, mode: 'copy'
 
     input:
-        tuple path(locusres), path(allannots)
+        tuple val(chr), path(locusres), path(allannots)
 
 
     output:
-        path '*.{annotated,txt}'
+        path '*.annotated'
 
     shell:
     '''
-        paste !{locusres} !{allannots} > !{locusres}.annotated
+        locus_annotations.py \\
+            --paste \\
+            !{locusres} \\
+            !{allannots} \\
+                > locus_annotations.!{chr}.out
     '''
 }
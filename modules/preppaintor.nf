@@ -16,10 +16,21 @@ process PREPPAINTOR_splitlocus {
     position_header: Column header for the genomic position in the GWAS file
     rsid_header: Column header for the variant identifier
     zheader_header: Column header for the z-score in the locus files
+    params.chunksize: Number of GWAS lines read at once (0 reads the whole file, see main_V2.py --chunksize)
+    params.cacheDir: Persistent directory where the parsed GWAS file is cached, so that runs with other thresholds skip its parsing
+    params.maxSnpsPerLocus: Maximum number of SNPs of a locus (0 means no cap)
+    params.locusCap: pvalue to keep the best SNPs of the loci above the cap here, ld to prune them by LD in LDCALCULATION_calculation
+    clump_panel: [ldFile.txt, mapFile.txt] of the reference panel when params.clumpR2 is above 0, to clump the lead SNPs by LD 
+    (r2 with the samples of params.population) instead of merging fixed windows; empty otherwise
 
     Outputs
     Multiple locus-specific files, generated by the main_V2.py script in the output directory 
     specified by params.outputDir_locus.
+    loci_manifest.tsv, with the number of SNPs, span, predicted LD matrix bytes and PAINTOR cost of each locus, 
+    used to size the memory and CPUs of the LD and PAINTOR tasks.
+    locus_metrics/, with the timers and counters of the run (main.metrics.json) and of each chromosome (CHRnn.metrics.json), 
+    and locus_profile/, with the cProfile and tracemalloc outputs of the reading step and of each chromosome when 
+    params.splitProfile is set.
     
     Script main_V2.py
     The script first creates the output directory if it does not exist. 
@@ -27,6 +38,15 @@ process PREPPAINTOR_splitlocus {
     the input file, column headers, P-value and other thresholds, and output directory. 
     The main_V2.py script is expected to split the input file into locus-specific files based 
     on the provided parameters and write them to the output directory.
+    Chromosomes are split in parallel by task.cpus worker processes, the most expensive chromosomes first.
+    The Z-scores are computed once per chromosome, and the loci are written already sorted by position (LOCUS.sorted), 
+    all the loci of a chromosome at once: one text file per locus, one gzipped file per locus (params.locusFormat gzip) 
+    or a single CHRnn.loci file per chromosome with its CHRnn.loci.idx index of byte offsets (params.locusFormat indexed).
+    With params.locusStoreDir, loci are named by content (CHRnnlocus_start_end_digest) and written to this persistent
+    directory, where the loci that did not change since a previous run are left untouched; the workflow then reads the 
+    loci from the store, so that -resume finds in the cache the tasks of every chromosome whose loci are all unchanged 
+    (the LD, bed and annotation tasks take all the loci of a chromosome). The store only grows, 
+    the loci of the current run being the ones listed in loci_manifest.tsv.
     '''
 
     publishDir '.', mode: 'copy'
@@ -45,12 +65,19 @@ process PREPPAINTOR_splitlocus {
         val position_header
         val rsid_header
         val zheader_header
+        val clump_panel
         
 
     output:
-        path "$params.outputDir_locus/*"
+        path "$params.outputDir_locus/*", emit: loci
+        path "loci_manifest.tsv", emit: manifest
+        path "locus_metrics/*", emit: metrics
+        path "locus_profile/*", emit: profile, optional: true
 
     script:
+    def locus_store = params.locusStoreDir ? file(params.locusStoreDir) : ''
+    def locus_suffix = '.sorted' + (params.locusFormat == 'gzip' ? '.gz' : '')
+    def clump = clump_panel ? "--clump-r2 ${params.clumpR2} --ld-file ${clump_panel[0]} --map-file ${clump_panel[1]} --population ${params.population}" + (params.panelDir ? " --panel ${params.panelDir}/${params.ref_genome}" : '') : ''
     """
         mkdir -p ${params.outputDir_locus}
         main_V2.py \\
@@ -68,6 +95,24 @@ process PREPPAINTOR_splitlocus {
         --kb $kb \\
         --pv-lead $pvalue_lead \\
         --pv-nonlead $pvalue_nonlead \\
-        --od ${params.outputDir_locus}
+        --chunksize ${params.chunksize} \\
+        --threads ${task.cpus} \\
+        ${params.cacheDir ? "--cache-dir ${params.cacheDir}" : ''} \\
+        --max-snps ${params.maxSnpsPerLocus} \\
+        --cap-mode ${params.locusCap} \\
+        ${clump} \\
+        --manifest loci_manifest.tsv \\
+        --locus-format ${params.locusFormat} \\
+        --suffix .sorted \\
+        --log-level ${params.splitLogLevel} \\
+        --metrics locus_metrics \\
+        ${params.splitProfile ? "--profile locus_profile" : ''} \\
+        ${locus_store ? "--locus-names content --od ${locus_store}" : "--od ${params.outputDir_locus}"}
+
+        if [ -n "${locus_store}" ]; then
+            tail -n +2 loci_manifest.tsv | cut -f1 | while read locus; do
+                ln -sf ${locus_store}/\$locus${locus_suffix} ${params.outputDir_locus}/\$locus${locus_suffix}
+            done
+        fi
     """
 }
\ No newline at end of file